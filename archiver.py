@@ -0,0 +1,153 @@
+"""Move old submitted and cancelled tickets into archive tables.
+
+``SubmittedTicket`` and ``CancelledTicket`` rows whose ``entry_time`` is
+older than ``ARCHIVE_RETENTION_DAYS`` are moved, ids unchanged, to
+``SubmittedTicketArchive`` and ``CancelledTicketArchive``. This keeps the
+live tables and their indexes small. Each batch is its own transaction, so
+the job can be interrupted and resumed at any point.
+
+The archive tables can additionally be partitioned by month on MySQL
+(``ticket_partitioning.sql``). Each run then first splits the catch-all
+``pmax`` partition so that monthly partitions exist up to
+``ARCHIVE_PARTITION_MONTHS_AHEAD`` months from now.
+"""
+
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from jobs import Job, JobRegistry, registry
+from logging_config import get_logger
+from models import CancelledTicket, CancelledTicketArchive, SubmittedTicket, SubmittedTicketArchive
+from ticket_transitions import move_tickets
+
+ARCHIVE_RETENTION_DAYS = int(os.environ.get("ARCHIVE_RETENTION_DAYS", "0"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_AT = os.environ.get("ARCHIVE_AT", "03:00")
+ARCHIVE_PARTITION_MONTHS_AHEAD = int(os.environ.get("ARCHIVE_PARTITION_MONTHS_AHEAD", "3"))
+MONTH_PARTITION_PATTERN = re.compile(r"^p(\d{4})(\d{2})$")
+ARCHIVE_TABLES = (
+    (SubmittedTicket, SubmittedTicketArchive),
+    (CancelledTicket, CancelledTicketArchive),
+)
+
+log = get_logger("archive")
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _month_partitions(db: Session, table: str) -> Optional[List[str]]:
+    """Partition names of *table*, or None when it is not partitioned."""
+
+    rows = db.execute(
+        text(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL"
+        ),
+        {"table": table},
+    ).scalars().all()
+    return list(rows) or None
+
+
+def extend_partitions(
+    session_factory: Callable[[], Session],
+    months_ahead: int = ARCHIVE_PARTITION_MONTHS_AHEAD,
+    today: Optional[date] = None,
+) -> Dict[str, List[str]]:
+    """Split ``pmax`` of each partitioned archive table into the missing monthly partitions.
+
+    Partitions are added after the newest ``pYYYYMM`` one up to the month
+    *months_ahead* from *today*. Does nothing on other databases or on tables
+    that are not partitioned. Returns the added partition names per table.
+    """
+
+    added: Dict[str, List[str]] = {}
+    db = session_factory()
+    try:
+        if db.get_bind().dialect.name != "mysql" or months_ahead < 0:
+            return added
+        today = today or date.today()
+        last_month = date(today.year, today.month, 1)
+        for _ in range(months_ahead):
+            last_month = _next_month(last_month)
+
+        for _, target in ARCHIVE_TABLES:
+            table = target.__tablename__
+            partitions = _month_partitions(db, table)
+            if not partitions or "pmax" not in partitions:
+                continue
+            months = [
+                date(int(match.group(1)), int(match.group(2)), 1)
+                for match in map(MONTH_PARTITION_PATTERN.match, partitions)
+                if match
+            ]
+            month = _next_month(max(months)) if months else date(today.year, today.month, 1)
+            definitions = []
+            names = []
+            while month <= last_month:
+                name = f"p{month:%Y%m}"
+                bound = _next_month(month)
+                definitions.append(f"PARTITION {name} VALUES LESS THAN (TO_DAYS('{bound:%Y-%m-%d}'))")
+                names.append(name)
+                month = bound
+            if not names:
+                continue
+            definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+            # DDL commits implicitly; rows already in pmax for these months are moved.
+            db.execute(text(f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO ({', '.join(definitions)})"))
+            added[table] = names
+            log.info("Added partitions to %s", table, extra={"partitions": names})
+    finally:
+        db.close()
+    return added
+
+
+def archive_old_tickets(
+    session_factory: Callable[[], Session],
+    retention_days: int = ARCHIVE_RETENTION_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    job: Optional[Job] = None,
+    jobs: JobRegistry = registry,
+) -> dict:
+    """Archive rows with an ``entry_time`` older than *retention_days*. Returns moved counts per table."""
+
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    summary = {"cutoff": cutoff.isoformat(), "moved": {}}
+    try:
+        summary["partitions_added"] = extend_partitions(session_factory)
+    except Exception as exc:
+        # Rows still land in pmax; archiving itself is unaffected.
+        log.error("Failed to extend the archive partitions: %s", exc)
+    for source, target in ARCHIVE_TABLES:
+        moved = 0
+        db = session_factory()
+        try:
+            while True:
+                ids = [
+                    row.id
+                    for row in db.query(source.id)
+                    .filter(source.entry_time < cutoff)
+                    .order_by(source.id)
+                    .limit(batch_size)
+                ]
+                if not ids:
+                    break
+                moved += move_tickets(db, ids, source, target, keep_ids=True)
+                db.commit()
+                summary["moved"][source.__tablename__] = moved
+                if job is not None:
+                    jobs.update(job, **summary)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        summary["moved"][source.__tablename__] = moved
+        log.info("Archived %d rows of %s", moved, source.__tablename__, extra={"cutoff": summary["cutoff"]})
+    return summary
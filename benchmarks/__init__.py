@@ -0,0 +1 @@
+"""Load and micro-benchmarks for the ticket server. See ``benchmarks/run.py``."""
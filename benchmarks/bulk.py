@@ -0,0 +1,112 @@
+"""Bulk submission benchmark against the local fake Parkonic API."""
+
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from benchmarks.common import latency_summary
+from benchmarks.fake_parkonic import FakeParkonic
+
+
+def _seed(count: int, image_kb: int) -> List[int]:
+    """Create *count* finished short tickets with images on disk."""
+
+    import main
+    from models import Ticket
+
+    rng = random.Random(22)
+    image = rng.randbytes(image_kb * 1024)
+    db = main.SessionLocal()
+    try:
+        ids = []
+        start = datetime(2026, 10, 16, 8, 0, 0)
+        for index in range(count):
+            car = os.path.join(main.CAR_IMAGE_DIR, f"bulk-car-{index}.jpg")
+            entry = os.path.join(main.ENTRY_IMAGE_DIR, f"bulk-in-{index}.jpg")
+            for path in (car, entry):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(image)
+            entry_time = start + timedelta(minutes=index)
+            ticket = Ticket(
+                token="bench",
+                access_point_id=8000,
+                spot_number=index,
+                number=f"{index:05d}",
+                code="A",
+                city="DXB",
+                status="pending",
+                entry_time=entry_time,
+                exit_time=entry_time + timedelta(minutes=20),
+                entry_pic_base64=entry,
+                car_pic=car,
+            )
+            db.add(ticket)
+            db.flush()
+            ids.append(ticket.id)
+        db.commit()
+        return ids
+    finally:
+        db.close()
+
+
+def run(
+    tickets: int = 200,
+    concurrency: int = 8,
+    latency: float = 0.02,
+    image_kb: int = 60,
+) -> dict:
+    """Submit *tickets* through the submission outbox with *concurrency* workers and no rate limit."""
+
+    import bulk_submit
+    import main
+    import parking_api
+    from submission_outbox import SubmissionWorkers
+
+    ids = _seed(tickets, image_kb)
+    fake = FakeParkonic(latency=latency).start()
+    original_base_url = parking_api.client.base_url
+    parking_api.client.base_url = fake.base_url
+    latencies: List[float] = []
+    started_at: Dict[int, float] = {}
+
+    class _TimedSubmission(main.ParkonicSubmission):
+        def park_in(self, ticket):
+            started_at[ticket.id] = time.perf_counter()
+            return super().park_in(ticket)
+
+        def completed(self, ticket_id, spot):
+            super().completed(ticket_id, spot)
+            began = started_at.pop(ticket_id, None)
+            if began is not None:
+                latencies.append(time.perf_counter() - began)
+
+    workers = SubmissionWorkers(
+        main.SessionLocal, _TimedSubmission(), workers=concurrency, poll_seconds=0.05, rate_limit=0
+    )
+    try:
+        job = bulk_submit.registry.create("bulk_submission", reason="benchmark")
+        started = time.perf_counter()
+        bulk_submit.enqueue_many(main.SessionLocal, ids)
+        workers.start()
+        counts = bulk_submit.follow_submissions(main.SessionLocal, ids, job, poll_seconds=0.05)
+        elapsed = time.perf_counter() - started
+    finally:
+        workers.stop()
+        parking_api.client.base_url = original_base_url
+        fake.stop()
+
+    metrics = latency_summary(latencies, elapsed)
+    metrics.update(
+        succeeded=counts["succeeded"],
+        failed=counts["failed"],
+        upstream_requests=fake.requests,
+        upstream_bytes=fake.bytes_received,
+    )
+    return {
+        "name": "bulk.outbox_submission",
+        "params": {"tickets": tickets, "concurrency": concurrency, "upstream_latency_s": latency, "image_kb": image_kb},
+        "metrics": metrics,
+    }
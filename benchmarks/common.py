@@ -0,0 +1,122 @@
+"""Shared setup and reporting for the benchmarks.
+
+:func:`setup_environment` must run before ``main`` is imported: it points
+the server at a throwaway SQLite database and temporary media directories
+unless ``DATABASE_URL`` (e.g. a disposable MySQL schema) and the directory
+variables are already set.
+"""
+
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_environment(workdir: Optional[str] = None) -> str:
+    """Configure a disposable database and media directories; returns the work dir."""
+
+    workdir = workdir or tempfile.mkdtemp(prefix="ticketserver-bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}")
+    os.environ.setdefault("ENTRY_IMAGE_DIR", os.path.join(workdir, "entry_images"))
+    os.environ.setdefault("CAR_IMAGE_DIR", os.path.join(workdir, "car_images"))
+    os.environ.setdefault("EXIT_VIDEO_DIR", os.path.join(workdir, "exit_video"))
+    os.environ.setdefault("ENCODED_IMAGE_CACHE_DIR", os.path.join(workdir, "b64"))
+    # Keep benchmark output readable; the logger still does its work.
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return workdir
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of *samples*."""
+
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(samples: List[float], elapsed: Optional[float] = None) -> Dict[str, float]:
+    """Summarise per-operation latencies in seconds."""
+
+    summary = {
+        "count": len(samples),
+        "mean_s": statistics.fmean(samples) if samples else float("nan"),
+        "p50_s": percentile(samples, 50),
+        "p95_s": percentile(samples, 95),
+        "p99_s": percentile(samples, 99),
+        "max_s": max(samples) if samples else float("nan"),
+    }
+    if elapsed:
+        summary["throughput_per_s"] = len(samples) / elapsed
+    return summary
+
+
+def time_calls(fn, repeat: int = 5, number: int = 1000) -> Dict[str, float]:
+    """Best-of-*repeat* timing of *number* calls to *fn*, per call."""
+
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - started) / number)
+    return {"best_s": min(runs), "median_s": statistics.median(runs), "calls": number, "repeat": repeat}
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results: Iterable[dict], output: Optional[str] = None) -> dict:
+    """Emit *results* as one JSON document, to *output* or stdout."""
+
+    document = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": os.environ.get("DATABASE_URL", "").split("@")[-1],
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": list(results),
+    }
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return document
+
+
+def compare(baseline_path: str, current: dict) -> List[str]:
+    """Describe how *current* results differ from a saved baseline document."""
+
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["name"]: r["metrics"] for r in json.load(f)["results"]}
+    lines = []
+    for result in current["results"]:
+        before = baseline.get(result["name"])
+        if before is None:
+            continue
+        for key, value in sorted(result["metrics"].items()):
+            old = before.get(key)
+            if key in ("calls", "repeat", "count"):
+                continue
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                lines.append(f"{result['name']}.{key}: {old:.6g} -> {value:.6g} ({value / old:.2f}x)")
+    return lines
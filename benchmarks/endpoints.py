@@ -0,0 +1,188 @@
+"""Endpoint benchmarks: ``POST /ticket`` under camera traffic and list pagination.
+
+Requests go to the app in-process through ``httpx.ASGITransport`` unless a
+``base_url`` of a running server is given.
+"""
+
+import asyncio
+import base64
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+
+import httpx
+
+from benchmarks.common import latency_summary
+
+# Spots used by the listing benchmark; kept apart from the ingest traffic.
+LISTING_ACCESS_POINT = 9000
+
+
+def client(base_url: Optional[str] = None, timeout: float = 60.0) -> httpx.AsyncClient:
+    if base_url:
+        return httpx.AsyncClient(base_url=base_url, timeout=timeout)
+    import main
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=timeout)
+
+
+def _plate(rng: random.Random) -> str:
+    return "".join(rng.choice("0123456789") for _ in range(5))
+
+
+def _misread(rng: random.Random, plate: str) -> str:
+    position = rng.randrange(len(plate))
+    return plate[:position] + rng.choice("0123456789") + plate[position + 1 :]
+
+
+def camera_traffic(
+    events: int,
+    spots: int = 200,
+    access_points: int = 10,
+    image_kb: int = 60,
+    new_car_rate: float = 0.3,
+    misread_rate: float = 0.1,
+    seed: int = 20,
+) -> Iterator[dict]:
+    """Yield synthetic camera events.
+
+    Each event reports the car currently seen on a random spot. With
+    *new_car_rate* a new car has arrived; with *misread_rate* the plate is
+    read with one wrong character; otherwise it repeats the last reading.
+    This exercises the updated, similar-plate and created ingest paths.
+    """
+
+    rng = random.Random(seed)
+    image = "data:image/jpeg;base64," + base64.b64encode(rng.randbytes(image_kb * 1024)).decode()
+    parked = {}
+    clock = datetime(2026, 10, 17, 6, 0, 0)
+    for _ in range(events):
+        clock += timedelta(seconds=rng.randint(1, 5))
+        spot = (rng.randint(1, access_points), rng.randint(1, spots))
+        plate = parked.get(spot)
+        if plate is None or rng.random() < new_car_rate:
+            plate = parked[spot] = _plate(rng)
+        reading = _misread(rng, plate) if rng.random() < misread_rate else plate
+        yield {
+            "token": "bench",
+            "access_point_id": spot[0],
+            "spot_number": spot[1],
+            "number": reading,
+            "code": rng.choice("ABCDEFG"),
+            "city": "DXB",
+            "entry_time": clock.isoformat(),
+            "entry_pic_base64": image,
+            "car_pic_base64": image,
+        }
+
+
+async def _drive(http: httpx.AsyncClient, requests: List[dict], concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    queue = iter(requests)
+
+    async def _worker() -> None:
+        nonlocal errors
+        for request in queue:
+            started = time.perf_counter()
+            response = await http.request(**request)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    metrics = latency_summary(latencies, elapsed)
+    metrics["errors"] = errors
+    return metrics
+
+
+async def ingest(
+    events: int = 2000,
+    concurrency: int = 16,
+    image_kb: int = 60,
+    base_url: Optional[str] = None,
+) -> dict:
+    """Throughput and latency of ``POST /ticket``."""
+
+    requests = [
+        {"method": "POST", "url": "/ticket", "json": event}
+        for event in camera_traffic(events, image_kb=image_kb)
+    ]
+    async with client(base_url) as http:
+        metrics = await _drive(http, requests, concurrency)
+    return {
+        "name": "endpoint.post_ticket",
+        "params": {"events": events, "concurrency": concurrency, "image_kb": image_kb},
+        "metrics": metrics,
+    }
+
+
+def seed_tickets(count: int, batch: int = 5000) -> None:
+    """Insert *count* tickets straight into the database for the listing benchmark."""
+
+    from database import SessionLocal
+    from models import Ticket
+
+    rng = random.Random(21)
+    start = datetime(2026, 1, 1)
+    db = SessionLocal()
+    try:
+        for offset in range(0, count, batch):
+            rows = [
+                {
+                    "token": "bench",
+                    "access_point_id": LISTING_ACCESS_POINT,
+                    "spot_number": index % 500,
+                    "number": _plate(rng),
+                    "code": "A",
+                    "city": "DXB",
+                    "status": "pending",
+                    "entry_time": start + timedelta(minutes=index),
+                    "entry_pic_base64": f"{index}.jpg",
+                    "car_pic": f"{index}.jpg",
+                }
+                for index in range(offset, min(count, offset + batch))
+            ]
+            db.execute(Ticket.__table__.insert(), rows)
+            db.commit()
+    finally:
+        db.close()
+
+
+async def listing(
+    rows: int = 50000,
+    page_size: int = 50,
+    depths=(1, 100, 500),
+    samples: int = 20,
+    base_url: Optional[str] = None,
+    seed: bool = True,
+) -> List[dict]:
+    """Latency of ``GET /tickets/`` at increasing depth, by page number and by cursor."""
+
+    if seed and not base_url:
+        seed_tickets(rows)
+
+    results = []
+    async with client(base_url) as http:
+        for depth in depths:
+            by_page = [{"method": "GET", "url": "/tickets/", "params": {"page": depth, "page_size": page_size}}]
+            probe = await http.get("/tickets/", params={"page": max(depth - 1, 1), "page_size": page_size})
+            cursor = probe.headers.get("x-next-cursor") if depth > 1 else None
+            by_cursor = [
+                {"method": "GET", "url": "/tickets/", "params": {"cursor": cursor, "page_size": page_size}}
+                if cursor
+                else by_page[0]
+            ]
+            for mode, request in (("page", by_page), ("cursor", by_cursor)):
+                metrics = await _drive(http, request * samples, 1)
+                results.append(
+                    {
+                        "name": f"endpoint.list_tickets.{mode}.depth_{depth}",
+                        "params": {"rows": rows, "page_size": page_size, "depth": depth},
+                        "metrics": metrics,
+                    }
+                )
+    return results
@@ -0,0 +1,100 @@
+"""Local stand-in for the Parkonic API.
+
+Answers ``POST .../park-in`` with a fresh ``trip_id`` and ``POST .../park-out``
+with a success body, after an optional delay and with an optional failure
+rate. Run it on its own with::
+
+    python -m benchmarks.fake_parkonic --port 8099 --latency 0.05
+
+and point the server at it with ``PARKONIC_BASE_URL=http://127.0.0.1:8099``.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+class FakeParkonic:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, failure_rate: float = 0.0) -> None:
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.bytes_received = 0
+        self._trip_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                with fake._lock:
+                    fake.requests += 1
+                    fake.bytes_received += len(body)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if random.random() < fake.failure_rate:
+                    self._reply(503, {"error": "unavailable"})
+                elif self.path.endswith("/park-in"):
+                    self._reply(200, {"trip_id": next(fake._trip_ids)})
+                else:
+                    self._reply(200, {"status": "ok"})
+
+            def _reply(self, status: int, payload: dict) -> None:
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeParkonic":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-parkonic", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    fake = FakeParkonic(args.host, args.port, args.latency, args.failure_rate)
+    print(f"Fake Parkonic listening on {fake.base_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
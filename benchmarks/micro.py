@@ -0,0 +1,60 @@
+"""Micro-benchmarks of the per-event helpers on the ingest and media paths."""
+
+import base64
+import os
+import random
+from typing import List
+
+from benchmarks.common import time_calls
+
+
+def _plates(rng: random.Random, count: int) -> List[str]:
+    return ["".join(rng.choice("0123456789") for _ in range(rng.randint(4, 6))) for _ in range(count)]
+
+
+def run(workdir: str, number: int = 2000, image_kb: int = 150) -> List[dict]:
+    import main
+    import media
+
+    rng = random.Random(20)
+    results = []
+
+    plates = _plates(rng, 256)
+    pairs = [(plates[i], plates[(i * 7 + 3) % len(plates)]) for i in range(len(plates))]
+    index = iter(range(1 << 62))
+
+    def _similarity():
+        a, b = pairs[next(index) % len(pairs)]
+        main.plate_similarity_strict(a, b)
+
+    results.append({"name": "micro.plate_similarity_strict", "metrics": time_calls(_similarity, number=number)})
+
+    image = "data:image/jpeg;base64," + base64.b64encode(rng.randbytes(image_kb * 1024)).decode()
+    target = os.path.join(workdir, "micro_images", "snapshot.jpg")
+
+    def _save():
+        main.save_base64_jpg(image, target)
+
+    results.append(
+        {
+            "name": "micro.save_base64_jpg",
+            "params": {"image_kb": image_kb},
+            "metrics": time_calls(_save, number=max(1, number // 20)),
+        }
+    )
+
+    base_dir = main.ENTRY_IMAGE_DIR
+    base_name = os.path.basename(os.path.normpath(base_dir))
+    paths = [
+        "3f2a9c1e-0d4b-4c55-9a1e-7b6f0c2d8e11.jpg",
+        f"{base_name}/3f2a9c1e-0d4b-4c55-9a1e-7b6f0c2d8e11.jpg",
+        f"\\{base_name}\\3f2a9c1e-0d4b-4c55-9a1e-7b6f0c2d8e11.jpg",
+        os.path.join(base_dir, "3f2a9c1e-0d4b-4c55-9a1e-7b6f0c2d8e11.jpg"),
+        "C:\\images\\3f2a9c1e-0d4b-4c55-9a1e-7b6f0c2d8e11.jpg",
+    ]
+
+    def _resolve():
+        media.resolve_relative_path(paths[next(index) % len(paths)], base_dir)
+
+    results.append({"name": "micro.resolve_relative_path", "metrics": time_calls(_resolve, number=number)})
+    return results
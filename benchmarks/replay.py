@@ -0,0 +1,203 @@
+"""Replay a traffic capture (see ``traffic_capture.py``) against a server.
+
+Requests are sent on the recorded schedule compressed by ``--speed`` (``10``
+replays an hour of traffic in six minutes; ``0`` sends as fast as the
+workers allow), by ``--concurrency`` workers. Captures of several server
+workers (one file per process) are merged by timestamp. Images that were
+referenced are read back from ``<capture>.images``; stripped or missing ones
+are replaced with random bytes of the recorded size.
+
+Besides request latency the report includes the schedule lag: how late
+requests were sent because every worker was busy. A lag that keeps growing
+means the server cannot sustain that multiple of the recorded load.
+
+Examples::
+
+    python -m benchmarks.replay capture.*.jsonl.gz --speed 5 --concurrency 32
+    python -m benchmarks.replay capture.jsonl --url http://127.0.0.1:8000 --output replay.json
+
+Replay into a throwaway database: the requests create and update tickets.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from benchmarks import common
+
+IMAGE_FIELDS = ("entry_pic_base64", "car_pic_base64")
+
+
+class ImageSource:
+    """Turns recorded image entries back into request payloads."""
+
+    def __init__(self, image_dir: Optional[str]) -> None:
+        self.image_dir = image_dir
+        self._random = random.Random(21)
+        self._cache: Dict[Tuple[str, int], bytes] = {}
+
+    def data(self, entry: dict) -> bytes:
+        digest = entry.get("sha256")
+        size = int(entry.get("bytes", 0))
+        key = (digest or "", size)
+        if key not in self._cache:
+            path = os.path.join(self.image_dir, f"{digest}.jpg") if digest and self.image_dir else None
+            if path and os.path.exists(path):
+                with open(path, "rb") as f:
+                    self._cache[key] = f.read()
+            else:
+                self._cache[key] = self._random.randbytes(size)
+        return self._cache[key]
+
+    def base64(self, value):
+        if not isinstance(value, dict):
+            return value
+        return "data:image/jpeg;base64," + base64.b64encode(self.data(value)).decode()
+
+    def ticket(self, ticket: dict) -> dict:
+        ticket = dict(ticket)
+        for field in IMAGE_FIELDS:
+            if field in ticket:
+                ticket[field] = self.base64(ticket[field])
+        return ticket
+
+
+def load(path: str, images: ImageSource, limit: Optional[int] = None) -> Iterator[Tuple[float, str, dict]]:
+    """Yield ``(timestamp, endpoint, httpx request kwargs)`` for each recorded request."""
+
+    from traffic_capture import open_log
+
+    with open_log(path, "r") as f:
+        for count, line in enumerate(f):
+            if limit is not None and count >= limit:
+                return
+            entry = json.loads(line)
+            endpoint = entry["endpoint"]
+            if endpoint == "ticket":
+                request = {"method": "POST", "url": "/ticket", "json": images.ticket(entry["ticket"])}
+            elif endpoint == "batch":
+                request = {
+                    "method": "POST",
+                    "url": "/tickets/batch",
+                    "json": [images.ticket(ticket) for ticket in entry["tickets"]],
+                }
+            elif endpoint == "multipart":
+                sizes = entry.get("image_bytes") or {}
+                request = {
+                    "method": "POST",
+                    "url": "/ticket/multipart",
+                    "data": {"ticket": json.dumps(entry["ticket"])},
+                    "files": {
+                        name: (f"{name}.jpg", images.data({"bytes": sizes.get(name) or 0}), "image/jpeg")
+                        for name in ("entry_pic", "car_pic")
+                    },
+                }
+            else:
+                continue
+            yield entry["ts"], endpoint, request
+
+
+async def replay(
+    requests: List[Tuple[float, str, dict]],
+    speed: float,
+    concurrency: int,
+    base_url: Optional[str] = None,
+) -> List[dict]:
+    from benchmarks.endpoints import client
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lags: List[float] = []
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+
+    async def _worker(http) -> None:
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            scheduled, endpoint, request = item
+            started = time.perf_counter()
+            lags.append(max(0.0, started - scheduled))
+            try:
+                response = await http.request(**request)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            latencies[endpoint].append(time.perf_counter() - started)
+            if failed:
+                errors[endpoint] += 1
+
+    async with client(base_url) as http:
+        workers = [asyncio.create_task(_worker(http)) for _ in range(concurrency)]
+        first = requests[0][0] if requests else 0.0
+        began = time.perf_counter()
+        for recorded, endpoint, request in requests:
+            scheduled = began + ((recorded - first) / speed if speed > 0 else 0.0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await pending.put((scheduled, endpoint, request))
+        for _ in workers:
+            await pending.put(None)
+        await asyncio.gather(*workers)
+        elapsed = time.perf_counter() - began
+
+    recorded_span = requests[-1][0] - first if requests else 0.0
+    params = {"requests": len(requests), "speed": speed, "concurrency": concurrency, "recorded_span_s": recorded_span}
+    results = []
+    for endpoint, samples in sorted(latencies.items()):
+        metrics = common.latency_summary(samples, elapsed)
+        metrics["errors"] = errors[endpoint]
+        results.append({"name": f"replay.{endpoint}", "params": params, "metrics": metrics})
+    lag = common.latency_summary(lags)
+    results.append(
+        {
+            "name": "replay.schedule_lag",
+            "params": params,
+            "metrics": {"p50_s": lag["p50_s"], "p99_s": lag["p99_s"], "max_s": lag["max_s"], "elapsed_s": elapsed},
+        }
+    )
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", nargs="+", help="files written with TRAFFIC_CAPTURE_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="multiple of real time; 0 sends without pauses")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--url", help="base URL of a running server (default: the app in-process)")
+    parser.add_argument("--workdir", help="directory for the in-process SQLite database and media")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="print ratios against an earlier --output file")
+    args = parser.parse_args(argv)
+
+    common.setup_environment(args.workdir)
+    # Payloads are built up front so encoding them does not count against the server.
+    requests = []
+    for capture in args.capture:
+        image_dir = f"{capture}.images"
+        images = ImageSource(image_dir if os.path.isdir(image_dir) else None)
+        requests.extend(load(capture, images, args.limit))
+    requests.sort(key=lambda request: request[0])
+    requests = requests[: args.limit]
+    if not requests:
+        parser.error("the capture holds no replayable requests")
+
+    results = asyncio.run(replay(requests, args.speed, max(1, args.concurrency), args.url))
+    document = common.report(results, args.output)
+    if args.compare:
+        for line in common.compare(args.compare, document):
+            print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
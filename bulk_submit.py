@@ -0,0 +1,164 @@
+"""Submission of many tickets through the durable outbox (``submission_outbox``).
+
+The tickets are queued as outbox jobs before anything else happens, so a
+crash loses no progress and a ticket already being worked is not submitted
+twice. The outbox workers then make the Parkonic calls; a bulk run only
+follows their jobs and reports progress on a :class:`jobs.Job`.
+"""
+
+import contextvars
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import Session
+
+import submission_outbox
+from jobs import Job, JobRegistry, registry
+from logging_config import get_logger, request_id
+from models import SubmissionJob, Ticket
+
+ENQUEUE_CHUNK_SIZE = 500
+# Seconds between checks of the outbox jobs of a bulk run.
+BULK_POLL_SECONDS = 2.0
+
+log = get_logger("submit")
+
+
+def _duration_seconds(dialect: str):
+    """SQL expression for ``exit_time - entry_time`` in seconds."""
+
+    if dialect == "sqlite":
+        return (func.julianday(Ticket.exit_time) - func.julianday(Ticket.entry_time)) * 86400
+    if dialect == "postgresql":
+        return func.extract("epoch", Ticket.exit_time - Ticket.entry_time)
+    return func.timestampdiff(literal_column("SECOND"), Ticket.entry_time, Ticket.exit_time)
+
+
+def select_short_ticket_ids(
+    db: Session,
+    max_seconds: int = 3600,
+    min_seconds: Optional[int] = 0,
+    entry_from: Optional[datetime] = None,
+    entry_to: Optional[datetime] = None,
+) -> List[int]:
+    """Return ids of finished tickets whose stay is shorter than *max_seconds*.
+
+    The duration is computed by the database so only matching ids are loaded.
+    ``min_seconds=None`` also accepts tickets whose exit precedes their entry.
+    """
+
+    duration = _duration_seconds(db.get_bind().dialect.name)
+    query = db.query(Ticket.id).filter(
+        Ticket.entry_time != None,
+        Ticket.exit_time != None,
+        duration < max_seconds,
+    )
+    if min_seconds is not None:
+        query = query.filter(duration >= min_seconds)
+    if entry_from is not None:
+        query = query.filter(Ticket.entry_time >= entry_from)
+    if entry_to is not None:
+        query = query.filter(Ticket.entry_time < entry_to)
+    return [row.id for row in query.order_by(Ticket.id)]
+
+
+def enqueue_many(session_factory: Callable[[], Session], ticket_ids: Iterable[int]) -> List[int]:
+    """Queue an outbox job for every id, committing in chunks. Returns the ids."""
+
+    ids = list(ticket_ids)
+    db = session_factory()
+    try:
+        for start in range(0, len(ids), ENQUEUE_CHUNK_SIZE):
+            for ticket_id in ids[start:start + ENQUEUE_CHUNK_SIZE]:
+                submission_outbox.enqueue(db, ticket_id)
+            db.commit()
+    finally:
+        db.close()
+    return ids
+
+
+def follow_submissions(
+    session_factory: Callable[[], Session],
+    ticket_ids: List[int],
+    job: Job,
+    jobs: JobRegistry = registry,
+    poll_seconds: float = BULK_POLL_SECONDS,
+) -> dict:
+    """Record the progress of the outbox jobs of *ticket_ids* on *job* until all finish.
+
+    ``job.info["tickets"]`` maps each ticket id to ``"pending"``,
+    ``"submitted"`` or the last error of its failed job.
+    """
+
+    counts = {"total": len(ticket_ids), "done": 0, "succeeded": 0, "failed": 0}
+    statuses: Dict[int, str] = {tid: "pending" for tid in ticket_ids}
+    remaining = set(ticket_ids)
+    jobs.update(job, tickets=statuses, **counts)
+    jobs.mark_running(job)
+
+    while remaining:
+        db = session_factory()
+        try:
+            pending = sorted(remaining)
+            for start in range(0, len(pending), ENQUEUE_CHUNK_SIZE):
+                rows = db.query(SubmissionJob.ticket_id, SubmissionJob.state, SubmissionJob.last_error).filter(
+                    SubmissionJob.ticket_id.in_(pending[start:start + ENQUEUE_CHUNK_SIZE])
+                )
+                for ticket_id, state, last_error in rows:
+                    if state == submission_outbox.PENDING:
+                        continue
+                    remaining.discard(ticket_id)
+                    succeeded = state == submission_outbox.DONE
+                    statuses[ticket_id] = "submitted" if succeeded else (last_error or state)
+                    counts["done"] += 1
+                    counts["succeeded" if succeeded else "failed"] += 1
+        finally:
+            db.close()
+        jobs.update(job, **counts)
+        if remaining:
+            time.sleep(poll_seconds)
+
+    jobs.mark_done(job, dict(counts))
+    return counts
+
+
+def start_bulk_submission(
+    session_factory: Callable[[], Session],
+    ticket_ids: List[int],
+    reason: str,
+    wake: Optional[Callable[[], None]] = None,
+    jobs: JobRegistry = registry,
+    wait: bool = False,
+) -> Job:
+    """Queue *ticket_ids* in the outbox and return a job following their submission.
+
+    The outbox jobs are committed before this returns. Their progress is
+    followed in a background thread, or in the calling thread with
+    ``wait=True``. *wake* tells idle outbox workers that jobs were queued.
+    """
+
+    job = jobs.create("bulk_submission", reason=reason)
+    ids = enqueue_many(session_factory, ticket_ids)
+    if wake is not None:
+        wake()
+
+    def _run() -> None:
+        if request_id.get() is None:
+            request_id.set(f"job-{job.id[:8]}")
+        try:
+            follow_submissions(session_factory, ids, job, jobs=jobs)
+        except Exception as exc:
+            log.exception("Bulk submission %s failed", job.id)
+            jobs.mark_failed(job, str(exc))
+        else:
+            log.info("Bulk submission finished", extra={"job_id": job.id, "reason": reason, **job.result})
+
+    context = contextvars.copy_context()
+    if wait:
+        context.run(_run)
+    else:
+        threading.Thread(target=context.run, args=(_run,), name=f"bulk-submit-{job.id[:8]}", daemon=True).start()
+    return job
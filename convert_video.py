@@ -1,19 +1,40 @@
+import contextvars
 import os
 import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
 
+from jobs import Job, JobRegistry, registry
+from logging_config import get_logger
+from metrics import FFMPEG_SECONDS
 
-def make_browser_friendly(input_path: str) -> str:
+CPU_COUNT = os.cpu_count() or 2
+# libx264 is itself multi-threaded, so by default run one conversion per two
+# cores and give each ffmpeg process an equal share of the machine.
+VIDEO_CONVERT_WORKERS = int(os.environ.get("VIDEO_CONVERT_WORKERS") or max(1, CPU_COUNT // 2))
+VIDEO_QUEUE_MAX = int(os.environ.get("VIDEO_QUEUE_MAX", "100"))
+
+log = get_logger("video")
+
+
+def make_browser_friendly(input_path: str, threads: Optional[int] = None, remove_input: bool = True) -> str:
     """Convert a video to a browser friendly format in the same directory.
 
     Parameters
     ----------
     input_path : str
         Absolute path to the video.
+    threads : int, optional
+        Number of encoder threads ffmpeg may use. ``None`` lets ffmpeg decide.
+    remove_input : bool
+        Delete the original once converted. Pass ``False`` when the caller
+        must first record the new name, and remove it afterwards.
 
     Returns
     -------
     str
-        Path to the converted video. The original file is removed.
+        Path to the converted video.
     """
     directory, filename = os.path.split(input_path)
     base, ext = os.path.splitext(filename)
@@ -21,17 +42,151 @@ def make_browser_friendly(input_path: str) -> str:
 
     cmd = [
         "ffmpeg",
+        # An existing output is a leftover of an interrupted run; without -y
+        # ffmpeg would prompt for confirmation instead of converting.
+        "-y",
         "-i", input_path,
         "-c:v", "libx264",
         "-preset", "fast",
         "-crf", "23",
         "-movflags", "+faststart",
         "-c:a", "aac",
-        output_path,
     ]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    cmd.append(output_path)
 
-    subprocess.run(cmd, check=True)
+    with FFMPEG_SECONDS.time(result="error") as labels:
+        subprocess.run(cmd, check=True)
+        labels["result"] = "ok"
 
-    os.remove(input_path)
+    if remove_input:
+        os.remove(input_path)
     return output_path
 
+
+def needs_conversion(path: str) -> bool:
+    """Return True if *path* has not been converted by ``make_browser_friendly`` yet."""
+    return "_bf" not in os.path.splitext(path)[0]
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError as exc:
+        log.warning("Failed to remove %s: %s", path, exc)
+
+
+class ConversionQueueFull(RuntimeError):
+    """Raised when the conversion queue already holds ``max_pending`` jobs."""
+
+
+class VideoConversionQueue:
+    """Bounded pool of ffmpeg workers.
+
+    Jobs are tracked in a :class:`jobs.JobRegistry` so their status can be
+    polled. Submitting a path that is already queued returns the existing job
+    instead of converting the same file twice.
+    """
+
+    def __init__(
+        self,
+        workers: int = VIDEO_CONVERT_WORKERS,
+        max_pending: int = VIDEO_QUEUE_MAX,
+        jobs: JobRegistry = registry,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.threads_per_job = max(1, CPU_COUNT // self.workers)
+        self._jobs = jobs
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ffmpeg")
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._pending: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        input_path: str,
+        on_done: Optional[Callable[[str], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+    ) -> Job:
+        """Queue *input_path* for conversion.
+
+        ``on_done`` is called from the worker thread with the converted path
+        once ffmpeg succeeds; the original is only deleted after it returns.
+        ``on_error`` is called with the exception if ffmpeg or ``on_done``
+        fails, in which case the original is kept.
+        """
+        with self._lock:
+            job = self._pending.get(input_path)
+            if job is not None:
+                return job
+            if not self._slots.acquire(blocking=False):
+                raise ConversionQueueFull(f"{len(self._pending)} conversions already pending")
+            job = self._jobs.create("video_conversion", input=os.path.basename(input_path))
+            self._pending[input_path] = job
+
+        try:
+            self._executor.submit(contextvars.copy_context().run, self._run, job, input_path, on_done, on_error)
+        except RuntimeError:
+            self._release(input_path)
+            self._jobs.mark_failed(job, "conversion queue is shut down")
+            raise
+        return job
+
+    def convert(self, input_path: str, on_done: Optional[Callable[[str], None]] = None) -> "Future[str]":
+        """Queue *input_path* and return a future of the converted path.
+
+        The future fails with the conversion error; ``on_done`` works as in
+        :meth:`submit`. Raises :class:`ConversionQueueFull` like it.
+        """
+
+        future: "Future[str]" = Future()
+
+        def _done(output_path: str) -> None:
+            if on_done is not None:
+                on_done(output_path)
+            future.set_result(output_path)
+
+        self.submit(input_path, on_done=_done, on_error=future.set_exception)
+        return future
+
+    def _run(
+        self,
+        job: Job,
+        input_path: str,
+        on_done: Optional[Callable[[str], None]],
+        on_error: Optional[Callable[[Exception], None]],
+    ) -> None:
+        self._jobs.mark_running(job)
+        output_path = None
+        try:
+            try:
+                output_path = make_browser_friendly(input_path, threads=self.threads_per_job, remove_input=False)
+                if on_done is not None:
+                    on_done(output_path)
+            except Exception as exc:
+                log.error("Failed to convert %s: %s", input_path, exc, extra={"job_id": job.id})
+                self._jobs.mark_failed(job, str(exc))
+                if output_path is not None:
+                    # Nothing references the converted copy; a retry starts from the original.
+                    _remove_quietly(output_path)
+                if on_error is not None:
+                    try:
+                        on_error(exc)
+                    except Exception:
+                        log.exception("Failed to record the conversion failure of %s", input_path)
+                return
+
+            # Tickets now reference the converted file, so the original can go.
+            _remove_quietly(input_path)
+            self._jobs.mark_done(job, {"output": os.path.basename(output_path)})
+        finally:
+            self._release(input_path)
+
+    def _release(self, input_path: str) -> None:
+        with self._lock:
+            self._pending.pop(input_path, None)
+        self._slots.release()
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
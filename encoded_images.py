@@ -0,0 +1,138 @@
+"""Base64 encodings of ticket images, spilled to disk and reused.
+
+Parkonic expects the images of a park-in call base64-encoded inside the JSON
+body. Each image is encoded once, streamed in chunks, into a ``.b64`` file
+under ``ENCODED_IMAGE_CACHE_DIR``. Retries and later bulk runs reuse that
+file. Entries are keyed by the source path, size and mtime, so a replaced
+image is encoded again. The least recently used entries are deleted once the
+cache grows past ``ENCODED_IMAGE_CACHE_MAX_BYTES``. Entries in use are never
+deleted.
+"""
+
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, NamedTuple
+
+ENCODED_IMAGE_CACHE_DIR = os.environ.get(
+    "ENCODED_IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ticket-image-b64")
+)
+ENCODED_IMAGE_CACHE_MAX_BYTES = int(os.environ.get("ENCODED_IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# A multiple of 3 so every chunk encodes without padding.
+READ_CHUNK_SIZE = 3 * 64 * 1024
+
+
+class EncodedImage(NamedTuple):
+    path: str
+    size: int
+
+
+class EncodedImageCache:
+    def __init__(self, directory: str = ENCODED_IMAGE_CACHE_DIR, max_bytes: int = ENCODED_IMAGE_CACHE_MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._pins: Dict[str, int] = {}
+        self._total_bytes = None
+        self._lock = threading.Lock()
+
+    def _entry_path(self, source: str, st: os.stat_result) -> str:
+        key = f"{os.path.abspath(source)}|{st.st_size}|{st.st_mtime_ns}"
+        return os.path.join(self.directory, f"{hashlib.sha1(key.encode()).hexdigest()}.b64")
+
+    @contextmanager
+    def encoded(self, source: str) -> Iterator[EncodedImage]:
+        """Yield the encoded form of the image at *source*, encoding it if needed.
+
+        The entry cannot be evicted until the ``with`` block exits.
+        """
+
+        path = self._entry_path(source, os.stat(source))
+        with self._lock:
+            self._pins[path] = self._pins.get(path, 0) + 1
+        try:
+            try:
+                os.utime(path)
+                size = os.path.getsize(path)
+                hit = True
+            except OSError:
+                size = self._encode(source, path)
+                hit = False
+            with self._lock:
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            yield EncodedImage(path, size)
+        finally:
+            with self._lock:
+                self._pins[path] -= 1
+                if not self._pins[path]:
+                    del self._pins[path]
+
+    def _encode(self, source: str, path: str) -> int:
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.part"
+        try:
+            with open(source, "rb") as src, open(temp_path, "wb") as out:
+                while chunk := src.read(READ_CHUNK_SIZE):
+                    out.write(base64.b64encode(chunk))
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        size = os.path.getsize(path)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total()
+            else:
+                self._total_bytes += size
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+        return size
+
+    def _entries(self) -> list:
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".b64"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _scan_total(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        """Delete the least recently used unpinned entries down to 90% of the budget."""
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            with self._lock:
+                if path in self._pins:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+        with self._lock:
+            self._total_bytes = total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes}
+
+
+cache = EncodedImageCache()
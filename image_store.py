@@ -0,0 +1,177 @@
+"""Where ticket images are written, and garbage collection of unused ones.
+
+``IMAGE_STORE_MODE=uuid`` (the default) writes every image under the uuid
+name chosen by the caller, placed according to ``MEDIA_LAYOUT``.
+``IMAGE_STORE_MODE=cas`` stores images by content instead, at
+``<dir>/<sha256[:2]>/<sha256>.jpg``: byte-identical frames, which fixed-pole
+cameras send often, are written once and shared by every ticket that
+references them.
+
+Shared files must never be deleted together with one ticket, so removal is
+left to :func:`collect_garbage`. It deletes files that no row of the ticket
+tables references any more (a mark-and-sweep over the tables, rather than
+reference counts that every move, cancel and merge would have to keep in
+step).
+"""
+
+import hashlib
+import os
+import re
+import time
+from typing import BinaryIO, Dict, Iterable, Optional, Set
+
+from jobs import Job, registry
+from media import layout_path
+from metrics import IMAGE_WRITE_SECONDS
+
+IMAGE_STORE_MODE = os.environ.get("IMAGE_STORE_MODE", "uuid").lower()
+# Unreferenced files younger than this are kept; their ticket may not be committed yet.
+IMAGE_GC_GRACE_SECONDS = float(os.environ.get("IMAGE_GC_GRACE_SECONDS", "3600"))
+COPY_CHUNK_SIZE = 1024 * 1024
+CAS_NAME_PATTERN = re.compile(r"^[0-9a-f]{64}\.\w+$")
+SKIPPED_DIRS = {".variants"}
+
+
+def content_addressed() -> bool:
+    return IMAGE_STORE_MODE == "cas"
+
+
+def _cas_path(directory: str, digest: str, ext: str) -> str:
+    return os.path.join(directory, digest[:2], f"{digest}{ext}")
+
+
+def target_path(data: bytes, suggested_path: str) -> str:
+    """Return where *data* is stored when the caller proposes *suggested_path*."""
+
+    directory, filename = os.path.split(suggested_path)
+    if not content_addressed():
+        return layout_path(directory, filename)
+    return _cas_path(directory, hashlib.sha256(data).hexdigest(), os.path.splitext(filename)[1])
+
+
+def _reuse(path: str) -> bool:
+    """Return True if *path* already exists, refreshing its mtime for the GC grace period."""
+
+    try:
+        os.utime(path)
+        return True
+    except OSError:
+        return False
+
+
+def write(data: bytes, path: str) -> str:
+    """Write *data* to *path* as returned by :func:`target_path`."""
+
+    with IMAGE_WRITE_SECONDS.time(mode=IMAGE_STORE_MODE) as labels:
+        if content_addressed() and _reuse(path):
+            labels["mode"] = "cas_reused"
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.part"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return path
+
+
+def store(data: bytes, suggested_path: str) -> str:
+    """Store an image held in memory and return its path."""
+
+    return write(data, target_path(data, suggested_path))
+
+
+def store_stream(source: BinaryIO, suggested_path: str) -> str:
+    """Store an image read from *source* without loading it whole; returns its path."""
+
+    with IMAGE_WRITE_SECONDS.time(mode=IMAGE_STORE_MODE):
+        return _store_stream(source, suggested_path)
+
+
+def _store_stream(source: BinaryIO, suggested_path: str) -> str:
+    directory, filename = os.path.split(suggested_path)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f".{filename}.part")
+    digest = hashlib.sha256()
+    try:
+        with open(temp_path, "wb") as out:
+            while chunk := source.read(COPY_CHUNK_SIZE):
+                digest.update(chunk)
+                out.write(chunk)
+        if not content_addressed():
+            path = layout_path(directory, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            return path
+        path = _cas_path(directory, digest.hexdigest(), os.path.splitext(filename)[1])
+        if _reuse(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def discard(paths: Iterable[str]) -> None:
+    """Delete images written for tickets that were never committed.
+
+    Content-addressed files may be shared with other tickets and are left
+    to :func:`collect_garbage`.
+    """
+
+    for path in paths:
+        if CAS_NAME_PATTERN.match(os.path.basename(path)):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def collect_garbage(
+    referenced: Dict[str, Set[str]],
+    grace_seconds: float = IMAGE_GC_GRACE_SECONDS,
+    dry_run: bool = False,
+    job: Optional[Job] = None,
+) -> dict:
+    """Delete image files that no ticket references.
+
+    *referenced* maps each image directory to the file names its tickets
+    reference. Names rather than full paths are compared, because stored
+    paths may use an older base directory. Resized variants and partial
+    writes are left alone.
+    """
+
+    cutoff = time.time() - grace_seconds
+    summary = {"scanned": 0, "removed": 0, "freed_bytes": 0, "dry_run": dry_run}
+    for directory, names in referenced.items():
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if d not in SKIPPED_DIRS]
+            for filename in files:
+                if filename.endswith(".part"):
+                    continue
+                summary["scanned"] += 1
+                if filename in names:
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    st = os.stat(path)
+                    if st.st_mtime > cutoff:
+                        continue
+                    if not dry_run:
+                        os.remove(path)
+                except OSError:
+                    continue
+                summary["removed"] += 1
+                summary["freed_bytes"] += st.st_size
+            if job is not None:
+                registry.update(job, **summary)
+    return summary
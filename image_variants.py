@@ -0,0 +1,210 @@
+"""Resized derivatives of the camera images, cached on disk.
+
+Variants live in a ``.variants`` directory next to the original image and
+are named after it, e.g. ``.variants/<uuid>_w320_h0.webp``. The combined
+size of all variant directories is kept under ``VARIANT_CACHE_MAX_BYTES`` by
+deleting the least recently served variants first. :meth:`VariantCache.scan`
+counts the variants already on disk at startup, so the budget holds across
+restarts, and deletes variants whose original is gone, e.g. the flat
+``.variants`` directories left behind when images move to sharded folders.
+
+Resizing needs Pillow; without it :data:`AVAILABLE` is False.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Set
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+AVAILABLE = Image is not None
+VARIANT_DIR_NAME = ".variants"
+VARIANT_CACHE_MAX_BYTES = int(os.environ.get("VARIANT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+VARIANT_WORKERS = int(os.environ.get("VARIANT_WORKERS") or (os.cpu_count() or 2))
+MAX_DIMENSION = 4096
+
+FORMATS = {
+    "jpeg": ("jpg", "JPEG", "image/jpeg"),
+    "webp": ("webp", "WEBP", "image/webp"),
+}
+
+
+def media_type(fmt: str) -> str:
+    return FORMATS[fmt][2]
+
+
+class VariantCache:
+    def __init__(self, max_bytes: int = VARIANT_CACHE_MAX_BYTES, workers: int = VARIANT_WORKERS) -> None:
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="resize")
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._dirs: Set[str] = set()
+        self._total_bytes = 0
+
+    @staticmethod
+    def variant_path(original: str, width: Optional[int], height: Optional[int], fmt: str) -> str:
+        directory, filename = os.path.split(original)
+        stem = os.path.splitext(filename)[0]
+        ext = FORMATS[fmt][0]
+        return os.path.join(directory, VARIANT_DIR_NAME, f"{stem}_w{width or 0}_h{height or 0}.{ext}")
+
+    def get(self, original: str, width: Optional[int], height: Optional[int], fmt: str = "jpeg") -> str:
+        """Return the path of the requested variant, rendering it if needed."""
+
+        path = self.variant_path(original, width, height, fmt)
+        try:
+            if os.path.getmtime(path) >= os.path.getmtime(original):
+                # mtime doubles as the last-served time for eviction.
+                os.utime(path)
+                return path
+        except OSError:
+            pass
+
+        with self._lock:
+            future = self._in_flight.get(path)
+            if future is None:
+                future = self._executor.submit(self._render, original, path, width, height, fmt)
+                self._in_flight[path] = future
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                if self._in_flight.get(path) is future and future.done():
+                    del self._in_flight[path]
+
+    def _render(self, original: str, path: str, width: Optional[int], height: Optional[int], fmt: str) -> str:
+        directory = os.path.dirname(path)
+        self._track(directory)
+        os.makedirs(directory, exist_ok=True)
+
+        with Image.open(original) as img:
+            img.thumbnail((width or MAX_DIMENSION, height or MAX_DIMENSION))
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            temp_path = f"{path}.part"
+            img.save(temp_path, FORMATS[fmt][1], quality=80)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._total_bytes += os.path.getsize(path)
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self._evict(keep=path)
+        return path
+
+    def _track(self, directory: str) -> None:
+        """Count the bytes already stored in *directory* the first time it is used."""
+        with self._lock:
+            if directory in self._dirs:
+                return
+            self._dirs.add(directory)
+            if os.path.isdir(directory):
+                with os.scandir(directory) as entries:
+                    self._total_bytes += sum(e.stat().st_size for e in entries if e.is_file())
+
+    @staticmethod
+    def _variant_dirs(root: str) -> Iterable[str]:
+        """``.variants`` directories of *root* and of its shard folders."""
+
+        parents = [root]
+        with os.scandir(root) as entries:
+            parents.extend(e.path for e in entries if e.is_dir() and not e.name.startswith("."))
+        for parent in parents:
+            directory = os.path.join(parent, VARIANT_DIR_NAME)
+            if os.path.isdir(directory):
+                yield directory
+
+    def scan(self, roots: Iterable[str], dry_run: bool = False) -> dict:
+        """Count the variants under the image directories *roots* and delete orphans.
+
+        A variant is an orphan when its directory's parent holds no original
+        with the same stem. Evicts down to the budget afterwards.
+        """
+
+        summary = {"dirs": 0, "bytes": 0, "orphans_removed": 0, "orphan_bytes": 0, "dry_run": dry_run}
+        for root in roots:
+            if not os.path.isdir(root):
+                continue
+            for directory in self._variant_dirs(root):
+                parent = os.path.dirname(directory)
+                with os.scandir(parent) as entries:
+                    stems = {os.path.splitext(e.name)[0] for e in entries if e.is_file()}
+                size = 0
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if not entry.is_file() or entry.name.endswith(".part"):
+                            continue
+                        entry_size = entry.stat().st_size
+                        if entry.name.rsplit("_w", 1)[0] in stems:
+                            size += entry_size
+                            continue
+                        try:
+                            if not dry_run:
+                                os.remove(entry.path)
+                        except OSError:
+                            size += entry_size
+                            continue
+                        summary["orphans_removed"] += 1
+                        summary["orphan_bytes"] += entry_size
+                if not dry_run and not size:
+                    try:
+                        os.rmdir(directory)
+                        continue
+                    except OSError:
+                        pass
+                summary["dirs"] += 1
+                summary["bytes"] += size
+                with self._lock:
+                    if directory not in self._dirs:
+                        self._dirs.add(directory)
+                        self._total_bytes += size
+
+        with self._lock:
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget and not dry_run:
+            self._evict(keep=None)
+        return summary
+
+    def _evict(self, keep: Optional[str]) -> None:
+        """Delete the least recently served variants down to 90% of the budget.
+
+        *keep*, if given, is the variant about to be served and is never deleted.
+        """
+        with self._lock:
+            dirs = list(self._dirs)
+        files = []
+        for directory in dirs:
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and not entry.name.endswith(".part"):
+                        st = entry.stat()
+                        files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, size, file_path in files:
+            if total <= target:
+                break
+            if file_path == keep:
+                continue
+            try:
+                os.remove(file_path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._total_bytes = total
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+variants = VariantCache()
@@ -0,0 +1,229 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from logging_config import get_logger
+from models import BackgroundJob
+
+# Finished jobs stay readable from the database for this long.
+JOB_HISTORY_SECONDS = float(os.environ.get("JOB_HISTORY_SECONDS", str(7 * 24 * 3600)))
+JOB_PURGE_INTERVAL_SECONDS = 3600
+
+log = get_logger("jobs")
+
+
+class Job:
+    """State of a single background job."""
+
+    def __init__(self, kind: str, **info: Any) -> None:
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "pending"
+        self.info: Dict[str, Any] = info
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "info": self.info,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobRegistry:
+    """Thread-safe registry of the jobs of this process.
+
+    Finished jobs are kept so their status can be queried, but only the most
+    recent ``max_finished`` of them; older ones are dropped first. Once
+    :meth:`bind` is called every change is also written to
+    :class:`~models.BackgroundJob`, so :meth:`get` finds jobs started by any
+    server process, for ``JOB_HISTORY_SECONDS`` after they finish. A job whose
+    process died keeps the state it last wrote.
+    """
+
+    def __init__(self, max_finished: int = 1000) -> None:
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_finished = max_finished
+        self._session_factory: Optional[Callable[[], Session]] = None
+        self._purged_at = 0.0
+
+    def bind(self, session_factory: Callable[[], Session]) -> None:
+        """Persist jobs through *session_factory*."""
+        self._session_factory = session_factory
+
+    def create(self, kind: str, **info: Any) -> Job:
+        job = Job(kind, **info)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._save(job, created=True)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self._session_factory is not None:
+            job = self._load(job_id)
+        return job
+
+    def mark_running(self, job: Job) -> None:
+        with self._lock:
+            job.status = "running"
+            job.started_at = time.time()
+        self._save(job)
+
+    def update(self, job: Job, **info: Any) -> None:
+        with self._lock:
+            job.info.update(info)
+        self._save(job)
+
+    def mark_done(self, job: Job, result: Any = None) -> None:
+        with self._lock:
+            job.status = "done"
+            job.result = result
+            job.finished_at = time.time()
+        self._save(job)
+
+    def mark_failed(self, job: Job, error: str) -> None:
+        with self._lock:
+            job.status = "failed"
+            job.error = error
+            job.finished_at = time.time()
+        self._save(job)
+
+    def _save(self, job: Job, created: bool = False) -> None:
+        if self._session_factory is None:
+            return
+        with self._lock:
+            values = {
+                "kind": job.kind,
+                "status": job.status,
+                "info": json.dumps(job.info, default=str),
+                "result": json.dumps(job.result, default=str),
+                "error": job.error,
+                "created_at": job.created_at,
+                "started_at": job.started_at,
+                "finished_at": job.finished_at,
+            }
+        db = self._session_factory()
+        try:
+            if created:
+                db.add(BackgroundJob(id=job.id, **values))
+            else:
+                db.query(BackgroundJob).filter(BackgroundJob.id == job.id).update(values, synchronize_session=False)
+            db.commit()
+            if created:
+                self._purge(db)
+        except Exception as exc:
+            # The job itself goes on; only other processes see a stale state.
+            db.rollback()
+            log.error("Failed to store job %s: %s", job.id, exc)
+        finally:
+            db.close()
+
+    def _purge(self, db: Session) -> None:
+        now = time.time()
+        if now - self._purged_at < JOB_PURGE_INTERVAL_SECONDS:
+            return
+        self._purged_at = now
+        db.query(BackgroundJob).filter(BackgroundJob.finished_at < now - JOB_HISTORY_SECONDS).delete(
+            synchronize_session=False
+        )
+        db.commit()
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        db = self._session_factory()
+        try:
+            row = db.get(BackgroundJob, job_id)
+        except Exception as exc:
+            log.error("Failed to load job %s: %s", job_id, exc)
+            return None
+        finally:
+            db.close()
+        if row is None:
+            return None
+        job = Job(row.kind, **json.loads(row.info or "{}"))
+        job.id = row.id
+        job.status = row.status
+        job.result = json.loads(row.result) if row.result else None
+        job.error = row.error
+        job.created_at = row.created_at
+        job.started_at = row.started_at
+        job.finished_at = row.finished_at
+        return job
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - self._max_finished)]:
+            del self._jobs[job_id]
+
+
+registry = JobRegistry()
+
+
+class JobAlreadyRunning(RuntimeError):
+    def __init__(self, job: Job) -> None:
+        super().__init__(f"{job.kind} job {job.id} is still running")
+        self.job = job
+
+
+class ExclusiveJob:
+    """Runs jobs of one kind, at most one at a time within this process."""
+
+    def __init__(self, kind: str, log: logging.Logger, jobs: JobRegistry = registry) -> None:
+        self.kind = kind
+        self.log = log
+        self.jobs = jobs
+        self._lock = threading.Lock()
+        self._active: Optional[Job] = None
+
+    def start(self, target: Callable[[Job], Any], wait: bool = False, **info: Any) -> Job:
+        """Run ``target(job)`` in a thread and record its result on the returned job.
+
+        Raises :class:`JobAlreadyRunning` while an earlier job is unfinished.
+        ``wait=True`` runs in the calling thread instead.
+        """
+
+        with self._lock:
+            if self._active is not None and not self._active.finished:
+                raise JobAlreadyRunning(self._active)
+            job = self.jobs.create(self.kind, **info)
+            self._active = job
+
+        def _run() -> None:
+            try:
+                self.jobs.mark_running(job)
+                self.jobs.mark_done(job, target(job))
+            except Exception as exc:
+                self.log.exception("%s job %s failed", self.kind, job.id)
+                self.jobs.mark_failed(job, str(exc))
+
+        context = contextvars.copy_context()
+        if wait:
+            context.run(_run)
+        else:
+            threading.Thread(target=context.run, args=(_run,), name=self.kind, daemon=True).start()
+        return job
@@ -0,0 +1,182 @@
+"""Queue-backed structured logging.
+
+Log calls only put the record on an in-memory queue; a background
+``QueueListener`` thread formats it and writes it to stdout, so request
+threads never wait on I/O. Configuration comes from the environment:
+
+``LOG_LEVEL``
+    Default level of the ``ticketserver`` loggers (``INFO``).
+``LOG_LEVELS``
+    Per-category levels, e.g. ``ingest.plate=WARNING,submit=DEBUG``.
+``LOG_SAMPLE``
+    Fraction of records below ``WARNING`` kept per category, e.g.
+    ``ingest.plate=0.01``. Warnings and errors are never dropped.
+``LOG_FORMAT``
+    ``json`` (default) or ``text``.
+
+Records carry the id of the request that produced them (see
+:class:`RequestIdMiddleware`). Extra fields given with
+``logger.info(..., extra={...})`` are included in the JSON output.
+"""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+ROOT_LOGGER = "ticketserver"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else came from ``extra``.
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _parse_mapping(value: str) -> Dict[str, str]:
+    mapping = {}
+    for item in value.split(","):
+        name, sep, setting = item.partition("=")
+        if sep and name.strip():
+            mapping[name.strip()] = setting.strip()
+    return mapping
+
+
+def get_logger(category: str) -> logging.Logger:
+    """Return the logger of a category such as ``ingest`` or ``ingest.plate``."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{category}")
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only *rate* of the records below ``WARNING``."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """Queue the record itself and leave all formatting to the listener.
+
+    The stock ``prepare`` formats the record, traceback included, on the
+    calling thread. Only the message is merged here, since the arguments may
+    change once the call returns; ``exc_info`` is formatted by the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging() -> None:
+    """Install the queue handler on the ``ticketserver`` loggers. Safe to call twice."""
+
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JSONFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = RecordQueueHandler(records)
+    # Capture the request id on the calling thread, before the record is queued.
+    handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(handler)
+    root.propagate = False
+    for category, level in _parse_mapping(os.environ.get("LOG_LEVELS", "")).items():
+        get_logger(category).setLevel(level.upper())
+    for category, rate in _parse_mapping(os.environ.get("LOG_SAMPLE", "")).items():
+        get_logger(category).addFilter(SamplingFilter(float(rate)))
+
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the background writer."""
+
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """ASGI middleware binding a request id for the duration of each request.
+
+    An incoming ``X-Request-ID`` header is reused, otherwise one is
+    generated. The id is echoed in the response headers.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(REQUEST_ID_HEADER.encode())
+        value = incoming.decode("latin-1")[:128] if incoming else uuid.uuid4().hex
+        token = request_id.set(value)
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(REQUEST_ID_HEADER.encode(), value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            request_id.reset(token)
@@ -4,74 +4,108 @@ from fastapi import (
     Depends,
     UploadFile,
     File,
-    BackgroundTasks,
+    Form,
+    Query,
     Request,
 )
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, ConfigDict
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, TypeAdapter, ValidationError
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
 import asyncio
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database import SessionLocal, engine
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from sqlalchemy.util import await_only
+from starlette.concurrency import run_in_threadpool
 from auth import verify_password, create_access_token
-from models import Base, Ticket, SubmittedTicket, CancelledTicket, User
+from models import (
+    Base,
+    Ticket,
+    SubmittedTicket,
+    CancelledTicket,
+    SubmittedTicketArchive,
+    CancelledTicketArchive,
+    SubmissionJob,
+    User,
+)
 import requests
 import shutil
+import threading
 from datetime import datetime, timedelta
 import os
-import re
+from concurrent.futures import ThreadPoolExecutor
 import base64
+import hashlib
 import json
 import aiofiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 import uuid
-from parking_api import park_in_request, park_out_request
-from fastapi.responses import FileResponse
-from convert_video import make_browser_friendly
-
-
-WINDOWS_ABS_PATH_PATTERN = re.compile(r"^[A-Za-z]:[/\\]")
-
-
-def _normalize_directory(path: str) -> str:
-    """Return a normalized directory path for consistent joins."""
-
-    expanded = os.path.expanduser(path)
-    return os.path.normpath(expanded)
-
-
-def _resolve_relative_path(path: Optional[str], base_dir: str) -> Optional[str]:
-    """Resolve *path* against *base_dir* when it is not absolute."""
-
-    if not path:
-        return path
-    if os.path.isabs(path) or WINDOWS_ABS_PATH_PATTERN.match(path):
-        return os.path.normpath(path)
-
-    normalized = path.replace("\\", "/").lstrip("/")
-    base_name = os.path.basename(os.path.normpath(base_dir))
-    if base_name:
-        lowered = normalized.lower()
-        prefix = f"{base_name.lower()}/"
-        if lowered.startswith(prefix):
-            normalized = normalized[len(prefix) :]
-
-    if not normalized:
-        return os.path.normpath(base_dir)
-
-    return os.path.normpath(os.path.join(base_dir, normalized))
-
-
-ENTRY_IMAGE_DIR = _normalize_directory(os.environ.get("ENTRY_IMAGE_DIR", "D:/entry_images"))
-CAR_IMAGE_DIR = _normalize_directory(os.environ.get("CAR_IMAGE_DIR", "D:/car_images"))
-UPLOAD_FOLDER = _normalize_directory(os.environ.get("EXIT_VIDEO_DIR", "D:/exit_video"))
+from parking_api import client as parkonic_client, park_in_request, park_out_response
+from media import (
+    UUID_NAME_PATTERN,
+    LRUCache,
+    file_response,
+    layout_path,
+    locate,
+    media_directories,
+    resolve_relative_path,
+)
+import image_variants
+import image_store
+import metrics
+from logging_config import RequestIdMiddleware, configure_logging, get_logger
+import encoded_images
+import traffic_capture
+from convert_video import (
+    ConversionQueueFull,
+    VideoConversionQueue,
+    needs_conversion,
+)
+from scheduler import SCHEDULER_ENABLED, Scheduler
+from archiver import ARCHIVE_AT, ARCHIVE_RETENTION_DAYS, archive_old_tickets
+from jobs import ExclusiveJob, Job, JobAlreadyRunning, registry as job_registry
+from occupancy import SpotSnapshot, occupancy
+from plate_index import clean_plate, levenshtein, plates as plate_index
+from spot_state import NULL_KEY, LockedSpot, lock_spot, record_created, update_if_latest
+from ticket_transitions import cancel_tickets, lock_tickets, move_ticket
+from bulk_submit import select_short_ticket_ids, start_bulk_submission
+import submission_outbox
+from submission_outbox import SubmissionError, SubmissionSteps, SubmissionWorkers
+
+
+configure_logging()
+config_log = get_logger("config")
+startup_log = get_logger("startup")
+ingest_log = get_logger("ingest")
+plate_log = get_logger("ingest.plate")
+submit_log = get_logger("submit")
+video_log = get_logger("video")
+media_log = get_logger("media")
+jobs_log = get_logger("jobs")
+
+_directories = media_directories()
+ENTRY_IMAGE_DIR = _directories["entry_image_dir"]
+CAR_IMAGE_DIR = _directories["car_image_dir"]
+UPLOAD_FOLDER = _directories["exit_video_dir"]
 CONFIG_PATH = os.environ.get("TICKETSERVER_CONFIG_PATH")
+# Largest accepted /upload-video body in bytes; 0 disables the limit.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+TICKET_BATCH_MAX = int(os.environ.get("TICKET_BATCH_MAX", "500"))
+# Largest accepted /tickets/batch body in bytes, checked before it is parsed.
+TICKET_BATCH_MAX_BYTES = int(os.environ.get("TICKET_BATCH_MAX_BYTES", str(64 * 1024 * 1024)))
+TICKET_BATCH_IMAGE_WORKERS = int(os.environ.get("TICKET_BATCH_IMAGE_WORKERS", "8"))
+# Older tickets are hidden from the ticket list and next-ticket lookups; empty shows all.
+_visible_since = os.environ.get("TICKET_VISIBLE_SINCE", "2025-07-28 23:59:59").strip()
+TICKET_VISIBLE_SINCE = datetime.fromisoformat(_visible_since) if _visible_since else None
 
 Base.metadata.create_all(bind=engine)
+# Job state goes to the database so /jobs/{id} answers from any worker.
+job_registry.bind(SessionLocal)
 app = FastAPI()
 cors_env = os.environ.get("CORS_ORIGINS")
 if cors_env:
@@ -87,7 +121,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+metrics.instrument_engine(engine)
+if async_engine is not None:
+    metrics.instrument_engine(async_engine)
 
 
 def success_response(message: str, identifier, **extra) -> JSONResponse:
@@ -130,6 +170,7 @@ class TicketOut(BaseModel):
     entry_pic_base64: Optional[str] = None
     car_pic: Optional[str] = None
     exit_video_path: Optional[str] = None
+    video_status: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -137,10 +178,71 @@ class TicketOut(BaseModel):
 def get_db():
     db = SessionLocal()
     try:
+        with metrics.DB_POOL_CHECKOUT_SECONDS.time():
+            db.connection()
         yield db
     finally:
         db.close()
 
+
+async def get_async_db():
+    """Yield an ``AsyncSession``; only available with ``DB_ASYNC=1``."""
+    if AsyncSessionLocal is None:
+        raise RuntimeError("The async database engine is disabled; set DB_ASYNC=1")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+class DbRunner:
+    """Run sync ORM code from an ``async def`` endpoint.
+
+    ``await run_db(fn, *args)`` calls ``fn(session, *args)``. With the
+    threaded engine that happens in Starlette's threadpool, as for a sync
+    endpoint. With ``DB_ASYNC=1`` it runs through ``AsyncSession.run_sync``
+    on the event loop, so waiting on the database does not hold a thread.
+    Inside *fn*, wrap blocking work that is not database I/O (file writes)
+    in :meth:`blocking`.
+    """
+
+    def __init__(self, session) -> None:
+        self.session = session
+        self.is_async = not isinstance(session, Session)
+
+    async def __call__(self, fn, *args):
+        if self.is_async:
+            return await self.session.run_sync(fn, *args)
+        return await run_in_threadpool(fn, self.session, *args)
+
+    def blocking(self, fn, *args):
+        if self.is_async:
+            return await_only(asyncio.to_thread(fn, *args))
+        return fn(*args)
+
+
+async def get_db_runner():
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            with metrics.DB_POOL_CHECKOUT_SECONDS.time():
+                await db.connection()
+            yield DbRunner(db)
+    else:
+        db = SessionLocal()
+        try:
+            with metrics.DB_POOL_CHECKOUT_SECONDS.time():
+                await run_in_threadpool(db.connection)
+            yield DbRunner(db)
+        finally:
+            await run_in_threadpool(db.close)
+
+def decode_base64_jpg(b64_string: str) -> bytes:
+    """Decode a base64 JPEG, with or without a ``data:image/...`` URI prefix."""
+
+    # If the string has a data URI prefix, strip it out:
+    if b64_string.startswith("data:image"):
+        b64_string = b64_string.split(",", 1)[1]
+    return base64.b64decode(b64_string)
+
+
 def save_base64_jpg(b64_string: str, output_path: str):
     """
     Decode a base64‐encoded JPEG and save it to disk.
@@ -149,12 +251,7 @@ def save_base64_jpg(b64_string: str, output_path: str):
                         It may include a data URI prefix like "data:image/jpeg;base64,..."
     :param output_path: Path to write the decoded JPG, e.g. "snapshot.jpg"
     """
-    # If the string has a data URI prefix, strip it out:
-    if b64_string.startswith("data:image"):
-        b64_string = b64_string.split(",", 1)[1]
-
-    # Decode and write to a file
-    img_data = base64.b64decode(b64_string)
+    img_data = decode_base64_jpg(b64_string)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     with open(output_path, "wb") as f:
         f.write(img_data)
@@ -181,37 +278,31 @@ async def load_runtime_config() -> None:
         async with aiofiles.open(CONFIG_PATH, "r", encoding="utf-8") as config_file:
             raw_config = await config_file.read()
     except FileNotFoundError:
-        print(f"Config file {CONFIG_PATH} not found; using default directories.")
+        config_log.warning("Config file %s not found; using default directories.", CONFIG_PATH)
         return
     except OSError as exc:
-        print(f"Failed to open config file {CONFIG_PATH}: {exc}")
+        config_log.error("Failed to open config file %s: %s", CONFIG_PATH, exc)
         return
 
     try:
         data = json.loads(raw_config)
     except json.JSONDecodeError as exc:
-        print(f"Invalid JSON in config file {CONFIG_PATH}: {exc}")
+        config_log.error("Invalid JSON in config file %s: %s", CONFIG_PATH, exc)
         return
 
-    entry_dir = data.get("entry_image_dir")
-    car_dir = data.get("car_image_dir")
-    exit_dir = data.get("exit_video_dir")
-
-    if entry_dir:
-        ENTRY_IMAGE_DIR = _normalize_directory(entry_dir)
-    if car_dir:
-        CAR_IMAGE_DIR = _normalize_directory(car_dir)
-    if exit_dir:
-        UPLOAD_FOLDER = _normalize_directory(exit_dir)
+    directories = media_directories(data)
+    ENTRY_IMAGE_DIR = directories["entry_image_dir"]
+    CAR_IMAGE_DIR = directories["car_image_dir"]
+    UPLOAD_FOLDER = directories["exit_video_dir"]
 
 
 def normalize_path_car(path: str) -> str:
-    normalized = _resolve_relative_path(path, CAR_IMAGE_DIR)
+    normalized = resolve_relative_path(path, CAR_IMAGE_DIR)
     return normalized if normalized is not None else path
 
 
 def normalize_video_path(path: str) -> str:
-    normalized = _resolve_relative_path(path, UPLOAD_FOLDER)
+    normalized = resolve_relative_path(path, UPLOAD_FOLDER)
     return normalized if normalized is not None else path
 
 
@@ -221,20 +312,110 @@ def is_video_file(path: str) -> bool:
     return os.path.splitext(path)[1].lower() in video_exts
 
 
-async def _write_bytes(path: str, data: bytes) -> None:
-    """Write *data* to *path* in a background thread."""
+async def _stream_to_file(upload: UploadFile, directory: str, filename: str, max_bytes: int) -> tuple[str, int, str]:
+    """Copy *upload* into *directory* in fixed-size chunks.
+
+    The data goes to a temporary file that is renamed to *filename* only once
+    it is complete, so readers never see a partial file. Returns the final
+    path, the size in bytes and the SHA-256 hex digest.
+    """
+
+    final_path = os.path.join(directory, filename)
+    temp_path = os.path.join(directory, f".{filename}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(temp_path, "wb") as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise HTTPException(status_code=413, detail="File too large")
+                digest.update(chunk)
+                await out.write(chunk)
+        os.replace(temp_path, final_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return final_path, size, digest.hexdigest()
 
-    def _write() -> None:
-        with open(path, "wb") as f:
-            f.write(data)
 
-    await asyncio.to_thread(_write)
+video_queue = VideoConversionQueue()
 
 
 async def _convert_video(path: str) -> str:
-    """Run ``make_browser_friendly`` in a background thread."""
+    """Convert *path* through ``video_queue`` and wait for the converted path."""
 
-    return await asyncio.to_thread(make_browser_friendly, path)
+    return await asyncio.wrap_future(video_queue.convert(path))
+
+
+VIDEO_STATUS_TABLES = (Ticket, SubmittedTicket, CancelledTicket)
+
+
+def _finish_video_conversion(original_name: str, converted_path: str) -> None:
+    """Point every ticket still referencing *original_name* at the converted video."""
+
+    converted_name = os.path.basename(converted_path)
+    db = SessionLocal()
+    try:
+        # The ticket may have been submitted or cancelled while ffmpeg was running.
+        for model in VIDEO_STATUS_TABLES:
+            db.query(model).filter(model.exit_video_path == original_name).update(
+                {model.exit_video_path: converted_name, model.video_status: None}, synchronize_session=False
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _set_video_status(video_name: str, status: str) -> None:
+    """Record on the tickets referencing *video_name* that it was not converted."""
+
+    db = SessionLocal()
+    try:
+        for model in VIDEO_STATUS_TABLES:
+            db.query(model).filter(model.exit_video_path == video_name).update(
+                {model.video_status: status}, synchronize_session=False
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _video_status_for(video_path: Optional[str]) -> Optional[str]:
+    """``video_status`` of a ticket given a newly stored exit video."""
+
+    if video_path and is_video_file(video_path) and needs_conversion(video_path):
+        return "pending"
+    return None
+
+
+def _queue_exit_video(video_path: Optional[str]) -> dict:
+    """Queue conversion of a stored exit video.
+
+    Must be called after the ticket referencing the video has been committed
+    with ``video_status="pending"``. Returns extra response fields describing
+    the conversion job, if any.
+    """
+
+    if _video_status_for(video_path) is None:
+        return {}
+
+    original_name = os.path.basename(video_path)
+    try:
+        job = video_queue.submit(
+            video_path,
+            on_done=lambda converted: _finish_video_conversion(original_name, converted),
+            on_error=lambda exc: _set_video_status(original_name, "failed"),
+        )
+    except (ConversionQueueFull, RuntimeError) as exc:
+        video_log.warning("Could not queue conversion of %s: %s", video_path, exc)
+        try:
+            _set_video_status(original_name, "unconverted")
+        except SQLAlchemyError as db_exc:
+            video_log.error("Failed to record that %s is unconverted: %s", original_name, db_exc)
+        return {"video_status": "unconverted"}
+    return {"video_job_id": job.id, "video_status": job.status}
 
 
 def submit_previous_day_tickets() -> None:
@@ -243,54 +424,270 @@ def submit_previous_day_tickets() -> None:
     end_prev = start_prev + timedelta(days=1)
     db = SessionLocal()
     try:
-        tickets = (
-            db.query(Ticket)
-            .filter(
-                Ticket.entry_time >= start_prev,
-                Ticket.entry_time < end_prev,
-                Ticket.exit_time != None,
-            )
-            .all()
+        ids_to_submit = select_short_ticket_ids(
+            db, min_seconds=None, entry_from=start_prev, entry_to=end_prev
         )
     finally:
         db.close()
 
-    ids_to_submit = [
-        t.id
-        for t in tickets
-        if t.entry_time and t.exit_time and t.exit_time - t.entry_time < timedelta(hours=1)
-    ]
+    job = start_bulk_submission(SessionLocal, ids_to_submit, "previous_day", wake=submission_workers.wake)
+    submit_log.info("Previous day submission queued", extra={"job_id": job.id, "tickets": len(ids_to_submit)})
+
 
-    for tid in ids_to_submit:
-        submit_ticket(tid)
+@app.on_event("startup")
+async def start_scheduler() -> None:
+    await load_runtime_config()
+    if SCHEDULER_ENABLED:
+        scheduler.start()
 
 
-async def schedule_midnight_submission() -> None:
-    """Run submission task every midnight."""
-    while True:
-        now = datetime.now()
-        next_midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        await asyncio.sleep((next_midnight - now).total_seconds())
-        submit_previous_day_tickets()
+@app.on_event("shutdown")
+async def stop_scheduler() -> None:
+    await scheduler.stop()
 
 
 @app.on_event("startup")
-async def start_scheduler() -> None:
-    await load_runtime_config()
-    asyncio.create_task(schedule_midnight_submission())
+async def warm_occupancy_index() -> None:
+    def _warm() -> None:
+        db = SessionLocal()
+        try:
+            spots = occupancy.warm_up(db)
+            startup_log.info("Occupancy index loaded %d spots", spots)
+        except Exception as exc:
+            startup_log.error("Failed to warm occupancy index: %s", exc)
+        finally:
+            db.close()
 
-@app.get("/tickets/", response_model=List[TicketOut])
-def get_tickets(page: int = 1, page_size: int = 50, db: Session = Depends(get_db)):
-    offset = (page - 1) * page_size
-    tickets = (
-        db.query(Ticket)
-        .filter(Ticket.entry_time>"2025-07-28 23:59:59")
-        .order_by(Ticket.id.desc())
-        .offset(offset)
-        .limit(page_size)
-        .all()
+    await asyncio.to_thread(_warm)
+
+
+@app.on_event("startup")
+async def scan_image_variants() -> None:
+    def _scan() -> None:
+        try:
+            summary = image_variants.variants.scan([ENTRY_IMAGE_DIR, CAR_IMAGE_DIR])
+            startup_log.info("Variant cache scanned", extra=summary)
+        except Exception as exc:
+            startup_log.error("Failed to scan the variant cache: %s", exc)
+
+    # Runs in the background: walking large image directories must not delay startup.
+    threading.Thread(target=_scan, name="variant-scan", daemon=True).start()
+
+
+def _requeue_pending_videos() -> int:
+    """Queue again the conversions a previous run left at ``video_status="pending"``.
+
+    Queued conversions only live in memory, so a restart or crash drops
+    them. An original that no longer exists is marked ``failed``. Returns
+    the number of videos queued.
+    """
+
+    db = SessionLocal()
+    try:
+        names = set()
+        for model in VIDEO_STATUS_TABLES:
+            names.update(
+                name for (name,) in db.query(model.exit_video_path).filter(model.video_status == "pending").distinct()
+            )
+    finally:
+        db.close()
+
+    queued = 0
+    for name in sorted(filter(None, names)):
+        path = normalize_video_path(name)
+        if not os.path.isfile(path):
+            video_log.warning("Pending video %s no longer exists", name)
+            _set_video_status(name, "failed")
+        elif _queue_exit_video(path).get("video_job_id"):
+            queued += 1
+    return queued
+
+
+@app.on_event("startup")
+async def requeue_pending_videos() -> None:
+    def _requeue() -> None:
+        try:
+            startup_log.info("Requeued %d pending video conversions", _requeue_pending_videos())
+        except Exception as exc:
+            startup_log.error("Failed to requeue pending video conversions: %s", exc)
+
+    threading.Thread(target=_requeue, name="video-requeue", daemon=True).start()
+
+
+@app.on_event("startup")
+async def warm_plate_index() -> None:
+    def _warm() -> None:
+        db = SessionLocal()
+        try:
+            plate_index.refresh(db)
+            startup_log.info("Plate index loaded %d plates", plate_index.size)
+        except Exception as exc:
+            startup_log.error("Failed to warm plate index: %s", exc)
+        finally:
+            db.close()
+
+    # Loading millions of plates takes minutes; /tickets/search answers 503 meanwhile.
+    threading.Thread(target=_warm, name="plate-index", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def stop_video_queue() -> None:
+    video_queue.shutdown()
+    image_variants.variants.shutdown()
+    traffic_capture.recorder.close()
+
+
+@app.on_event("shutdown")
+async def close_parkonic_client() -> None:
+    await parkonic_client.aclose()
+    parkonic_client.close()
+
+
+@app.get("/parkonic/stats")
+def get_parkonic_stats():
+    """Return per-endpoint latency and error counters for Parkonic calls."""
+    return {**parkonic_client.stats(), "encoded_images": encoded_images.cache.stats()}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics of this process."""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Return the status of a background job started by any server process."""
+    job = job_registry.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+TICKET_FIELDS = tuple(TicketOut.model_fields)
+
+
+def _encode_cursor(direction: str, ticket_id: int) -> str:
+    raw = f"{direction}:{ticket_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, ticket_id = base64.urlsafe_b64decode(padded).decode().split(":")
+        if direction not in ("after", "before"):
+            raise ValueError(direction)
+        return direction, int(ticket_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(TICKET_FIELDS)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in TICKET_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # ``id`` is always returned so clients can build the next cursor themselves.
+    return ["id"] + [f for f in requested if f != "id"]
+
+
+def _list_tickets(
+    db: Session,
+    model,
+    page: int,
+    page_size: int,
+    after_id: Optional[int],
+    before_id: Optional[int],
+    cursor: Optional[str],
+    fields: Optional[str],
+    *filters,
+) -> JSONResponse:
+    """Return one page of *model* rows, newest first.
+
+    Pages are addressed by id (``after_id``/``before_id`` or an opaque
+    ``cursor``) so the cost does not depend on how deep the page is. The
+    plain ``page`` parameter still works for existing clients but is served
+    with ``OFFSET``. Cursors for the adjacent pages are returned in the
+    ``X-Next-Cursor`` and ``X-Prev-Cursor`` headers.
+    """
+
+    if page_size < 1:
+        raise HTTPException(status_code=400, detail="page_size must be positive")
+    if cursor:
+        direction, cursor_id = _decode_cursor(cursor)
+        if direction == "after":
+            after_id = cursor_id
+        else:
+            before_id = cursor_id
+
+    columns = _parse_fields(fields)
+    query = db.query(*(getattr(model, name) for name in columns)).filter(*filters)
+    if after_id is not None:
+        rows = query.filter(model.id < after_id).order_by(model.id.desc()).limit(page_size).all()
+    elif before_id is not None:
+        rows = query.filter(model.id > before_id).order_by(model.id.asc()).limit(page_size).all()
+        rows.reverse()
+    else:
+        offset = (max(page, 1) - 1) * page_size
+        rows = query.order_by(model.id.desc()).offset(offset).limit(page_size).all()
+
+    headers = {}
+    if rows:
+        if len(rows) == page_size or before_id is not None:
+            headers["X-Next-Cursor"] = _encode_cursor("after", rows[-1].id)
+        if after_id is not None or before_id is not None or page > 1:
+            headers["X-Prev-Cursor"] = _encode_cursor("before", rows[0].id)
+
+    content = jsonable_encoder([row._asdict() for row in rows])
+    return JSONResponse(content=content, headers=headers)
+
+
+# ``_list_tickets`` answers with its own ``JSONResponse``: the rows are
+# projected to ``fields`` and the cursors travel in headers, so the routes
+# declare the shape here instead of through ``response_model``.
+TICKET_LIST_RESPONSES = {
+    200: {
+        "model": List[TicketOut],
+        "description": (
+            "Tickets, newest first. With ``fields`` each object only holds ``id`` "
+            "and the requested fields; the other keys are absent."
+        ),
+        "headers": {
+            "X-Next-Cursor": {
+                "description": "Cursor of the next (older) page, when there may be one.",
+                "schema": {"type": "string"},
+            },
+            "X-Prev-Cursor": {
+                "description": "Cursor of the previous (newer) page, when there is one.",
+                "schema": {"type": "string"},
+            },
+        },
+    }
+}
+
+
+def _visible_ticket_filters() -> list:
+    """Filters hiding tickets that entered before ``TICKET_VISIBLE_SINCE``."""
+    return [Ticket.entry_time > TICKET_VISIBLE_SINCE] if TICKET_VISIBLE_SINCE else []
+
+
+@app.get("/tickets/", responses=TICKET_LIST_RESPONSES)
+async def get_tickets(
+    page: int = 1,
+    page_size: int = 50,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    run_db: DbRunner = Depends(get_db_runner),
+):
+    return await run_db(
+        _list_tickets, Ticket, page, page_size, after_id, before_id, cursor, fields, *_visible_ticket_filters()
     )
-    return tickets
+
+
 @app.get("/tickets/next-id")
 def get_next_ticket_id(db: Session = Depends(get_db)):
     """Return the next available ticket id."""
@@ -298,29 +695,91 @@ def get_next_ticket_id(db: Session = Depends(get_db)):
     next_id = (max_id or 0) + 1
     return {"next_id": next_id}
 
-@app.get("/submittedtickets/", response_model=List[TicketOut])
-def get_submitted_tickets(page: int = 1, page_size: int = 50, db: Session = Depends(get_db)):
-    offset = (page - 1) * page_size
-    tickets = (
-        db.query(SubmittedTicket)
-        .order_by(SubmittedTicket.id.desc())
-        .offset(offset)
-        .limit(page_size)
-        .all()
-    )
-    return tickets
+@app.get("/submittedtickets/", responses=TICKET_LIST_RESPONSES)
+async def get_submitted_tickets(
+    page: int = 1,
+    page_size: int = 50,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    run_db: DbRunner = Depends(get_db_runner),
+):
+    return await run_db(_list_tickets, SubmittedTicket, page, page_size, after_id, before_id, cursor, fields)
+
+@app.get("/cancelledtickets/", responses=TICKET_LIST_RESPONSES)
+async def get_cancelled_tickets(
+    page: int = 1,
+    page_size: int = 50,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    run_db: DbRunner = Depends(get_db_runner),
+):
+    return await run_db(_list_tickets, CancelledTicket, page, page_size, after_id, before_id, cursor, fields)
+SEARCH_TABLES = (
+    ("ticket", Ticket),
+    ("submitted", SubmittedTicket),
+    ("cancelled", CancelledTicket),
+    ("submitted_archive", SubmittedTicketArchive),
+    ("cancelled_archive", CancelledTicketArchive),
+)
+
+
+@app.get("/tickets/search")
+def search_tickets(
+    plate: str,
+    max_distance: int = Query(1, ge=0, le=2),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    """Find tickets in all ticket tables, archives included, whose plate is close to *plate*.
+
+    ``max_distance`` is the number of character edits (after removing
+    spaces and punctuation) tolerated for OCR misreads. Results are ordered
+    by distance, then newest entry first. It may be at most half the length
+    of the cleaned plate. Answers ``503`` while the plate index is still
+    loading after a restart.
+    """
+
+    cleaned = clean_plate(plate)
+    if not cleaned:
+        raise HTTPException(status_code=400, detail="plate must contain letters or digits")
+    if max_distance > len(cleaned) // 2:
+        raise HTTPException(status_code=400, detail=f"max_distance may be at most {len(cleaned) // 2} for this plate")
+    if plate_index.loading:
+        raise HTTPException(status_code=503, detail="Plate index is loading", headers={"Retry-After": "30"})
+    plate_index.refresh_if_stale(db)
+    matches = plate_index.search(plate, max_distance)
+    distances = {}
+    for distance, _, numbers in matches:
+        for number in numbers:
+            distances[number] = distance
+    if not distances:
+        return {"plate": clean_plate(plate), "results": []}
+
+    results = []
+    numbers = list(distances)
+    for table, model in SEARCH_TABLES:
+        rows = (
+            db.query(model)
+            .filter(model.number.in_(numbers))
+            .order_by(model.entry_time.desc())
+            .limit(limit)
+            .all()
+        )
+        for row in rows:
+            item = TicketOut.model_validate(row).model_dump()
+            item["table"] = table
+            item["distance"] = distances.get(row.number, levenshtein(clean_plate(plate), clean_plate(row.number)))
+            results.append(item)
+
+    results.sort(key=lambda item: item["entry_time"] or datetime.min, reverse=True)
+    results.sort(key=lambda item: item["distance"])
+    return jsonable_encoder({"plate": clean_plate(plate), "results": results[:limit]})
+
 
-@app.get("/cancelledtickets/", response_model=List[TicketOut])
-def get_cancelled_tickets(page: int = 1, page_size: int = 50, db: Session = Depends(get_db)):
-    offset = (page - 1) * page_size
-    tickets = (
-        db.query(CancelledTicket)
-        .order_by(CancelledTicket.id.desc())
-        .offset(offset)
-        .limit(page_size)
-        .all()
-    )
-    return tickets
 @app.post("/login")
 def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == form_data.username).first()
@@ -330,9 +789,6 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-def clean_plate(p: str) -> str:
-    return re.sub(r"[^A-Z0-9]", "", (p or "").upper())
-
 def plate_similarity_strict(p1: str, p2: str) -> float:
     p1, p2 = clean_plate(p1), clean_plate(p2)
     n = min(len(p1), len(p2))
@@ -342,12 +798,24 @@ def plate_similarity_strict(p1: str, p2: str) -> float:
     return matches / max(len(p1), len(p2))
 
 
-@app.post("/ticket")
-def create_ticket(ticket: TicketCreate, db: Session = Depends(get_db)):
-    ref_time = ticket.entry_time or ticket.exit_time or datetime.now()
-    day_start = ref_time.replace(hour=0, minute=0, second=0, microsecond=0)
-    day_end = day_start + timedelta(days=1)
-    # time_threshold = max(ref_time - timedelta(hours=2), day_start)
+def _same_plate_number(a: Optional[str], b: Optional[str]) -> bool:
+    """Compare plate numbers the way the database collation does."""
+    if a is None or b is None:
+        return a is b
+    return a.rstrip().upper() == b.rstrip().upper()
+
+
+def _latest_same_plate(
+    db: Session, ticket: TicketCreate, day_end: datetime, spot: LockedSpot
+) -> Optional[Ticket]:
+    """Return the spot's latest ticket before *day_end* if it has the same plate number."""
+
+    latest = spot.latest
+    if latest is None:
+        return None
+    # Events older than the spot's latest ticket fall back to the queries below.
+    if latest.entry_time < day_end:
+        return latest if _same_plate_number(latest.number, ticket.number) else None
 
     existing = (
         db.query(Ticket)
@@ -368,93 +836,143 @@ def create_ticket(ticket: TicketCreate, db: Session = Depends(get_db)):
     #     if time_diff > timedelta(hours=2):
     #         existing = None
 
-    if existing:
-        latest = (
-            db.query(Ticket)
-            .filter(
-                Ticket.spot_number == ticket.spot_number,
-                Ticket.access_point_id == ticket.access_point_id,
-                # Ticket.entry_time >= time_threshold,
-                Ticket.entry_time < day_end,
-            )
-            .order_by(Ticket.entry_time.desc())
-            .first()
-        )
-        if latest and latest.id == existing.id:
-            if ticket.exit_time:
-                existing.exit_time = ticket.exit_time
-            if ticket.exit_video_path:
-                normalized_video = normalize_video_path(ticket.exit_video_path)
-                if is_video_file(normalized_video) and "_bf" not in os.path.splitext(normalized_video)[0]:
-                    try:
-                        converted = make_browser_friendly(normalized_video)
-                        existing.exit_video_path = os.path.basename(converted)
-                    except Exception as exc:
-                        print(f"Failed to convert {ticket.exit_video_path}: {exc}")
-                else:
-                    existing.exit_video_path = os.path.basename(normalized_video)
-            db.commit()
-            db.refresh(existing)
-            print("Ticket exit time updated")
-            return success_response("Ticket exit time updated", existing.id)
-
-    
-    # // ADD BY MHD
-    last_car = (
+    if not existing:
+        return None
+
+    latest = (
         db.query(Ticket)
         .filter(
             Ticket.spot_number == ticket.spot_number,
             Ticket.access_point_id == ticket.access_point_id,
+            # Ticket.entry_time >= time_threshold,
+            Ticket.entry_time < day_end,
         )
-        .order_by(Ticket.id.desc())
+        .order_by(Ticket.entry_time.desc())
         .first()
     )
+    if latest and latest.id == existing.id:
+        return existing
+    return None
 
-    print("New car detected:")
-    print(f"  Spot: {ticket.spot_number}, Access Point: {ticket.access_point_id}")
-    print(f"  Plate: {ticket.code} {ticket.number}")
 
-    if last_car:
-        print(f"  Last car in this spot: {last_car.code} {last_car.number}")
+def _try_fast_exit_update(
+    db: Session, ticket: TicketCreate, day_end: datetime, values: dict
+) -> Optional[int]:
+    """Update the spot's current ticket in one statement when the occupancy hint allows it.
+
+    Returns the updated ticket id, or None when the locked path must decide.
+    Does not commit.
+    """
 
+    hint = occupancy.peek(ticket.access_point_id, ticket.spot_number)
+    latest = hint.latest if hint else None
+    if (
+        latest is None
+        or latest.entry_time is None
+        or latest.entry_time >= day_end
+        or not _same_plate_number(latest.number, ticket.number)
+    ):
+        return None
+    if not update_if_latest(
+        db, latest.id, ticket.access_point_id, ticket.spot_number, ticket.number, day_end, values
+    ):
+        return None
+    return latest.id
+
+
+class IngestOutcome(NamedTuple):
+    message: str
+    ticket_id: int
+    # "updated", "similar_plate" or "created"
+    kind: str
+    # Exit video to convert once the transaction is committed.
+    video_path: Optional[str]
+    # The locked spot, or None when the fast exit update applied.
+    spot: Optional[LockedSpot]
+
+
+def _apply_ticket(
+    ticket: TicketCreate,
+    db: Session,
+    save_images: Callable[[str, str], tuple[str, str]],
+    spot: Optional[LockedSpot] = None,
+    video_path: Optional[str] = None,
+) -> IngestOutcome:
+    """Apply the spot/plate dedup rules to a camera event.
+
+    The event either updates the spot's current ticket or creates a new one.
+    ``save_images(entry_path, car_path)`` is only called in the latter case
+    and must write both images, returning the stored paths.
+
+    Decisions are made while holding the spot's ``SpotState`` row lock, so
+    simultaneous events for the same spot cannot both create a ticket. Pass
+    *spot* when the caller already holds that lock. *video_path* is the exit
+    video already resolved with :func:`normalize_video_path`, which touches
+    the file system; it is resolved here when omitted. Does not commit.
+    """
+
+    ref_time = ticket.entry_time or ticket.exit_time or datetime.now()
+    day_start = ref_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_end = day_start + timedelta(days=1)
+    # time_threshold = max(ref_time - timedelta(hours=2), day_start)
+
+    normalized_video = None
+    updates = {}
+    if ticket.exit_time:
+        updates["exit_time"] = ticket.exit_time
+    if ticket.exit_video_path:
+        normalized_video = video_path or normalize_video_path(ticket.exit_video_path)
+        updates["exit_video_path"] = os.path.basename(normalized_video)
+        updates["video_status"] = _video_status_for(normalized_video)
+
+    if spot is None:
+        updated_id = _try_fast_exit_update(db, ticket, day_end, updates)
+        if updated_id is not None:
+            ingest_log.info("Ticket exit time updated", extra={"ticket_id": updated_id})
+            return IngestOutcome("Ticket exit time updated", updated_id, "updated", normalized_video, None)
+        spot = lock_spot(db, ticket.access_point_id, ticket.spot_number)
+
+    existing = _latest_same_plate(db, ticket, day_end, spot)
+    if existing:
+        for field, value in updates.items():
+            setattr(existing, field, value)
+        ingest_log.info("Ticket exit time updated", extra={"ticket_id": existing.id})
+        return IngestOutcome("Ticket exit time updated", existing.id, "updated", normalized_video, spot)
+
+    # // ADD BY MHD
+    last_car = spot.last
+
+    spot_fields = {"spot_number": ticket.spot_number, "access_point_id": ticket.access_point_id}
+    ingest_log.info("New car detected", extra={**spot_fields, "plate": f"{ticket.code} {ticket.number}"})
+
+    if last_car:
         new_plate_full = f"{ticket.code}-{ticket.number}".upper()
         old_plate_full = f"{last_car.code}-{last_car.number}".upper()
 
         similarity = plate_similarity_strict(new_plate_full, old_plate_full)
-        print(f"[PLATE CHECK] new={new_plate_full}, last={old_plate_full}, similarity={similarity:.2f}")
+        plate_log.info(
+            "Plate check",
+            extra={**spot_fields, "new": new_plate_full, "last": old_plate_full, "similarity": round(similarity, 2)},
+        )
 
         # ✅ If similar → update last ticket instead of creating new one
         if similarity >= 0.6:
-            print(f"[DUPLICATE] Similar plate detected ({similarity:.2f}) → updating last ticket #{last_car.id}")
-
-            # Update exit time if provided
-            if ticket.exit_time:
-                last_car.exit_time = ticket.exit_time
-
-            # Update exit video if provided
-            if ticket.exit_video_path:
-                normalized_video = normalize_video_path(ticket.exit_video_path)
-                if is_video_file(normalized_video) and "_bf" not in os.path.splitext(normalized_video)[0]:
-                    try:
-                        converted = make_browser_friendly(normalized_video)
-                        last_car.exit_video_path = os.path.basename(converted)
-                        print(f"Exit video converted and updated for ticket #{last_car.id}")
-                    except Exception as exc:
-                        print(f"Failed to convert {ticket.exit_video_path}: {exc}")
-                else:
-                    last_car.exit_video_path = os.path.basename(normalized_video)
-                    print(f"Exit video updated for ticket #{last_car.id}")
-
-            # Commit database changes
-            db.commit()
-            db.refresh(last_car)
-            print(f"Ticket #{last_car.id} updated successfully (exit time/video).")
-            return success_response("Similar plate detected → Ticket updated", last_car.id)
+
+            # Update exit time and video if provided; conversion happens after commit
+            for field, value in updates.items():
+                setattr(last_car, field, value)
+            ingest_log.info(
+                "Similar plate detected, ticket updated",
+                extra={"ticket_id": last_car.id, "similarity": round(similarity, 2), "exit_video": bool(normalized_video)},
+            )
+            return IngestOutcome(
+                "Similar plate detected → Ticket updated", last_car.id, "similar_plate", normalized_video, spot
+            )
 
         else:
-            print(f"[INFO] Different plate detected ({similarity:.2f}) → new car, creating new ticket.")
+            ingest_log.debug("Different plate detected, creating new ticket", extra=spot_fields)
     else:
-        print("No previous car found for this spot.")
+        ingest_log.debug("No previous car found for this spot", extra=spot_fields)
 
     #!//////////////
 
@@ -462,20 +980,9 @@ def create_ticket(ticket: TicketCreate, db: Session = Depends(get_db)):
     filename_car = f"{uuid.uuid4()}.jpg"
     full_path_in = os.path.join(ENTRY_IMAGE_DIR, filename_in)
     full_path_car = os.path.join(CAR_IMAGE_DIR, filename_car)
-    in_image = save_base64_jpg(ticket.entry_pic_base64, full_path_in)
-    car_im = save_base64_jpg(ticket.car_pic_base64, full_path_car)
+    in_image, car_im = save_images(full_path_in, full_path_car)
 
-    exit_video_filename = ticket.exit_video_path
-    if ticket.exit_video_path:
-        normalized_video = normalize_video_path(ticket.exit_video_path)
-        if is_video_file(normalized_video) and "_bf" not in os.path.splitext(normalized_video)[0]:
-            try:
-                converted = make_browser_friendly(normalized_video)
-                exit_video_filename = os.path.basename(converted)
-            except Exception as exc:
-                print(f"Failed to convert {ticket.exit_video_path}: {exc}")
-        else:
-            exit_video_filename = os.path.basename(normalized_video)
+    exit_video_filename = updates.get("exit_video_path", ticket.exit_video_path)
 
     db_ticket = Ticket(
         token=ticket.token,
@@ -491,13 +998,213 @@ def create_ticket(ticket: TicketCreate, db: Session = Depends(get_db)):
         entry_pic_base64=in_image,
         car_pic=car_im,
         exit_video_path=exit_video_filename,
+        video_status=updates.get("video_status"),
     )
 
     db.add(db_ticket)
+    db.flush()
+    spot = record_created(spot, db_ticket)
+    ingest_log.info("Ticket created", extra={**spot_fields, "ticket_id": db_ticket.id})
+    return IngestOutcome("Ticket created successfully", db_ticket.id, "created", normalized_video, spot)
+
+
+def _ingest_ticket(
+    ticket: TicketCreate,
+    db: Session,
+    save_images: Callable[[str, str], tuple[str, str]],
+    video_path: Optional[str] = None,
+) -> JSONResponse:
+    """Apply one camera event with :func:`_apply_ticket` and commit it."""
+
+    outcome = _apply_ticket(ticket, db, save_images, video_path=video_path)
+    snapshot = SpotSnapshot.of(outcome.spot.latest, outcome.spot.last) if outcome.spot else None
     db.commit()
-    db.refresh(db_ticket)
-    print('Ticket created successfully')
-    return success_response("Ticket created successfully", db_ticket.id)
+    if snapshot:
+        occupancy.store(ticket.access_point_id, ticket.spot_number, snapshot)
+    metrics.TICKET_INGEST.inc(outcome=outcome.kind)
+    if outcome.kind == "created":
+        plate_index.add(ticket.number)
+    return success_response(outcome.message, outcome.ticket_id, **_queue_exit_video(outcome.video_path))
+
+
+@app.post("/ticket")
+async def create_ticket(ticket: TicketCreate, run_db: DbRunner = Depends(get_db_runner)):
+    traffic_capture.recorder.record("ticket", ticket)
+
+    def _store_images(path_in: str, path_car: str) -> tuple[str, str]:
+        return (
+            image_store.store(decode_base64_jpg(ticket.entry_pic_base64), path_in),
+            image_store.store(decode_base64_jpg(ticket.car_pic_base64), path_car),
+        )
+
+    def _save_images(path_in: str, path_car: str) -> tuple[str, str]:
+        return run_db.blocking(_store_images, path_in, path_car)
+
+    # Resolved off the event loop: with DB_ASYNC=1 the ingest itself runs on it.
+    video_path = await asyncio.to_thread(normalize_video_path, ticket.exit_video_path) if ticket.exit_video_path else None
+    return await run_db(lambda db: _ingest_ticket(ticket, db, _save_images, video_path))
+
+
+@app.post("/ticket/multipart")
+def create_ticket_multipart(
+    ticket: str = Form(...),
+    entry_pic: UploadFile = File(...),
+    car_pic: UploadFile = File(...),
+    db: Session = Depends(get_db),
+):
+    """Create a ticket from multipart form data.
+
+    ``ticket`` holds the ``TicketCreate`` fields as JSON (without the base64
+    images); ``entry_pic`` and ``car_pic`` are the raw JPEG parts. Follows the
+    same dedup rules as ``POST /ticket``.
+    """
+
+    try:
+        ticket_data = TicketCreate.model_validate_json(ticket)
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(exc.errors()))
+    traffic_capture.recorder.record(
+        "multipart", ticket_data, image_bytes={"entry_pic": entry_pic.size, "car_pic": car_pic.size}
+    )
+
+    def _save_images(path_in: str, path_car: str) -> tuple[str, str]:
+        return image_store.store_stream(entry_pic.file, path_in), image_store.store_stream(car_pic.file, path_car)
+
+    return _ingest_ticket(ticket_data, db, _save_images)
+
+
+_TICKET_LIST = TypeAdapter(List[TicketCreate])
+
+
+async def _read_body(request: Request, max_bytes: int) -> bytes:
+    """Read the request body, answering ``413`` as soon as it exceeds *max_bytes*."""
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Request body larger than {max_bytes} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Request body larger than {max_bytes} bytes")
+    return bytes(body)
+
+
+@app.post(
+    "/tickets/batch",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": {"$ref": "#/components/schemas/TicketCreate"}}
+                }
+            },
+        }
+    },
+)
+async def create_tickets_batch(request: Request, db: Session = Depends(get_db)):
+    """Apply a buffered backlog of camera events in order.
+
+    The body is a JSON list of ``TicketCreate`` items, at most
+    ``TICKET_BATCH_MAX`` of them and ``TICKET_BATCH_MAX_BYTES`` in total; the
+    size is checked before anything is parsed. Each item follows the same
+    dedup rules as ``POST /ticket`` and runs in its own savepoint, so a bad
+    item is reported without affecting the others. Images are written
+    concurrently and everything is committed once at the end. The response
+    lists one result per item.
+    """
+
+    body = await _read_body(request, TICKET_BATCH_MAX_BYTES)
+    try:
+        tickets = _TICKET_LIST.validate_json(body)
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(exc.errors()))
+    del body
+    if len(tickets) > TICKET_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {TICKET_BATCH_MAX} tickets per batch")
+    return await run_in_threadpool(_apply_ticket_batch, tickets, db)
+
+
+def _apply_ticket_batch(tickets: List[TicketCreate], db: Session):
+    traffic_capture.recorder.record("batch", tickets)
+
+    # Lock every spot up front in a fixed order so concurrent batches cannot deadlock.
+    spot_keys = {(t.access_point_id, t.spot_number) for t in tickets}
+    spots: Dict[tuple, LockedSpot] = {}
+    for key in sorted(spot_keys, key=lambda k: tuple(NULL_KEY if v is None else v for v in k)):
+        spots[key] = lock_spot(db, *key)
+
+    results: List[dict] = []
+    outcomes: List[Optional[IngestOutcome]] = []
+    writes = []
+    written: List[str] = []
+    orphans: List[str] = []
+    with ThreadPoolExecutor(max_workers=TICKET_BATCH_IMAGE_WORKERS) as pool:
+        for index, ticket in enumerate(tickets):
+            key = (ticket.access_point_id, ticket.spot_number)
+
+            def _save_images(path_in: str, path_car: str, ticket: TicketCreate = ticket) -> tuple[str, str]:
+                # Decode here so bad input fails this item; the disk writes run in the pool.
+                paths = []
+                for b64, suggested in ((ticket.entry_pic_base64, path_in), (ticket.car_pic_base64, path_car)):
+                    data = decode_base64_jpg(b64)
+                    path = image_store.target_path(data, suggested)
+                    writes.append(pool.submit(image_store.write, data, path))
+                    written.append(path)
+                    paths.append(path)
+                return paths[0], paths[1]
+
+            first_file = len(written)
+            savepoint = db.begin_nested()
+            try:
+                outcome = _apply_ticket(ticket, db, _save_images, spot=spots.get(key))
+                savepoint.commit()
+            except OperationalError:
+                raise
+            except (SQLAlchemyError, ValueError, OSError) as exc:
+                savepoint.rollback()
+                orphans.extend(written[first_file:])
+                del written[first_file:]
+                # The rollback may have discarded objects the cached spot refers to.
+                spots[key] = lock_spot(db, *key)
+                ingest_log.warning("Batch item %d failed: %s", index, exc)
+                outcomes.append(None)
+                results.append({"index": index, "status": "error", "detail": str(exc)})
+                continue
+            spots[key] = outcome.spot
+            outcomes.append(outcome)
+            results.append({"index": index, "status": "ok", "message": outcome.message, "id": outcome.ticket_id})
+
+        try:
+            for future in writes:
+                future.result()
+        except OSError as exc:
+            db.rollback()
+            image_store.discard(written + orphans)
+            raise HTTPException(status_code=500, detail=f"Failed to store images: {exc}")
+    image_store.discard(orphans)
+
+    snapshots = {key: SpotSnapshot.of(spot.latest, spot.last) for key, spot in spots.items()}
+    try:
+        db.commit()
+    except BaseException:
+        image_store.discard(written)
+        raise
+    for key, snapshot in snapshots.items():
+        occupancy.store(*key, snapshot)
+
+    for ticket, result, outcome in zip(tickets, results, outcomes):
+        if outcome is not None:
+            metrics.TICKET_INGEST.inc(outcome=outcome.kind)
+            if outcome.kind == "created":
+                plate_index.add(ticket.number)
+            result.update(_queue_exit_video(outcome.video_path))
+    failed = sum(1 for outcome in outcomes if outcome is None)
+    return success_response(
+        "Batch processed", None, processed=len(tickets) - failed, failed=failed, results=results
+    )
+
 
 def _is_absolute_url(value: Optional[str]) -> bool:
     if not value:
@@ -534,7 +1241,7 @@ def get_next_ticket(id: int, db: Session = Depends(get_db)):
     """Return the next ticket with an id greater than the provided id."""
     ticket = (
         db.query(Ticket)
-        .filter(Ticket.entry_time>"2025-07-28 23:59:59")
+        .filter(*_visible_ticket_filters())
         .filter(Ticket.id > id)
         .order_by(Ticket.id)
         .first()
@@ -542,161 +1249,167 @@ def get_next_ticket(id: int, db: Session = Depends(get_db)):
     if not ticket:
          ticket = (
         db.query(Ticket)
-        .filter(Ticket.entry_time>"2025-07-28 23:59:59")
+        .filter(*_visible_ticket_filters())
         .order_by(Ticket.id)
         .first()
     )
     return ticket
 @app.post("/upload-video")
-async def upload_video(file: UploadFile = File(...)):
+async def upload_video(request: Request, file: UploadFile = File(...)):
+    declared_size = request.headers.get("content-length")
+    if MAX_UPLOAD_BYTES and declared_size and declared_size.isdigit() and int(declared_size) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+
     file_extension = os.path.splitext(file.filename)[1]
     unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
 
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    content = await file.read()
-    await _write_bytes(file_path, content)
+    directory = os.path.dirname(layout_path(UPLOAD_FOLDER, unique_filename))
+    os.makedirs(directory, exist_ok=True)
+    file_path, size, sha256 = await _stream_to_file(file, directory, unique_filename, MAX_UPLOAD_BYTES)
     response_name = unique_filename
     if is_video_file(file_path) and "_bf" not in os.path.splitext(file_path)[0]:
         try:
             converted = await _convert_video(file_path)
             response_name = os.path.basename(converted)
+        except ConversionQueueFull as exc:
+            video_log.warning("Keeping %s unconverted: %s", file_path, exc)
         except Exception as exc:
-            print(f"Failed to convert {file_path}: {exc}")
+            video_log.error("Failed to convert %s: %s", file_path, exc)
 
-    return success_response("File uploaded successfully", response_name, file_name=response_name)
+    return success_response(
+        "File uploaded successfully", response_name, file_name=response_name, size=size, sha256=sha256
+    )
 
 
 @app.post("/submit/{ticket_id}")
-def submit_t(ticket_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    """Schedule ticket submission in the background."""
+def submit_t(ticket_id: int, db: Session = Depends(get_db)):
+    """Queue ticket submission in the durable outbox.
+
+    Poll ``/submission-jobs/{job_id}`` for progress.
+    """
 
     exists = db.query(Ticket.id).filter(Ticket.id == ticket_id).first()
     if not exists:
         raise HTTPException(status_code=404, detail="Ticket not found")
 
-    background_tasks.add_task(submit_ticket, ticket_id)
-    return success_response("Submission scheduled", ticket_id)
+    job = submission_outbox.enqueue(db, ticket_id)
+    db.commit()
+    submission_workers.wake()
+    return success_response("Submission scheduled", ticket_id, job_id=job.id, state=job.state, step=job.step)
 
 
-@app.post("/submit-under-hour")
-def submit_short_tickets(db: Session = Depends(get_db)):
-    """Submit all tickets with duration under one hour."""
-    tickets = db.query(Ticket).filter(Ticket.exit_time != None).all()
-    ids_to_submit = []
+@app.get("/submission-jobs/{job_id}")
+def get_submission_job(job_id: int, db: Session = Depends(get_db)):
+    """Return the state of a queued ticket submission."""
 
-    for t in tickets:
-        if not t.entry_time or not t.exit_time:
-            continue
+    job = db.get(SubmissionJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Submission job not found")
+    return submission_outbox.job_to_dict(job)
 
-        duration = t.exit_time - t.entry_time
-        print(f"Ticket {t.id} duration: {duration}")
 
-        if timedelta(0) <= duration < timedelta(hours=1):
-            ids_to_submit.append(t.id)
+@app.post("/submit-under-hour")
+def submit_short_tickets(db: Session = Depends(get_db)):
+    """Submit all tickets with duration under one hour.
 
-    for tid in ids_to_submit:
-        submit_ticket(tid)
+    The tickets are queued in the submission outbox; poll ``/jobs/{job_id}``
+    for the progress of the whole run.
+    """
+    ids_to_submit = select_short_ticket_ids(db)
+    job = start_bulk_submission(SessionLocal, ids_to_submit, "under_hour", wake=submission_workers.wake)
 
     return success_response(
-        "Submitted tickets under one hour",
+        "Submitting tickets under one hour",
         ids_to_submit,
         submitted=len(ids_to_submit),
+        job_id=job.id,
     )
 
-def submit_ticket(ticket_id: int, db: Session | None = None):
-    """Submit a ticket by calling park-in then park-out APIs."""
+class ParkonicSubmission(SubmissionSteps):
+    """Parkonic calls and ticket move made by the submission outbox workers."""
 
-    owns_session = db is None
-    if db is None:
-        db = SessionLocal()
-
-    try:
-        ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
-        if not ticket:
-            raise HTTPException(status_code=404, detail="Ticket not found")
-
-        car_bs64 = ""
-        in_bs64 = ""
+    def park_in(self, ticket: Ticket):
         normalized_path_car = normalize_path_car(ticket.car_pic)
-        with open(normalized_path_car, "rb") as f:
-            car_bytes = f.read()
-        car_bs64 = base64.b64encode(car_bytes).decode("utf-8")
         normalized_path = normalize_path(ticket.entry_pic_base64)
-        with open(normalized_path, "rb") as d:
-            in_bytes = d.read()
-        in_bs64 = base64.b64encode(in_bytes).decode("utf-8")
-        print(ticket.token)
 
-        parkin_resp = park_in_request(
-            token=ticket.token,
-            parkin_time=(ticket.entry_time or datetime.utcnow()).isoformat(),
-            plate_code=ticket.code or "",
-            plate_number=ticket.number or "",
-            emirates=ticket.city or "",
-            conf=str(ticket.ticket_key_id or ""),
-            spot_number=ticket.spot_number or 0,
-            pole_id=ticket.access_point_id or 0,
-            images=[car_bs64, in_bs64],
-        )
-        print(parkin_resp)
+        # The encoded images come from a spill cache and are streamed into the request.
+        with encoded_images.cache.encoded(normalized_path_car) as car_b64, \
+                encoded_images.cache.encoded(normalized_path) as in_b64:
+            parkin_resp = park_in_request(
+                token=ticket.token,
+                parkin_time=(ticket.entry_time or datetime.utcnow()).isoformat(),
+                plate_code=ticket.code or "",
+                plate_number=ticket.number or "",
+                emirates=ticket.city or "",
+                conf=str(ticket.ticket_key_id or ""),
+                spot_number=ticket.spot_number or 0,
+                pole_id=ticket.access_point_id or 0,
+                image_files=[car_b64.path, in_b64.path],
+            )
+        submit_log.info("Park-in response", extra={"ticket_id": ticket.id, "token": ticket.token, "response": parkin_resp})
 
         trip_id = None
         if isinstance(parkin_resp, dict):
             trip_id = parkin_resp.get("trip_id") or parkin_resp.get("data", {}).get("trip_id")
         if not trip_id:
-            print(f"Failed to obtain trip id for ticket {ticket_id}")
-            return {"status": "error", "detail": "Failed to obtain trip id"}
-
-        ticket.trip_p_id = trip_id
-        ticket.status = "submitted"
-        db.commit()
-        db.refresh(ticket)
+            raise SubmissionError("Failed to obtain trip id")
+        return trip_id, parkin_resp
 
-        parkout_resp = park_out_request(
+    def park_out(self, ticket: Ticket, trip_id: int):
+        parkout_resp = park_out_response(
             token=ticket.token,
             parkout_time=(ticket.exit_time or datetime.utcnow()).isoformat(),
             spot_number=ticket.spot_number or 0,
             pole_id=ticket.access_point_id or 0,
             trip_id=trip_id,
         )
-
-        submitted = SubmittedTicket(
-            token=ticket.token,
-            access_point_id=ticket.access_point_id,
-            number=ticket.number,
-            code=ticket.code,
-            city=ticket.city,
-            status="submitted",
-            entry_time=ticket.entry_time,
-            exit_time=ticket.exit_time,
-            entry_pic_base64=normalized_path,
-            car_pic=normalized_path_car,
-            exit_video_path=ticket.exit_video_path,
-            spot_number=ticket.spot_number,
-            trip_p_id=ticket.trip_p_id,
-            ticket_key_id=ticket.ticket_key_id,
+        submit_log.info("Park-out response", extra={"ticket_id": ticket.id, "trip_id": trip_id, "response": parkout_resp})
+        if isinstance(parkout_resp, str):
+            # No 2xx answer (network error, error status or open circuit breaker).
+            raise SubmissionError(f"Park-out failed: {parkout_resp}")
+        if "error" in parkout_resp:
+            # Parkonic answered, so the ticket is moved as before; sending the
+            # park-out again would only duplicate it.
+            submit_log.warning(
+                "Park-out answered with an error", extra={"ticket_id": ticket.id, "trip_id": trip_id, "response": parkout_resp}
+            )
+        return parkout_resp
+
+    def complete(self, db: Session, ticket: Ticket) -> int:
+        submitted_id = move_ticket(
+            db,
+            ticket.id,
+            Ticket,
+            SubmittedTicket,
+            {
+                "status": "submitted",
+                "entry_pic_base64": normalize_path(ticket.entry_pic_base64),
+                "car_pic": normalize_path_car(ticket.car_pic),
+            },
         )
-        db.add(submitted)
-        db.delete(ticket)
-        db.commit()
-        db.refresh(submitted)
+        if submitted_id is None:
+            raise SubmissionError("Ticket not found", permanent=True)
+        return submitted_id
+
+    def completed(self, ticket_id: int, spot) -> None:
+        occupancy.invalidate(*spot)
+        _forget_ticket_media(ticket_id)
+
+
+submission_steps = ParkonicSubmission()
+submission_workers = SubmissionWorkers(SessionLocal, submission_steps)
+
+
+@app.on_event("startup")
+def start_submission_workers() -> None:
+    submission_workers.start()
+
+
+@app.on_event("shutdown")
+def stop_submission_workers() -> None:
+    submission_workers.stop()
+
 
-        return success_response(
-            "Ticket submitted successfully",
-            submitted.id,
-            park_in=parkin_resp,
-            park_out=parkout_resp,
-        )
-    except HTTPException as exc:
-        print(f"Failed to submit ticket {ticket_id}: {exc.detail}")
-        return {"status": "error", "detail": exc.detail}
-    except Exception as exc:
-        print(f"Unexpected error submitting ticket {ticket_id}: {exc}")
-        return {"status": "error", "detail": str(exc)}
-    finally:
-        if owns_session:
-            db.close()
 # @app.get("/fix")
 # def fix_db(db: Session = Depends(get_db)):
 #     tickets = db.query(Ticket).filter(Ticket.token == 'buOs11IDXwseQCb3bLvAxNv0Gx4HLC21Um').all()
@@ -726,34 +1439,73 @@ def submit_ticket(ticket_id: int, db: Session | None = None):
 
 @app.post("/ticket/{id}/cancel", response_model=TicketOut)
 def cancel_ticket(id: int, db: Session = Depends(get_db)):
-    ticket = db.query(Ticket).filter(Ticket.id == id).first()
-    if not ticket:
+    rows = lock_tickets(db, [id])
+    if not rows:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    cancelled = CancelledTicket(
-        token=ticket.token,
-        access_point_id=ticket.access_point_id,
-        number=ticket.number,
-        code=ticket.code,
-        city=ticket.city,
-        status="cancelled",
-        entry_time=ticket.entry_time,
-        exit_time=ticket.exit_time,
-        entry_pic_base64=ticket.entry_pic_base64,
-        car_pic=ticket.car_pic,
-        exit_video_path=ticket.exit_video_path,
-        spot_number=ticket.spot_number,
-        trip_p_id=ticket.trip_p_id,
-        ticket_key_id=ticket.ticket_key_id,
-    )
-    db.add(cancelled)
-    db.delete(ticket)
+    cancelled_id = move_ticket(db, id, Ticket, CancelledTicket, {"status": "cancelled"})
     db.commit()
-    db.refresh(cancelled)
-    ticket_payload = TicketOut.from_orm(cancelled).dict()
+    occupancy.invalidate(rows[0].access_point_id, rows[0].spot_number)
+    _forget_ticket_media(id)
+    cancelled = db.get(CancelledTicket, cancelled_id)
+    ticket_payload = TicketOut.model_validate(cancelled).model_dump()
     return success_response("Ticket cancelled successfully", cancelled.id, ticket=ticket_payload)
 
 
-def merge_duplicate_tickets(db: Session) -> dict:
+class BulkCancelRequest(BaseModel):
+    ids: List[int]
+
+
+@app.post("/tickets/cancel-bulk")
+def cancel_tickets_bulk(request: BulkCancelRequest, db: Session = Depends(get_db)):
+    """Move many tickets to ``CancelledTicket`` in one transaction."""
+
+    rows = lock_tickets(db, request.ids)
+    found = [row.id for row in rows]
+    cancelled = cancel_tickets(db, found)
+    db.commit()
+    for row in rows:
+        occupancy.invalidate(row.access_point_id, row.spot_number)
+        _forget_ticket_media(row.id)
+
+    missing = sorted(set(request.ids) - set(found))
+    return success_response("Tickets cancelled successfully", found, cancelled=cancelled, missing=missing)
+
+
+MERGE_CHUNK_SIZE = int(os.environ.get("MERGE_CHUNK_SIZE", "1000"))
+
+
+def _ranked_tickets():
+    """Tickets ranked within their duplicate group.
+
+    A group is the plate number, code, city, spot number, access point and
+    calendar day of ``entry_time``. ``rn`` is 1 for the earliest entry, which
+    is the ticket kept by a merge; ``max_exit`` is the group's latest exit.
+    """
+
+    group = (
+        Ticket.number,
+        Ticket.code,
+        Ticket.city,
+        Ticket.spot_number,
+        Ticket.access_point_id,
+        func.date(Ticket.entry_time),
+    )
+    order = (Ticket.entry_time, Ticket.id)
+    return (
+        select(
+            Ticket.id,
+            Ticket.access_point_id,
+            Ticket.spot_number,
+            func.row_number().over(partition_by=group, order_by=order).label("rn"),
+            func.first_value(Ticket.id).over(partition_by=group, order_by=order).label("keeper_id"),
+            func.max(Ticket.exit_time).over(partition_by=group).label("max_exit"),
+        )
+        .where(Ticket.entry_time != None)
+        .subquery()
+    )
+
+
+def merge_duplicate_tickets(db: Session, job: Optional[Job] = None, chunk_size: int = MERGE_CHUNK_SIZE) -> dict:
     """Merge tickets with identical plate and location info on the same day.
 
     For each set of tickets sharing plate number, code, city, spot number and
@@ -762,119 +1514,319 @@ def merge_duplicate_tickets(db: Session) -> dict:
     seen in the set. All other tickets are moved to ``CancelledTicket`` and
     removed from ``Ticket``.
 
+    Groups are found with one window-function query in the database, which
+    returns only the duplicates with their keeper. They are then moved in
+    chunks of *chunk_size*, one transaction per chunk; the ranking is not
+    recomputed between chunks, so each ticket and group is counted once.
+
     :param db: Active database session.
-    :return: Summary with number of merged groups.
+    :param job: Optional job that receives progress updates.
+    :return: Summary with number of merged groups and moved tickets.
     """
 
-    tickets = db.query(Ticket).order_by(Ticket.entry_time).all()
-    groups: dict[tuple, list[Ticket]] = {}
-    for t in tickets:
-        if not t.entry_time:
-            continue
-        key = (
-            t.number,
-            t.code,
-            t.city,
-            t.spot_number,
-            t.access_point_id,
-            t.entry_time.date(),
-        )
-        groups.setdefault(key, []).append(t)
+    ranked = _ranked_tickets()
+    duplicates = db.execute(
+        select(ranked.c.id, ranked.c.access_point_id, ranked.c.spot_number, ranked.c.keeper_id, ranked.c.max_exit)
+        .where(ranked.c.rn > 1)
+        .order_by(ranked.c.id)
+    ).all()
+    # Release the snapshot of the scan before the moves start.
+    db.rollback()
+    summary = {"groups": len({row.keeper_id for row in duplicates}), "moved": 0, "total": len(duplicates)}
+    if job is not None:
+        job_registry.update(job, **summary)
+
+    updated_keepers = set()
+    for start in range(0, len(duplicates), chunk_size):
+        rows = duplicates[start:start + chunk_size]
+        keepers = {
+            row.keeper_id: row.max_exit
+            for row in rows
+            if row.max_exit is not None and row.keeper_id not in updated_keepers
+        }
+        if keepers:
+            db.execute(
+                update(Ticket),
+                [{"id": keeper_id, "exit_time": max_exit} for keeper_id, max_exit in keepers.items()],
+            )
+            updated_keepers.update(keepers)
+        ids = [row.id for row in rows]
+        summary["moved"] += cancel_tickets(db, ids)
+        db.commit()
 
-    merged_groups = 0
-    for key, group in groups.items():
-        if len(group) <= 1:
-            continue
+        for row in rows:
+            _forget_ticket_media(row.id)
+            occupancy.invalidate(row.access_point_id, row.spot_number)
+        if job is not None:
+            job_registry.update(job, **summary)
 
-        group.sort(key=lambda x: x.entry_time)
-        first = group[0]
-        exit_times = [g.exit_time for g in group if g.exit_time]
-        if exit_times:
-            first.exit_time = max(exit_times)
-
-        for duplicate in group[1:]:
-            cancelled = CancelledTicket(
-                token=duplicate.token,
-                access_point_id=duplicate.access_point_id,
-                number=duplicate.number,
-                code=duplicate.code,
-                city=duplicate.city,
-                status="cancelled",
-                entry_time=duplicate.entry_time,
-                exit_time=duplicate.exit_time,
-                entry_pic_base64=duplicate.entry_pic_base64,
-                car_pic=duplicate.car_pic,
-                exit_video_path=duplicate.exit_video_path,
-                spot_number=duplicate.spot_number,
-                trip_p_id=duplicate.trip_p_id,
-                ticket_key_id=duplicate.ticket_key_id,
-            )
-            db.add(cancelled)
-            db.delete(duplicate)
+    return summary
 
-        merged_groups += 1
 
-    db.commit()
-    return success_response("Merged duplicate tickets", merged_groups)
+merge_runner = ExclusiveJob("merge_duplicates", jobs_log)
+
+
+def _merge_duplicates_job(job: Job) -> dict:
+    db = SessionLocal()
+    try:
+        return merge_duplicate_tickets(db, job)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
 
 
 @app.post("/tickets/merge-duplicates")
-def merge_duplicates(db: Session = Depends(get_db)):
-    """API endpoint to merge duplicate tickets."""
-    return merge_duplicate_tickets(db)
+def merge_duplicates():
+    """Start merging duplicate tickets in the background.
 
-@app.get("/videos/{video_name}")
-def get_exit_video(video_name: str):
-    # 1. Look up the ticket in the database
-    
-    exit_video_path = os.path.join(UPLOAD_FOLDER,video_name)
-
-    # print(os.path.isfile(exit_video_path))
-    if os.path.isfile(exit_video_path):
-        # 2. Return the file on disk
-        return FileResponse(
-            path=exit_video_path,
-            media_type="video/mp4",            # adjust if your videos are a different format
-            filename=video_name  # suggested download name
+    Poll ``/jobs/{job_id}`` for progress. Only one merge runs at a time.
+    """
+
+    try:
+        job = merge_runner.start(_merge_duplicates_job)
+    except JobAlreadyRunning as exc:
+        raise HTTPException(status_code=409, detail={"message": "Merge already running", "job_id": exc.job.id})
+    return success_response("Merging duplicate tickets", job.id, job_id=job.id)
+
+IMAGE_TABLES = (Ticket, SubmittedTicket, CancelledTicket, SubmittedTicketArchive, CancelledTicketArchive)
+
+
+def _referenced_images(db: Session) -> dict:
+    """Map each image directory to the file names referenced by any ticket."""
+
+    entry_names: set = set()
+    car_names = entry_names if ENTRY_IMAGE_DIR == CAR_IMAGE_DIR else set()
+    for model in IMAGE_TABLES:
+        rows = db.query(model.entry_pic_base64, model.car_pic).yield_per(10000)
+        for entry_pic, car_pic in rows:
+            if entry_pic:
+                entry_names.add(os.path.basename(entry_pic.replace("\\", "/")))
+            if car_pic:
+                car_names.add(os.path.basename(car_pic.replace("\\", "/")))
+    return {ENTRY_IMAGE_DIR: entry_names, CAR_IMAGE_DIR: car_names}
+
+
+media_gc_runner = ExclusiveJob("media_gc", media_log)
+
+
+def _media_gc_job(job: Job, dry_run: bool = False) -> dict:
+    db = SessionLocal()
+    try:
+        referenced = _referenced_images(db)
+    finally:
+        db.close()
+    summary = image_store.collect_garbage(referenced, dry_run=dry_run, job=job)
+    # Variants of the images just removed, or of images moved to another folder, are orphans now.
+    summary["variants"] = image_variants.variants.scan(referenced, dry_run=dry_run)
+    return summary
+
+
+@app.post("/media/gc")
+def collect_media_garbage(dry_run: bool = False):
+    """Start deleting images that no ticket references.
+
+    Poll ``/jobs/{job_id}`` for progress. With ``dry_run`` the files are only
+    counted. Only one collection runs at a time.
+    """
+
+    try:
+        job = media_gc_runner.start(lambda job: _media_gc_job(job, dry_run), dry_run=dry_run)
+    except JobAlreadyRunning as exc:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Media garbage collection already running", "job_id": exc.job.id},
         )
-    else:
+    return success_response("Collecting unused images", job.id, job_id=job.id)
+
+
+archive_runner = ExclusiveJob("archive_tickets", jobs_log)
+
+
+def _archive_job(job: Job, retention_days: int = ARCHIVE_RETENTION_DAYS) -> dict:
+    return archive_old_tickets(SessionLocal, retention_days, job=job)
+
+
+@app.post("/tickets/archive")
+def archive_tickets(retention_days: Optional[int] = Query(None, ge=1)):
+    """Start moving submitted and cancelled tickets older than *retention_days* to the archive tables.
+
+    Defaults to ``ARCHIVE_RETENTION_DAYS``. Poll ``/jobs/{job_id}`` for
+    progress. Only one archive run happens at a time.
+    """
+
+    retention_days = retention_days or ARCHIVE_RETENTION_DAYS
+    if retention_days < 1:
+        raise HTTPException(status_code=400, detail="retention_days is required when ARCHIVE_RETENTION_DAYS is not set")
+    try:
+        job = archive_runner.start(lambda job: _archive_job(job, retention_days), retention_days=retention_days)
+    except JobAlreadyRunning as exc:
+        raise HTTPException(status_code=409, detail={"message": "Archiving already running", "job_id": exc.job.id})
+    return success_response("Archiving old tickets", job.id, job_id=job.id)
+
+
+def _run_exclusive(runner: ExclusiveJob, target: Callable[[Job], Any]) -> None:
+    """Run *target* for the scheduler unless a manually started job is still running."""
+
+    try:
+        job = runner.start(target, wait=True, scheduled=True)
+    except JobAlreadyRunning as exc:
+        jobs_log.warning("Skipping scheduled %s: %s", runner.kind, exc)
+        return
+    if job.status == "failed":
+        raise RuntimeError(job.error)
+
+
+SCHEDULE_MERGE_SECONDS = float(os.environ.get("SCHEDULE_MERGE_SECONDS", "0"))
+SCHEDULE_MEDIA_GC_SECONDS = float(os.environ.get("SCHEDULE_MEDIA_GC_SECONDS", "0"))
+
+scheduler = Scheduler(SessionLocal)
+scheduler.register("previous_day_submission", submit_previous_day_tickets, daily_at="00:00", lease_seconds=1800)
+if SCHEDULE_MERGE_SECONDS > 0:
+    scheduler.register(
+        "merge_duplicates",
+        lambda: _run_exclusive(merge_runner, _merge_duplicates_job),
+        every=SCHEDULE_MERGE_SECONDS,
+    )
+if SCHEDULE_MEDIA_GC_SECONDS > 0:
+    scheduler.register(
+        "media_gc",
+        lambda: _run_exclusive(media_gc_runner, _media_gc_job),
+        every=SCHEDULE_MEDIA_GC_SECONDS,
+    )
+
+if ARCHIVE_RETENTION_DAYS > 0:
+    scheduler.register(
+        "archive_tickets",
+        lambda: _run_exclusive(archive_runner, _archive_job),
+        daily_at=ARCHIVE_AT,
+        lease_seconds=1800,
+    )
+
+
+@app.get("/scheduler/jobs")
+def get_scheduled_jobs(db: Session = Depends(get_db)):
+    """Schedule, lease and last run of every periodic job."""
+    return {"enabled": SCHEDULER_ENABLED, "jobs": scheduler.status(db)}
+
+
+@app.get("/videos/{video_name}")
+def get_exit_video(video_name: str, request: Request):
+    # Clients only know the file name; it may live in the flat or the sharded layout.
+    exit_video_path = locate(os.path.join(UPLOAD_FOLDER, video_name))
+    response = file_response(request, exit_video_path, "video/mp4", filename=video_name)
+    if response is None:
         raise HTTPException(status_code=404, detail="Video not found")
+    return response
 
 
-@app.get("/image-car/{id}")
-def get_image(id: str,db: Session = Depends(get_db)):
-    # 1. Look up the ticket in the database
-    ticket = db.query(Ticket).filter(Ticket.id == id).first()
-    normalized_path_car =normalize_path_car(ticket.car_pic)
-    if os.path.isfile(normalized_path_car):
-        # 2. Return the file on disk
-        return FileResponse(
-            path=normalized_path_car,
-            media_type="image/jpg",            # adjust if your videos are a different format
-            filename=ticket.car_pic  # suggested download name
-        )
+MEDIA_PATH_CACHE_SIZE = int(os.environ.get("MEDIA_PATH_CACHE_SIZE", "10000"))
+# (kind, ticket id) -> resolved image path, where kind is "car" or "in".
+image_path_cache = LRUCache(MEDIA_PATH_CACHE_SIZE)
+
+
+def _forget_ticket_media(ticket_id: int) -> None:
+    """Drop cached image paths of a ticket that left the ``Ticket`` table."""
+    image_path_cache.pop(("car", ticket_id))
+    image_path_cache.pop(("in", ticket_id))
+
+
+def _stored_image_path(db: Session, ticket_id: int, kind: str) -> Optional[str]:
+    """Return a ticket image path as stored in the database."""
+
+    column = Ticket.car_pic if kind == "car" else Ticket.entry_pic_base64
+    return db.query(column).filter(Ticket.id == ticket_id).scalar()
+
+
+def _resolve_ticket_image(kind: str, ticket_id: int, stored: str) -> str:
+    """Resolve a stored ticket image path and cache it. Touches the file system."""
+
+    path = normalize_path_car(stored) if kind == "car" else normalize_path(stored)
+    image_path_cache.put((kind, ticket_id), path)
+    return path
+
+
+def _image_file_response(
+    request: Request,
+    path: Optional[str],
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    fmt: str = "jpeg",
+):
+    if path and not os.path.isfile(path):
+        # A cached path may predate a layout migration.
+        path = locate(path)
+    if not path or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    if not width and not height:
+        response = file_response(request, path, "image/jpg", filename=os.path.basename(path))
     else:
-    
-        raise HTTPException(status_code=404, detail="Video not found")
+        if not image_variants.AVAILABLE:
+            raise HTTPException(status_code=501, detail="Image resizing is not available")
+        try:
+            variant = image_variants.variants.get(path, width, height, fmt)
+        except Exception as exc:
+            media_log.error("Failed to resize %s: %s", path, exc)
+            raise HTTPException(status_code=500, detail="Failed to resize image")
+        immutable = bool(UUID_NAME_PATTERN.match(os.path.basename(path)))
+        response = file_response(
+            request,
+            variant,
+            image_variants.media_type(fmt),
+            filename=os.path.basename(variant),
+            immutable=immutable,
+        )
+    if response is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return response
+
+
+async def _ticket_image_response(
+    run_db: DbRunner,
+    request: Request,
+    ticket_id: int,
+    kind: str,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    fmt: str = "jpeg",
+):
+    path = image_path_cache.get((kind, ticket_id))
+    if path is None:
+        stored = await run_db(_stored_image_path, ticket_id, kind)
+        if stored:
+            # Resolving probes the file system, so it stays off the event loop as well.
+            path = await run_in_threadpool(_resolve_ticket_image, kind, ticket_id, stored)
+    return await run_in_threadpool(_image_file_response, request, path, width, height, fmt)
+
+
+@app.get("/image-car/{id}")
+async def get_car_image(
+    id: int,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=image_variants.MAX_DIMENSION),
+    h: Optional[int] = Query(None, ge=1, le=image_variants.MAX_DIMENSION),
+    fmt: str = Query("jpeg", alias="format", pattern="^(jpeg|webp)$"),
+    run_db: DbRunner = Depends(get_db_runner),
+):
+    return await _ticket_image_response(run_db, request, id, "car", w, h, fmt)
+
+
 def normalize_path(path: str) -> str:
-    normalized = _resolve_relative_path(path, ENTRY_IMAGE_DIR)
+    normalized = resolve_relative_path(path, ENTRY_IMAGE_DIR)
     return normalized if normalized is not None else path
 
 @app.get("/image-in/{id}")
-def get_image(id: str,db: Session = Depends(get_db)):
-    # 1. Look up the ticket in the database
-    ticket = db.query(Ticket).filter(Ticket.id == id).first()
-    normalized_path = normalize_path(ticket.entry_pic_base64)
-    if os.path.isfile(normalized_path):
-        # 2. Return the file on disk
-        return FileResponse(
-            path=normalized_path,
-            media_type="image/jpg",            # adjust if your videos are a different format
-            filename=ticket.entry_pic_base64  # suggested download name
-        )
-    else:
-    
-        raise HTTPException(status_code=404, detail="Video not found")
+async def get_entry_image(
+    id: int,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=image_variants.MAX_DIMENSION),
+    h: Optional[int] = Query(None, ge=1, le=image_variants.MAX_DIMENSION),
+    fmt: str = Query("jpeg", alias="format", pattern="^(jpeg|webp)$"),
+    run_db: DbRunner = Depends(get_db_runner),
+):
+    return await _ticket_image_response(run_db, request, id, "in", w, h, fmt)
 
 
 @app.get("/convert-video/{token}", response_model=List[TicketOut])
@@ -886,17 +1838,33 @@ def convert_video(token: str, db: Session = Depends(get_db)):
         .all()
     )
 
+    videos = {}
     for ticket in tickets:
         if not ticket.exit_video_path:
             continue
         normalized = normalize_video_path(ticket.exit_video_path)
-        if not is_video_file(normalized) or "_bf" in os.path.splitext(normalized)[0]:
-            continue
+        if is_video_file(normalized) and needs_conversion(normalized):
+            videos[ticket.exit_video_path] = normalized
+            ticket.video_status = "pending"
+    db.commit()
+
+    # Converted by the shared queue; each conversion points the tickets at
+    # the new file before the original is deleted.
+    conversions = {}
+    for name, path in videos.items():
         try:
-            new_path = make_browser_friendly(normalized)
-            ticket.exit_video_path = os.path.basename(new_path)
+            conversions[name] = video_queue.convert(
+                path, on_done=lambda converted, name=name: _finish_video_conversion(name, converted)
+            )
+        except (ConversionQueueFull, RuntimeError) as exc:
+            video_log.warning("Could not queue conversion of %s: %s", path, exc)
+            _set_video_status(name, "unconverted")
+    for name, conversion in conversions.items():
+        try:
+            conversion.result()
         except Exception as exc:
-            print(f"Failed to convert {ticket.exit_video_path}: {exc}")
+            video_log.error("Failed to convert %s: %s", name, exc)
+            _set_video_status(name, "failed")
 
-    db.commit()
+    db.expire_all()
     return tickets
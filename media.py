@@ -0,0 +1,202 @@
+import os
+import re
+import stat
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Hashable, Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+# Files written by the server are named with a fresh uuid4 (``_bf`` marks a
+# converted video) or with the SHA-256 of their content, so their content
+# never changes once written.
+UUID_NAME_PATTERN = re.compile(
+    r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(_bf)?|[0-9a-f]{64})\.\w+$",
+    re.IGNORECASE,
+)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=300"
+# ``sharded`` (the default) puts new files in ``<dir>/<name[:2]>/<name>`` so no
+# directory grows to millions of entries; ``flat`` writes ``<dir>/<name>``.
+MEDIA_LAYOUT = os.environ.get("MEDIA_LAYOUT", "sharded").lower()
+SHARD_LENGTH = 2
+WINDOWS_ABS_PATH_PATTERN = re.compile(r"^[A-Za-z]:[/\\]")
+# (config file key, environment variable, default) of each media directory.
+DIRECTORY_SETTINGS = (
+    ("entry_image_dir", "ENTRY_IMAGE_DIR", "D:/entry_images"),
+    ("car_image_dir", "CAR_IMAGE_DIR", "D:/car_images"),
+    ("exit_video_dir", "EXIT_VIDEO_DIR", "D:/exit_video"),
+)
+
+
+def normalize_directory(path: str) -> str:
+    """Return a normalized directory path for consistent joins."""
+
+    expanded = os.path.expanduser(path)
+    return os.path.normpath(expanded)
+
+
+def media_directories(config: Optional[dict] = None) -> Dict[str, str]:
+    """Media directories keyed by their config file key.
+
+    Values from *config* (the parsed ``TICKETSERVER_CONFIG_PATH`` file) win
+    over the environment, which wins over the defaults.
+    """
+
+    config = config or {}
+    return {
+        key: normalize_directory(config.get(key) or os.environ.get(env, default))
+        for key, env, default in DIRECTORY_SETTINGS
+    }
+
+
+def shard_path(directory: str, name: str) -> str:
+    """Sharded location of the file *name* under *directory*."""
+    return os.path.join(directory, name[:SHARD_LENGTH], name)
+
+
+def layout_path(directory: str, name: str) -> str:
+    """Where a new file called *name* is written under *directory*."""
+    return shard_path(directory, name) if MEDIA_LAYOUT == "sharded" else os.path.join(directory, name)
+
+
+def is_sharded(path: str) -> bool:
+    parent, name = os.path.split(path)
+    return len(name) > SHARD_LENGTH and os.path.basename(parent) == name[:SHARD_LENGTH]
+
+
+def alternate_path(path: str) -> str:
+    """The same file name in the other layout: flat for a sharded path and vice versa."""
+
+    parent, name = os.path.split(path)
+    if is_sharded(path):
+        return os.path.join(os.path.dirname(parent), name)
+    return shard_path(parent, name)
+
+
+def locate(path: str) -> str:
+    """Return *path*, or its counterpart in the other layout if only that one exists."""
+
+    if not path or os.path.exists(path):
+        return path
+    alternate = alternate_path(path)
+    return alternate if os.path.exists(alternate) else path
+
+
+def resolve_relative_path(path: Optional[str], base_dir: str) -> Optional[str]:
+    """Resolve *path* against *base_dir* when it is not absolute.
+
+    A file that has moved between the flat and the sharded media layout is
+    found in either place.
+    """
+
+    if not path:
+        return path
+    if os.path.isabs(path) or WINDOWS_ABS_PATH_PATTERN.match(path):
+        return locate(os.path.normpath(path))
+
+    normalized = path.replace("\\", "/").lstrip("/")
+    base_name = os.path.basename(os.path.normpath(base_dir))
+    if base_name:
+        lowered = normalized.lower()
+        prefix = f"{base_name.lower()}/"
+        if lowered.startswith(prefix):
+            normalized = normalized[len(prefix) :]
+
+    if not normalized:
+        return os.path.normpath(base_dir)
+
+    return locate(os.path.normpath(os.path.join(base_dir, normalized)))
+
+
+class LRUCache:
+    """Small thread-safe least-recently-used mapping."""
+
+    def __init__(self, maxsize: int = 10000) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+def _etag(stat_result: os.stat_result) -> str:
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    filename: Optional[str] = None,
+    immutable: Optional[bool] = None,
+) -> Optional[Response]:
+    """Serve *path* with validators and cache headers.
+
+    Answers ``If-None-Match``/``If-Modified-Since`` with ``304``. Byte ranges
+    (``Range``/``If-Range``) are handled by ``FileResponse``. ``immutable``
+    defaults to whether the file name is a server-generated uuid. Returns
+    ``None`` when *path* is not a regular file.
+    """
+
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(stat_result.st_mode):
+        return None
+
+    if immutable is None:
+        immutable = bool(UUID_NAME_PATTERN.match(os.path.basename(path)))
+    headers = {
+        "ETag": _etag(stat_result),
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else DEFAULT_CACHE_CONTROL,
+    }
+    if _not_modified(request, headers["ETag"], stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        path=path,
+        media_type=media_type,
+        filename=filename,
+        stat_result=stat_result,
+        headers=headers,
+    )
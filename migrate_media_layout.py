@@ -0,0 +1,222 @@
+"""Move media files from the flat layout to the sharded one, online.
+
+Usage::
+
+    python migrate_media_layout.py [--batch-size 500] [--sleep 0.1] [--dry-run]
+
+First the image columns of every ticket table are walked by id. Each
+referenced file still in the flat layout is moved to
+``<dir>/<name[:2]>/<name>`` and the column is pointed at the new path. The
+``UPDATE`` only applies if the column still holds the old value. Then the
+files left at the top level of the image and video directories are moved:
+unreferenced images and exit videos. Tickets store exit videos by name, so
+their rows need no update. Videos of tickets whose conversion is still
+pending are left for a later run, since ffmpeg works next to the original.
+
+The server may keep running: its path resolvers find a file in either
+layout, so a request never misses a file that is moving. A file that cannot
+be moved, e.g. because it is open on Windows, is counted as skipped. The
+tool can be interrupted and rerun; it continues where it stopped.
+
+Directories are read from the environment and ``TICKETSERVER_CONFIG_PATH``
+like the server does.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, Optional, Set
+
+from sqlalchemy import update
+
+from database import SessionLocal
+from media import is_sharded, media_directories, resolve_relative_path, shard_path
+from models import CancelledTicket, CancelledTicketArchive, SubmittedTicket, SubmittedTicketArchive, Ticket
+
+IMAGE_TABLES = (Ticket, SubmittedTicket, CancelledTicket, SubmittedTicketArchive, CancelledTicketArchive)
+VIDEO_TABLES = (Ticket, SubmittedTicket, CancelledTicket)
+
+
+def load_directories() -> Dict[str, str]:
+    config_path = os.environ.get("TICKETSERVER_CONFIG_PATH")
+    config = None
+    if config_path:
+        try:
+            with open(config_path, "r", encoding="utf-8") as config_file:
+                config = json.load(config_file)
+        except FileNotFoundError:
+            print(f"Config file {config_path} not found; using default directories.", file=sys.stderr)
+    return media_directories(config)
+
+
+def _move(path: str, dry_run: bool, counts: Dict[str, int]) -> Optional[str]:
+    """Move a flat *path* into its shard; returns the new path, or None if it was not moved."""
+
+    target = shard_path(os.path.dirname(path), os.path.basename(path))
+    if dry_run:
+        return target
+    if os.path.exists(target):
+        # Already migrated by an earlier, interrupted run; the flat copy is left alone.
+        return target
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    except FileNotFoundError:
+        if os.path.exists(target):
+            return target
+        counts["missing"] += 1
+        return None
+    except OSError as exc:
+        # Typically a file held open by the server on Windows; a rerun picks it up.
+        print(f"Skipping {path}: {exc}", file=sys.stderr)
+        counts["skipped"] += 1
+        return None
+    return target
+
+
+def converting_videos() -> Set[str]:
+    """Names of exit videos with a queued or running conversion, and of their outputs."""
+
+    db = SessionLocal()
+    try:
+        names = set()
+        for model in VIDEO_TABLES:
+            for (name,) in db.query(model.exit_video_path).filter(model.video_status == "pending"):
+                if name:
+                    base, ext = os.path.splitext(name)
+                    names.update((name, f"{base}_bf{ext}"))
+        return names
+    finally:
+        db.close()
+
+
+def migrate_rows(
+    directories: Dict[str, str],
+    batch_size: int,
+    sleep: float,
+    dry_run: bool,
+    counts: Dict[str, int],
+) -> None:
+    columns = (
+        ("entry_pic_base64", directories["entry_image_dir"]),
+        ("car_pic", directories["car_image_dir"]),
+    )
+    for model in IMAGE_TABLES:
+        last_id = 0
+        while True:
+            db = SessionLocal()
+            try:
+                rows = (
+                    db.query(model.id, model.entry_pic_base64, model.car_pic)
+                    .filter(model.id > last_id)
+                    .order_by(model.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                for row in rows:
+                    for name, base_dir in columns:
+                        stored = getattr(row, name)
+                        if stored:
+                            _migrate_value(db, model, row.id, name, stored, base_dir, dry_run, counts)
+                last_id = rows[-1].id
+                if not dry_run:
+                    db.commit()
+            finally:
+                db.close()
+            print(json.dumps({"table": model.__tablename__, "last_id": last_id, **counts}), flush=True)
+            if sleep:
+                time.sleep(sleep)
+
+
+def _migrate_value(
+    db,
+    model,
+    row_id: int,
+    column: str,
+    stored: str,
+    base_dir: str,
+    dry_run: bool,
+    counts: Dict[str, int],
+) -> None:
+    resolved = resolve_relative_path(stored, base_dir)
+    if not os.path.exists(resolved):
+        counts["missing"] += 1
+        return
+    if not is_sharded(resolved):
+        if os.path.normcase(os.path.dirname(resolved)) != os.path.normcase(base_dir):
+            # Lives outside the configured media directory; leave it where it is.
+            counts["outside"] += 1
+            return
+        resolved = _move(resolved, dry_run, counts)
+        if resolved is None:
+            return
+        counts["moved"] += 1
+    if resolved != stored:
+        if not dry_run:
+            column_attr = getattr(model, column)
+            db.execute(
+                update(model)
+                .where(model.id == row_id, column_attr == stored)
+                .values({column_attr: resolved})
+            )
+        counts["updated"] += 1
+
+
+def sweep_directories(
+    directories: Dict[str, str],
+    batch_size: int,
+    sleep: float,
+    dry_run: bool,
+    counts: Dict[str, int],
+) -> None:
+    video_dir = directories["exit_video_dir"]
+    for directory in sorted(set(directories.values())):
+        if not os.path.isdir(directory):
+            continue
+        converting = converting_videos() if directory == video_dir else set()
+        in_batch = 0
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name = entry.name
+                if not entry.is_file(follow_symlinks=False) or name.startswith(".") or name.endswith(".part"):
+                    continue
+                if name in converting:
+                    counts["converting"] += 1
+                    continue
+                if _move(entry.path, dry_run, counts) is not None:
+                    counts["swept"] += 1
+                in_batch += 1
+                if in_batch >= batch_size:
+                    print(json.dumps({"directory": directory, **counts}), flush=True)
+                    in_batch = 0
+                    if directory == video_dir:
+                        converting = converting_videos()
+                    if sleep:
+                        time.sleep(sleep)
+        print(json.dumps({"directory": directory, **counts}), flush=True)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="rows or files per batch")
+    parser.add_argument("--sleep", type=float, default=0.0, help="seconds to pause between batches")
+    parser.add_argument("--dry-run", action="store_true", help="report what would move without changing anything")
+    parser.add_argument("--skip-rows", action="store_true", help="only sweep the directories")
+    parser.add_argument("--skip-sweep", action="store_true", help="only migrate files referenced by tickets")
+    args = parser.parse_args(argv)
+
+    directories = load_directories()
+    counts = {"moved": 0, "updated": 0, "missing": 0, "outside": 0, "skipped": 0, "converting": 0, "swept": 0}
+    if not args.skip_rows:
+        migrate_rows(directories, args.batch_size, args.sleep, args.dry_run, counts)
+    if not args.skip_sweep:
+        sweep_directories(directories, args.batch_size, args.sleep, args.dry_run, counts)
+    print(json.dumps({"done": True, "dry_run": args.dry_run, **counts}))
+
+
+if __name__ == "__main__":
+    main()
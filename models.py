@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Double, Float, Text, Index
 from datetime import datetime
 from database import Base
 
@@ -6,6 +6,7 @@ class Ticket(Base):
     __tablename__ = "Ticket"
 
     id = Column(Integer, primary_key=True, index=True)
+    # Deliberately not unique: several tickets can share a token.
     token = Column(String(255), index=True)
     access_point_id = Column(Integer)
     number = Column(String(50))
@@ -17,10 +18,20 @@ class Ticket(Base):
     entry_pic_base64 = Column(String(255))
     car_pic = Column(Text)  # base64
     exit_video_path = Column(String(255))
+    # "pending", "failed" or "unconverted" while the exit video is not browser friendly.
+    video_status = Column(String(20))
     spot_number = Column(Integer)
     trip_p_id = Column(Integer)
     ticket_key_id = Column(Integer)
 
+    # Serve the per-spot lookups made by ``create_ticket``.
+    __table_args__ = (
+        Index("ix_ticket_spot_entry", "access_point_id", "spot_number", "entry_time"),
+        Index("ix_ticket_spot_plate", "access_point_id", "spot_number", "number", "entry_time"),
+        # Serves the plate lookups of ``/tickets/search``.
+        Index("ix_ticket_number", "number"),
+    )
+
 
 class SubmittedTicket(Base):
     __tablename__ = "SubmittedTicket"
@@ -37,10 +48,17 @@ class SubmittedTicket(Base):
     entry_pic_base64 = Column(String(255))
     car_pic = Column(Text)
     exit_video_path = Column(String(255))
+    video_status = Column(String(20))
     spot_number = Column(Integer)
     trip_p_id = Column(Integer)
     ticket_key_id = Column(Integer)
 
+    __table_args__ = (
+        Index("ix_submitted_ticket_number", "number"),
+        # Serves the archiver's range scan.
+        Index("ix_submitted_ticket_entry", "entry_time"),
+    )
+
 
 class CancelledTicket(Base):
     __tablename__ = "CancelledTicket"
@@ -57,9 +75,138 @@ class CancelledTicket(Base):
     entry_pic_base64 = Column(String(255))
     car_pic = Column(Text)
     exit_video_path = Column(String(255))
+    video_status = Column(String(20))
     spot_number = Column(Integer)
     trip_p_id = Column(Integer)
     ticket_key_id = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_cancelled_ticket_number", "number"),
+        Index("ix_cancelled_ticket_entry", "entry_time"),
+    )
+
+
+class _ArchivedTicketColumns:
+    """Columns of the archive tables; rows keep the id they had before archiving."""
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    token = Column(String(255))
+    access_point_id = Column(Integer)
+    number = Column(String(50))
+    code = Column(String(50))
+    city = Column(String(100))
+    status = Column(String(50))
+    entry_time = Column(DateTime, nullable=False)
+    exit_time = Column(DateTime, nullable=True)
+    entry_pic_base64 = Column(String(255))
+    car_pic = Column(Text)
+    exit_video_path = Column(String(255))
+    video_status = Column(String(20))
+    spot_number = Column(Integer)
+    trip_p_id = Column(Integer)
+    ticket_key_id = Column(Integer)
+
+
+class SubmittedTicketArchive(_ArchivedTicketColumns, Base):
+    __tablename__ = "SubmittedTicketArchive"
+
+    __table_args__ = (
+        Index("ix_submitted_ticket_archive_number", "number"),
+        Index("ix_submitted_ticket_archive_entry", "entry_time"),
+    )
+
+
+class CancelledTicketArchive(_ArchivedTicketColumns, Base):
+    __tablename__ = "CancelledTicketArchive"
+
+    __table_args__ = (
+        Index("ix_cancelled_ticket_archive_number", "number"),
+        Index("ix_cancelled_ticket_archive_entry", "entry_time"),
+    )
+
+
+class SpotState(Base):
+    """Per-spot row locked by ``create_ticket`` and pointing at the spot's tickets.
+
+    ``latest_ticket_id`` is the ticket with the newest ``entry_time`` and
+    ``last_ticket_id`` the most recently created one. Missing access point or
+    spot numbers are stored as ``-1``.
+    """
+
+    __tablename__ = "SpotState"
+
+    access_point_id = Column(Integer, primary_key=True, autoincrement=False)
+    spot_number = Column(Integer, primary_key=True, autoincrement=False)
+    latest_ticket_id = Column(Integer)
+    latest_entry_time = Column(DateTime)
+    last_ticket_id = Column(Integer)
+
+
+class SubmissionJob(Base):
+    """Durable request to submit a ticket to Parkonic, worked by ``submission_outbox``.
+
+    ``step`` is the next thing to do (``park_in``, ``park_out``, or ``move``
+    once Parkonic accepted the park-out) and ``state`` is ``pending``,
+    ``done`` or ``failed``. A worker owns the job
+    while ``lease_until`` lies in the future.
+    """
+
+    __tablename__ = "SubmissionJob"
+
+    id = Column(Integer, primary_key=True)
+    ticket_id = Column(Integer, nullable=False, unique=True)
+    state = Column(String(20), nullable=False, default="pending")
+    step = Column(String(20), nullable=False, default="park_in")
+    trip_id = Column(Integer)
+    submitted_id = Column(Integer)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    # JSON answer to the park-out call, stored before the ticket is moved.
+    park_out_response = Column(Text)
+    # Request id of the request that queued the job, used by the worker's logs.
+    request_id = Column(String(128))
+    lease_owner = Column(String(64))
+    lease_until = Column(DateTime)
+    next_attempt_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index("ix_submission_job_claim", "state", "next_attempt_at"),)
+
+
+class JobLock(Base):
+    """Lease and run history of a periodic job, shared by every server process."""
+
+    __tablename__ = "JobLock"
+
+    name = Column(String(100), primary_key=True)
+    owner = Column(String(64))
+    lease_until = Column(DateTime)
+    next_run_at = Column(DateTime)
+    last_started_at = Column(DateTime)
+    last_finished_at = Column(DateTime)
+    last_duration_seconds = Column(Float)
+    last_status = Column(String(20))
+    last_error = Column(Text)
+
+
+class BackgroundJob(Base):
+    """Last known state of a :class:`jobs.Job`, readable from every server process."""
+
+    __tablename__ = "BackgroundJob"
+
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False)
+    # JSON; bulk submissions keep a status per ticket here.
+    info = Column(Text(16777215))
+    result = Column(Text(16777215))
+    error = Column(Text)
+    created_at = Column(Double, nullable=False)
+    started_at = Column(Double)
+    finished_at = Column(Double, index=True)
+
+
 class User(Base):
     __tablename__ = "User"
     id = Column(Integer, primary_key=True, index=True)
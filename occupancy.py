@@ -0,0 +1,126 @@
+"""In-memory index of the latest ticket parked at each spot.
+
+``create_ticket`` only ever compares an incoming camera event with the most
+recent tickets at the same ``(access_point_id, spot_number)``. Keeping those
+in memory lets the common exit update go straight to a single guarded
+``UPDATE`` (see ``spot_state.update_if_latest``) without reading anything.
+
+The index is per process and only a hint: the guarded update re-checks it
+against the database, and a stale entry just falls back to the locked path.
+"""
+
+import os
+import threading
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Ticket
+
+OCCUPANCY_INDEX_ENABLED = os.environ.get("OCCUPANCY_INDEX", "1").lower() not in ("0", "false", "no")
+
+SpotKey = Tuple[Optional[int], Optional[int]]
+
+
+class SpotTicket(NamedTuple):
+    id: int
+    number: Optional[str]
+    code: Optional[str]
+    entry_time: Optional[datetime]
+    exit_time: Optional[datetime]
+
+    @classmethod
+    def from_ticket(cls, ticket: Ticket) -> "SpotTicket":
+        return cls(ticket.id, ticket.number, ticket.code, ticket.entry_time, ticket.exit_time)
+
+
+class SpotSnapshot(NamedTuple):
+    """``latest`` has the newest ``entry_time``; ``last`` has the highest id."""
+
+    latest: Optional[SpotTicket]
+    last: Optional[SpotTicket]
+
+    @classmethod
+    def of(cls, latest: Optional[Ticket], last: Optional[Ticket]) -> "SpotSnapshot":
+        """Snapshot *latest* and *last*, e.g. before a commit expires them."""
+        return cls(
+            SpotTicket.from_ticket(latest) if latest else None,
+            SpotTicket.from_ticket(last) if last else None,
+        )
+
+
+class OccupancyIndex:
+    def __init__(self, enabled: bool = OCCUPANCY_INDEX_ENABLED) -> None:
+        self.enabled = enabled
+        self._spots: Dict[SpotKey, SpotSnapshot] = {}
+        self._lock = threading.Lock()
+
+    def warm_up(self, db: Session) -> int:
+        """Load the latest tickets of every spot. Returns the number of spots."""
+
+        if not self.enabled:
+            return 0
+
+        spot_cols = (Ticket.access_point_id, Ticket.spot_number)
+        last_ids = db.query(func.max(Ticket.id)).group_by(*spot_cols)
+        latest_entry = (
+            db.query(*spot_cols, func.max(Ticket.entry_time).label("entry_time"))
+            .group_by(*spot_cols)
+            .subquery()
+        )
+        latest_rows = (
+            db.query(Ticket)
+            .join(
+                latest_entry,
+                (Ticket.access_point_id == latest_entry.c.access_point_id)
+                & (Ticket.spot_number == latest_entry.c.spot_number)
+                & (Ticket.entry_time == latest_entry.c.entry_time),
+            )
+            .order_by(Ticket.id)
+            .all()
+        )
+        last_rows = db.query(Ticket).filter(Ticket.id.in_(last_ids)).all()
+
+        spots: Dict[SpotKey, SpotSnapshot] = {}
+        for row in latest_rows:
+            # Ties on entry_time resolve to the highest id, as ordered above.
+            spots[(row.access_point_id, row.spot_number)] = SpotSnapshot(SpotTicket.from_ticket(row), None)
+        for row in last_rows:
+            key = (row.access_point_id, row.spot_number)
+            latest = spots[key].latest if key in spots else None
+            spots[key] = SpotSnapshot(latest, SpotTicket.from_ticket(row))
+
+        with self._lock:
+            self._spots = spots
+        return len(spots)
+
+    def peek(self, access_point_id: Optional[int], spot_number: Optional[int]) -> Optional[SpotSnapshot]:
+        """Return the cached state of a spot, or None if it is not cached."""
+
+        if not self.enabled:
+            return None
+        with self._lock:
+            return self._spots.get((access_point_id, spot_number))
+
+    def store(self, access_point_id: Optional[int], spot_number: Optional[int], state: SpotSnapshot) -> None:
+        """Replace the cached state of a spot once its transaction committed."""
+
+        if not self.enabled:
+            return
+        with self._lock:
+            self._spots[(access_point_id, spot_number)] = state
+
+    def invalidate(self, access_point_id: Optional[int], spot_number: Optional[int]) -> None:
+        """Forget a spot after one of its tickets left the ``Ticket`` table."""
+
+        with self._lock:
+            self._spots.pop((access_point_id, spot_number), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spots.clear()
+
+
+occupancy = OccupancyIndex()
@@ -1,47 +1,330 @@
 import os
 import json
 import time
+import random
+import asyncio
+import threading
 import requests
-from typing import List, Any, Dict
+from requests.adapters import HTTPAdapter
+from metrics import PARKONIC_ATTEMPT_SECONDS, PARKONIC_REJECTED
+from typing import List, Any, AsyncIterator, Dict, Iterator, Optional, Sequence
 
-PARKONIC_BASE_URL = "https://api.parkonic.com/api/street-parking/v2"
+try:
+    import httpx
+except ImportError:  # the async interface falls back to a worker thread
+    httpx = None
 
+PARKONIC_BASE_URL = os.environ.get(
+    "PARKONIC_BASE_URL", "https://api.parkonic.com/api/street-parking/v2"
+)
+PARKONIC_TIMEOUT = float(os.environ.get("PARKONIC_TIMEOUT", "10"))
+PARKONIC_POOL_SIZE = int(os.environ.get("PARKONIC_POOL_SIZE", "20"))
 
+# Status codes worth retrying; other 4xx responses will not improve.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+JSON_HEADERS = {"Content-Type": "application/json"}
 
-def send_request_with_retry(url: str, payload: Dict[str, Any], retries: int = 3, delay: float = 1.0) -> Dict[str, Any] | str:
-    """Send POST request with retries.
 
-    The upstream API occasionally returns an empty body with a ``200`` status,
-    which causes ``response.json()`` to raise a ``JSONDecodeError``. We treat
-    that as a soft failure and return a structured error dictionary instead of
-    bubbling up the decoding exception.
+class StreamedJSONBody:
+    """A JSON object whose ``images`` array is streamed from files.
+
+    Each file holds one image already base64-encoded (see
+    ``encoded_images``), so the body is never built in memory. The body has
+    a known length and can be iterated again for every retry.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, payload: Dict[str, Any], image_files: Sequence[str]) -> None:
+        head = json.dumps(payload)
+        self._head = (head[:-1] + (", " if payload else "") + '"images": [').encode()
+        self._files = list(image_files)
+        # Base64 needs no JSON escaping: only quotes, commas and the closing "]}" are added.
+        sizes = sum(os.path.getsize(path) for path in self._files)
+        self._length = len(self._head) + sizes + 3 * len(self._files) - (1 if self._files else 0) + 2
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        for index, path in enumerate(self._files):
+            yield b',"' if index else b'"'
+            with open(path, "rb") as f:
+                while chunk := f.read(self.chunk_size):
+                    yield chunk
+            yield b'"'
+        yield b"]}"
+
+    async def aiter(self) -> AsyncIterator[bytes]:
+        """Iterate in a worker thread so file reads do not block the event loop."""
+        chunks = iter(self)
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+
+
+class CircuitBreaker:
+    """Fail fast while the upstream keeps failing.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls are rejected for ``reset_timeout`` seconds. The first call after
+    that is let through as a probe; its outcome closes or re-opens the circuit.
     """
 
-    last_exc: Exception | None = None
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class EndpointStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "avg_seconds": self.total_seconds / self.requests if self.requests else 0.0,
+            "max_seconds": self.max_seconds,
+        }
+
+
+class ParkonicClient:
+    """Connection-pooled Parkonic client with retries and a circuit breaker.
+
+    ``post`` blocks the calling thread; ``apost`` is its asyncio counterpart
+    and uses ``httpx`` when it is installed.
+    """
+
+    def __init__(
+        self,
+        base_url: str = PARKONIC_BASE_URL,
+        timeout: float = PARKONIC_TIMEOUT,
+        pool_size: int = PARKONIC_POOL_SIZE,
+        backoff_max: float = 8.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._async_client = None
+        self._stats: Dict[str, EndpointStats] = {}
+        self._stats_lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
 
-    for attempt in range(retries):
+    def _backoff(self, attempt: int, delay: float) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(self.backoff_max, delay * 2 ** attempt))
+
+    def _record(self, url: str, seconds: Optional[float], error: bool = False, rejected: bool = False) -> None:
+        endpoint = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        if rejected:
+            PARKONIC_REJECTED.inc(endpoint=endpoint)
+        else:
+            PARKONIC_ATTEMPT_SECONDS.observe(seconds, endpoint=endpoint, result="error" if error else "ok")
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, EndpointStats())
+            if rejected:
+                stats.rejected += 1
+                return
+            stats.requests += 1
+            stats.errors += int(error)
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            endpoints = {name: s.to_dict() for name, s in self._stats.items()}
+        return {"circuit": self.breaker.state, "endpoints": endpoints}
+
+    @staticmethod
+    def _parse(text: str, json_body) -> Dict[str, Any] | str:
+        """Decode a successful response body.
+
+        The upstream API occasionally returns an empty body with a ``200``
+        status. That is treated as a soft failure and returned as a structured
+        error dictionary instead of raising a decoding exception.
+        """
         try:
-            response = requests.post(url, json=payload, timeout=10)
-            response.raise_for_status()
+            return json_body()
+        except ValueError:
+            content = text.strip()
+            if content:
+                return {"error": "Invalid JSON response", "raw": content}
+            return {"error": "Empty response body"}
+
+    def post(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        retries: int = 3,
+        delay: float = 1.0,
+        body: Optional[StreamedJSONBody] = None,
+    ) -> Dict[str, Any] | str:
+        """POST *payload* to *url*, retrying transient failures.
+
+        When *body* is given it is streamed instead of encoding *payload*.
+        Returns the decoded JSON body, or a string describing the last error.
+        """
+        last_exc: Exception | None = None
 
+        for attempt in range(retries):
+            if not self.breaker.allow():
+                self._record(url, None, rejected=True)
+                return "Parkonic circuit open; request not sent"
+            started = time.perf_counter()
             try:
-                return response.json()
-            except ValueError as exc:
-                # Empty or non-JSON response body
+                if body is None:
+                    response = self.session.post(url, json=payload, timeout=self.timeout)
+                else:
+                    response = self.session.post(url, data=body, headers=JSON_HEADERS, timeout=self.timeout)
+            except requests.RequestException as exc:
+                self._record(url, time.perf_counter() - started, error=True)
+                self.breaker.record_failure()
                 last_exc = exc
-                content = response.text.strip()
-                if content:
-                    return {"error": "Invalid JSON response", "raw": content}
-                return {"error": "Empty response body"}
-        except Exception as exc:  # broad catch to mirror simple behaviour
-            last_exc = exc
-            time.sleep(delay)
+            else:
+                failed = response.status_code >= 400
+                self._record(url, time.perf_counter() - started, error=failed)
+                if not failed:
+                    self.breaker.record_success()
+                    return self._parse(response.text, response.json)
+                try:
+                    response.raise_for_status()
+                except requests.HTTPError as exc:
+                    last_exc = exc
+                if response.status_code not in RETRY_STATUSES:
+                    # The upstream answered; the request itself is at fault.
+                    self.breaker.record_success()
+                    break
+                self.breaker.record_failure()
+            if attempt < retries - 1:
+                time.sleep(self._backoff(attempt, delay))
 
-    # if all retries failed, return error message
-    return str(last_exc) if last_exc else {}
+        return str(last_exc) if last_exc else {}
 
+    async def apost(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        retries: int = 3,
+        delay: float = 1.0,
+        body: Optional[StreamedJSONBody] = None,
+    ) -> Dict[str, Any] | str:
+        """Asyncio version of :meth:`post`."""
+        if httpx is None:
+            return await asyncio.to_thread(self.post, url, payload, retries, delay, body)
 
-def park_in_request(
+        if self._async_client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            self._async_client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+
+        last_exc: Exception | None = None
+
+        for attempt in range(retries):
+            if not self.breaker.allow():
+                self._record(url, None, rejected=True)
+                return "Parkonic circuit open; request not sent"
+            started = time.perf_counter()
+            try:
+                if body is None:
+                    response = await self._async_client.post(url, json=payload)
+                else:
+                    headers = {**JSON_HEADERS, "Content-Length": str(len(body))}
+                    response = await self._async_client.post(url, content=body.aiter(), headers=headers)
+            except httpx.HTTPError as exc:
+                self._record(url, time.perf_counter() - started, error=True)
+                self.breaker.record_failure()
+                last_exc = exc
+            else:
+                failed = response.status_code >= 400
+                self._record(url, time.perf_counter() - started, error=failed)
+                if not failed:
+                    self.breaker.record_success()
+                    return self._parse(response.text, response.json)
+                last_exc = RuntimeError(f"{response.status_code} error for url: {url}")
+                if response.status_code not in RETRY_STATUSES:
+                    # The upstream answered; the request itself is at fault.
+                    self.breaker.record_success()
+                    break
+                self.breaker.record_failure()
+            if attempt < retries - 1:
+                await asyncio.sleep(self._backoff(attempt, delay))
+
+        return str(last_exc) if last_exc else {}
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def close(self) -> None:
+        self.session.close()
+
+
+client = ParkonicClient()
+
+
+def send_request_with_retry(
+    url: str,
+    payload: Dict[str, Any],
+    retries: int = 3,
+    delay: float = 1.0,
+    body: Optional[StreamedJSONBody] = None,
+) -> Dict[str, Any] | str:
+    """Send POST request with retries through the shared pooled client."""
+
+    return client.post(url, payload, retries=retries, delay=delay, body=body)
+
+
+def _park_in_payload(
     token: str,
     parkin_time: str,
     plate_code: str,
@@ -50,10 +333,8 @@ def park_in_request(
     conf: str,
     spot_number: int,
     pole_id: int,
-    images: List[str],
+    images: Optional[List[str]],
 ) -> Dict[str, Any]:
-    """Call the /park-in endpoint."""
-    url = f"{PARKONIC_BASE_URL}/park-in"
     payload = {
         "token": token,
         "parkin_time": str(parkin_time),
@@ -63,31 +344,96 @@ def park_in_request(
         "conf": conf,
         "spot_number": spot_number,
         "pole_id": pole_id,
-        "images": images,
     }
-    resp = send_request_with_retry(url, payload)
-    if isinstance(resp, str):
-        try:
-            resp = json.loads(resp)
-        except Exception:
-            resp = {}
-    return resp
+    if images is not None:
+        payload["images"] = images
+    return payload
 
 
-def park_out_request(token: str, parkout_time: str, spot_number: int, pole_id: int, trip_id: int) -> Dict[str, Any]:
-    """Call the /park-out endpoint."""
-    url = f"{PARKONIC_BASE_URL}/park-out"
-    payload = {
+def _park_out_payload(token: str, parkout_time: str, spot_number: int, pole_id: int, trip_id: int) -> Dict[str, Any]:
+    return {
         "token": token,
         "parkout_time": str(parkout_time),
         "spot_number": str(spot_number),
         "pole_id": pole_id,
         "trip_id": str(trip_id),
     }
-    resp = send_request_with_retry(url, payload)
+
+
+def _as_dict(resp: Dict[str, Any] | str) -> Dict[str, Any]:
     if isinstance(resp, str):
         try:
             resp = json.loads(resp)
         except Exception:
             resp = {}
     return resp
+
+
+def park_in_request(
+    token: str,
+    parkin_time: str,
+    plate_code: str,
+    plate_number: str,
+    emirates: str,
+    conf: str,
+    spot_number: int,
+    pole_id: int,
+    images: Optional[List[str]] = None,
+    image_files: Sequence[str] = (),
+) -> Dict[str, Any]:
+    """Call the /park-in endpoint.
+
+    Pass the images either as base64 strings in *images* or as paths of
+    files holding their base64 text in *image_files*; the latter are
+    streamed into the request body.
+    """
+    payload = _park_in_payload(
+        token, parkin_time, plate_code, plate_number, emirates, conf, spot_number, pole_id,
+        None if image_files else images,
+    )
+    body = StreamedJSONBody(payload, image_files) if image_files else None
+    return _as_dict(send_request_with_retry(client.url("park-in"), payload, body=body))
+
+
+def park_out_response(
+    token: str, parkout_time: str, spot_number: int, pole_id: int, trip_id: int
+) -> Dict[str, Any] | str:
+    """Call the /park-out endpoint without flattening failures.
+
+    Returns the decoded body of a 2xx answer, which may itself carry an
+    ``error`` key, or a string describing why no such answer arrived.
+    """
+    payload = _park_out_payload(token, parkout_time, spot_number, pole_id, trip_id)
+    return send_request_with_retry(client.url("park-out"), payload)
+
+
+def park_out_request(token: str, parkout_time: str, spot_number: int, pole_id: int, trip_id: int) -> Dict[str, Any]:
+    """Call the /park-out endpoint."""
+    return _as_dict(park_out_response(token, parkout_time, spot_number, pole_id, trip_id))
+
+
+async def park_in_request_async(
+    token: str,
+    parkin_time: str,
+    plate_code: str,
+    plate_number: str,
+    emirates: str,
+    conf: str,
+    spot_number: int,
+    pole_id: int,
+    images: Optional[List[str]] = None,
+    image_files: Sequence[str] = (),
+) -> Dict[str, Any]:
+    """Asyncio version of :func:`park_in_request`."""
+    payload = _park_in_payload(
+        token, parkin_time, plate_code, plate_number, emirates, conf, spot_number, pole_id,
+        None if image_files else images,
+    )
+    body = StreamedJSONBody(payload, image_files) if image_files else None
+    return _as_dict(await client.apost(client.url("park-in"), payload, body=body))
+
+
+async def park_out_request_async(token: str, parkout_time: str, spot_number: int, pole_id: int, trip_id: int) -> Dict[str, Any]:
+    """Asyncio version of :func:`park_out_request`."""
+    payload = _park_out_payload(token, parkout_time, spot_number, pole_id, trip_id)
+    return _as_dict(await client.apost(client.url("park-out"), payload))
@@ -0,0 +1,194 @@
+"""Fuzzy plate number lookup across the ticket tables and their archives.
+
+OCR regularly confuses a character or two, so an operator searching for a
+plate wants every ticket whose plate is within a small edit distance of it.
+The index keeps one BK-tree node per distinct cleaned plate number (far
+fewer than there are tickets), mapping it to the raw ``number`` values seen
+in the database. A search walks the tree to find the close plates and then
+fetches their tickets with an indexed ``number IN (...)`` query.
+
+The index is per process. It is loaded in the background at startup and
+catches up incrementally (by id) with rows written by other processes before
+a search when it is older than ``PLATE_INDEX_REFRESH_SECONDS``. Searches walk
+the tree without the lock that ingest takes to add plates: a node's children
+are replaced, never modified, so a walk sees either the old or the new map.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import CancelledTicket, CancelledTicketArchive, SubmittedTicket, SubmittedTicketArchive, Ticket
+
+PLATE_INDEX_REFRESH_SECONDS = float(os.environ.get("PLATE_INDEX_REFRESH_SECONDS", "30"))
+# Archived rows keep their ids, so the archives may receive ids below the
+# last one loaded; their plates were already indexed from the live tables.
+TABLES = (Ticket, SubmittedTicket, CancelledTicket, SubmittedTicketArchive, CancelledTicketArchive)
+LOAD_CHUNK_SIZE = 50000
+
+
+def clean_plate(p: str) -> str:
+    return re.sub(r"[^A-Z0-9]", "", (p or "").upper())
+
+
+def levenshtein(a: str, b: str, limit: Optional[int] = None) -> int:
+    """Edit distance between *a* and *b*.
+
+    With *limit*, stops early and returns ``limit + 1`` once the distance is
+    known to exceed it.
+    """
+
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """Burkhard-Keller tree over strings with the Levenshtein metric."""
+
+    def __init__(self) -> None:
+        # node: [word, {distance: child node}]; the map is copied on write.
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, word: str) -> bool:
+        """Insert *word*; returns False if it was already present. Callers serialize adds."""
+
+        if self._root is None:
+            self._root = [word, {}]
+            self.size = 1
+            return True
+        node = self._root
+        while True:
+            distance = levenshtein(word, node[0])
+            if distance == 0:
+                return False
+            child = node[1].get(distance)
+            if child is None:
+                node[1] = {**node[1], distance: [word, {}]}
+                self.size += 1
+                return True
+            node = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Return ``(distance, word)`` pairs within *max_distance*, closest first.
+
+        Safe to call while another thread adds words.
+        """
+
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            candidate, children = stack.pop()
+            distance = levenshtein(word, candidate)
+            if distance <= max_distance:
+                found.append((distance, candidate))
+            # Triangle inequality: only these subtrees can hold matches.
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in children.items() if low <= d <= high)
+        found.sort()
+        return found
+
+
+class PlateIndex:
+    def __init__(self, refresh_seconds: float = PLATE_INDEX_REFRESH_SECONDS) -> None:
+        self.refresh_seconds = refresh_seconds
+        self._tree = BKTree()
+        # cleaned plate -> raw ``number`` values stored in the tables
+        self._numbers: Dict[str, Set[str]] = {}
+        # highest id loaded per table
+        self._loaded_ids: Dict[str, int] = {}
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def add(self, number: Optional[str]) -> None:
+        """Index one raw plate number."""
+
+        cleaned = clean_plate(number)
+        if not cleaned:
+            return
+        with self._lock:
+            raw = self._numbers.get(cleaned)
+            if raw is None:
+                self._numbers[cleaned] = {number}
+                self._tree.add(cleaned)
+            else:
+                raw.add(number)
+
+    def add_many(self, numbers: Iterable[Optional[str]]) -> None:
+        for number in numbers:
+            self.add(number)
+
+    def refresh(self, db: Session) -> int:
+        """Load plates of rows added since the last refresh. Returns the rows read."""
+
+        with self._refresh_lock:
+            read = 0
+            for model in TABLES:
+                table = model.__tablename__
+                last_id = self._loaded_ids.get(table, 0)
+                while True:
+                    rows = (
+                        db.query(model.id, model.number)
+                        .filter(model.id > last_id)
+                        .order_by(model.id)
+                        .limit(LOAD_CHUNK_SIZE)
+                        .all()
+                    )
+                    if not rows:
+                        break
+                    self.add_many(number for _, number in rows)
+                    last_id = rows[-1].id
+                    read += len(rows)
+                self._loaded_ids[table] = last_id
+            self._refreshed_at = time.monotonic()
+            return read
+
+    def refresh_if_stale(self, db: Session) -> None:
+        if time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+            self.refresh(db)
+
+    @property
+    def size(self) -> int:
+        return self._tree.size
+
+    @property
+    def ready(self) -> bool:
+        """True once the initial load has finished."""
+        return self._refreshed_at > 0
+
+    @property
+    def loading(self) -> bool:
+        """True while the initial load is running."""
+        return not self.ready and self._refresh_lock.locked()
+
+    def search(self, plate: str, max_distance: int = 1) -> List[Tuple[int, str, Set[str]]]:
+        """Return ``(distance, cleaned plate, raw numbers)`` for plates near *plate*."""
+
+        cleaned = clean_plate(plate)
+        if not cleaned:
+            return []
+        # The walk is the slow part and runs unlocked, so ingest is not held up.
+        matches = self._tree.search(cleaned, max_distance)
+        with self._lock:
+            return [(distance, word, set(self._numbers[word])) for distance, word in matches]
+
+
+plates = PlateIndex()
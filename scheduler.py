@@ -0,0 +1,222 @@
+"""Periodic jobs that run once per schedule across all server processes.
+
+Every process runs a :class:`Scheduler`, but a job only runs in the process
+that wins its :class:`~models.JobLock` row: a conditional ``UPDATE`` takes
+the lease once ``next_run_at`` has passed and no other lease is live. The
+winner renews the lease while the job runs and afterwards records the
+status and duration and sets the next run time. A job whose process died
+becomes runnable again when its lease expires.
+
+Jobs run in worker threads (``asyncio.to_thread``), never on the event loop.
+Times are local, like the rest of the server.
+"""
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from logging_config import get_logger, request_id
+from models import JobLock
+
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "1").lower() in ("1", "true", "yes")
+SCHEDULER_POLL_SECONDS = float(os.environ.get("SCHEDULER_POLL_SECONDS", "30"))
+
+log = get_logger("scheduler")
+
+
+class ScheduledJob:
+    """A job run every *every* seconds or daily at *daily_at* (``HH:MM``)."""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        every: Optional[float] = None,
+        daily_at: Optional[str] = None,
+        lease_seconds: float = 600,
+    ) -> None:
+        if (every is None) == (daily_at is None):
+            raise ValueError("Give exactly one of every or daily_at")
+        self.name = name
+        self.func = func
+        self.every = every
+        self.daily_at = None
+        if daily_at is not None:
+            hour, minute = (int(part) for part in daily_at.split(":"))
+            self.daily_at = (hour, minute)
+        self.lease = timedelta(seconds=lease_seconds)
+
+    def next_run(self, after: datetime) -> datetime:
+        if self.every is not None:
+            return after + timedelta(seconds=self.every)
+        hour, minute = self.daily_at
+        candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return candidate if candidate > after else candidate + timedelta(days=1)
+
+    def describe(self) -> Dict[str, Any]:
+        if self.every is not None:
+            return {"every_seconds": self.every}
+        return {"daily_at": "%02d:%02d" % self.daily_at}
+
+
+class Scheduler:
+    def __init__(self, session_factory: Callable[[], Session], poll_seconds: float = SCHEDULER_POLL_SECONDS) -> None:
+        self.session_factory = session_factory
+        self.poll_seconds = poll_seconds
+        self.owner = f"{uuid.uuid4().hex[:12]}-{os.getpid()}"
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, func: Callable[[], Any], **schedule: Any) -> ScheduledJob:
+        job = ScheduledJob(name, func, **schedule)
+        self.jobs[name] = job
+        return job
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Stop scheduling. Jobs already running finish in their threads."""
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self._ensure_rows)
+                break
+            except Exception:
+                log.exception("Failed to set up scheduled jobs")
+                await asyncio.sleep(self.poll_seconds)
+        while True:
+            for name, job in self.jobs.items():
+                task = self._running.get(name)
+                if task is None or task.done():
+                    self._running[name] = asyncio.create_task(asyncio.to_thread(self._run_if_due, job))
+            await asyncio.sleep(self.poll_seconds)
+
+    def _ensure_rows(self) -> None:
+        db = self.session_factory()
+        try:
+            now = datetime.now()
+            for job in self.jobs.values():
+                if db.get(JobLock, job.name) is None:
+                    try:
+                        db.add(JobLock(name=job.name, next_run_at=job.next_run(now)))
+                        db.commit()
+                    except IntegrityError:
+                        # Created by another process.
+                        db.rollback()
+        finally:
+            db.close()
+
+    def _acquire(self, db: Session, job: ScheduledJob, now: datetime) -> bool:
+        taken = db.execute(
+            update(JobLock)
+            .where(
+                JobLock.name == job.name,
+                or_(JobLock.next_run_at == None, JobLock.next_run_at <= now),
+                or_(JobLock.lease_until == None, JobLock.lease_until < now),
+            )
+            .values(owner=self.owner, lease_until=now + job.lease, last_started_at=now)
+        ).rowcount
+        db.commit()
+        return bool(taken)
+
+    def _heartbeat(self, job: ScheduledJob, done: threading.Event) -> None:
+        interval = max(1.0, job.lease.total_seconds() / 3)
+        while not done.wait(interval):
+            db = self.session_factory()
+            try:
+                db.execute(
+                    update(JobLock)
+                    .where(JobLock.name == job.name, JobLock.owner == self.owner)
+                    .values(lease_until=datetime.now() + job.lease)
+                )
+                db.commit()
+            except Exception:
+                log.exception("Failed to renew the lease of %s", job.name)
+            finally:
+                db.close()
+
+    def _run_if_due(self, job: ScheduledJob) -> None:
+        db = self.session_factory()
+        try:
+            if not self._acquire(db, job, datetime.now()):
+                return
+        except Exception:
+            log.exception("Failed to acquire scheduled job %s", job.name)
+            db.close()
+            return
+        db.close()
+
+        request_id.set(f"sched-{job.name}")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done), name=f"lease-{job.name}", daemon=True)
+        heartbeat.start()
+        started = time.perf_counter()
+        status, error = "ok", None
+        log.info("Scheduled job %s started", job.name)
+        try:
+            job.func()
+        except Exception as exc:
+            status, error = "error", str(exc)
+            log.exception("Scheduled job %s failed", job.name)
+        finally:
+            done.set()
+        duration = time.perf_counter() - started
+        log.info("Scheduled job %s finished", job.name, extra={"status": status, "duration_seconds": duration})
+
+        db = self.session_factory()
+        try:
+            now = datetime.now()
+            db.execute(
+                update(JobLock)
+                .where(JobLock.name == job.name, JobLock.owner == self.owner)
+                .values(
+                    owner=None,
+                    lease_until=None,
+                    next_run_at=job.next_run(now),
+                    last_finished_at=now,
+                    last_duration_seconds=duration,
+                    last_status=status,
+                    last_error=error[:2000] if error else None,
+                )
+            )
+            db.commit()
+        except Exception:
+            log.exception("Failed to record the run of %s", job.name)
+        finally:
+            db.close()
+
+    def status(self, db: Session) -> List[Dict[str, Any]]:
+        rows = {row.name: row for row in db.query(JobLock).filter(JobLock.name.in_(list(self.jobs)))}
+        result = []
+        for name, job in self.jobs.items():
+            row = rows.get(name)
+            entry = {"name": name, **job.describe()}
+            if row is not None:
+                entry.update(
+                    running=row.lease_until is not None and row.lease_until > datetime.now(),
+                    owner=row.owner,
+                    next_run_at=row.next_run_at,
+                    last_started_at=row.last_started_at,
+                    last_finished_at=row.last_finished_at,
+                    last_duration_seconds=row.last_duration_seconds,
+                    last_status=row.last_status,
+                    last_error=row.last_error,
+                )
+            result.append(entry)
+        return result
@@ -0,0 +1,145 @@
+"""Atomic per-spot decisions for ticket ingest.
+
+Two cameras reporting the same car at the same moment used to race in
+``create_ticket``: both read "no ticket yet" and both inserted one. Every
+decision now runs while holding the spot's ``SpotState`` row lock
+(``SELECT ... FOR UPDATE``), so events for one spot are serialized across
+threads and server processes. Different spots do not block each other.
+
+The common "exit update" is tried first as a single guarded ``UPDATE``
+that only matches while the hinted ticket is still the spot's latest one.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from models import SpotState, Ticket
+
+NULL_KEY = -1
+
+
+def _key(value: Optional[int]) -> int:
+    return NULL_KEY if value is None else value
+
+
+class LockedSpot(NamedTuple):
+    state: SpotState
+    latest: Optional[Ticket]
+    last: Optional[Ticket]
+
+
+def update_if_latest(
+    db: Session,
+    ticket_id: int,
+    access_point_id: Optional[int],
+    spot_number: Optional[int],
+    number: Optional[str],
+    day_end: datetime,
+    values: Dict[str, Any],
+) -> bool:
+    """Apply *values* to *ticket_id* if it is still the spot's latest ticket.
+
+    Runs as one ``UPDATE`` statement whose ``WHERE`` clause re-checks the
+    spot pointer, plate number and day, so it is safe against concurrent
+    writers. Returns True if the ticket was updated. Does not commit.
+    """
+
+    pointer = (
+        select(SpotState.latest_ticket_id)
+        .where(
+            SpotState.access_point_id == _key(access_point_id),
+            SpotState.spot_number == _key(spot_number),
+        )
+        .scalar_subquery()
+    )
+    statement = (
+        update(Ticket)
+        .where(
+            Ticket.id == ticket_id,
+            Ticket.id == pointer,
+            Ticket.number == number,
+            Ticket.entry_time < day_end,
+        )
+        # Always set something so the statement is valid without new values.
+        .values({"exit_time": Ticket.exit_time, **values})
+        .execution_options(synchronize_session=False)
+    )
+    return db.execute(statement).rowcount == 1
+
+
+def _insert_ignore(db: Session, access_point_id: int, spot_number: int) -> None:
+    dialect = db.get_bind().dialect.name
+    values = {"access_point_id": access_point_id, "spot_number": spot_number}
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        statement = insert(SpotState).values(**values).prefix_with("IGNORE")
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+
+        statement = insert(SpotState).values(**values).on_conflict_do_nothing()
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+        statement = insert(SpotState).values(**values).on_conflict_do_nothing()
+    db.execute(statement)
+
+
+def _query_latest(db: Session, access_point_id: Optional[int], spot_number: Optional[int]) -> Optional[Ticket]:
+    return (
+        db.query(Ticket)
+        .filter(Ticket.access_point_id == access_point_id, Ticket.spot_number == spot_number)
+        .order_by(Ticket.entry_time.desc(), Ticket.id.desc())
+        .first()
+    )
+
+
+def _query_last(db: Session, access_point_id: Optional[int], spot_number: Optional[int]) -> Optional[Ticket]:
+    return (
+        db.query(Ticket)
+        .filter(Ticket.access_point_id == access_point_id, Ticket.spot_number == spot_number)
+        .order_by(Ticket.id.desc())
+        .first()
+    )
+
+
+def lock_spot(db: Session, access_point_id: Optional[int], spot_number: Optional[int]) -> LockedSpot:
+    """Lock the spot's ``SpotState`` row until the transaction ends.
+
+    The row is created on first use. Pointers to tickets that have since
+    been submitted, cancelled or merged are recomputed from ``Ticket``.
+    """
+
+    key = {"access_point_id": _key(access_point_id), "spot_number": _key(spot_number)}
+    locked = select(SpotState).filter_by(**key).with_for_update()
+    state = db.execute(locked).scalar_one_or_none()
+    if state is None:
+        _insert_ignore(db, **key)
+        state = db.execute(locked).scalar_one()
+
+    latest = db.get(Ticket, state.latest_ticket_id) if state.latest_ticket_id else None
+    last = db.get(Ticket, state.last_ticket_id) if state.last_ticket_id else None
+    if latest is None or last is None:
+        latest = _query_latest(db, access_point_id, spot_number)
+        last = _query_last(db, access_point_id, spot_number)
+        _point(state, latest, last)
+    return LockedSpot(state, latest, last)
+
+
+def _point(state: SpotState, latest: Optional[Ticket], last: Optional[Ticket]) -> None:
+    state.latest_ticket_id = latest.id if latest else None
+    state.latest_entry_time = latest.entry_time if latest else None
+    state.last_ticket_id = last.id if last else None
+
+
+def record_created(spot: LockedSpot, ticket: Ticket) -> LockedSpot:
+    """Point the locked spot at a newly created (and flushed) *ticket*."""
+
+    latest = spot.latest
+    if latest is None or (ticket.entry_time is not None and ticket.entry_time >= latest.entry_time):
+        latest = ticket
+    _point(spot.state, latest, ticket)
+    return LockedSpot(spot.state, latest, ticket)
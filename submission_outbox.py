@@ -0,0 +1,403 @@
+"""Durable outbox of ticket submissions and the workers that drain it.
+
+``POST /submit/{id}`` only inserts a :class:`~models.SubmissionJob` row, so
+a pending submission survives a restart. Workers claim due jobs by taking a
+lease (``lease_owner``/``lease_until``) with a conditional ``UPDATE``; a job
+whose worker died becomes claimable again once its lease expires. Any number
+of worker threads, in any number of processes, can share the table.
+
+Each job runs three steps, each committed on its own:
+
+``park_in``
+    Skipped when the ticket already has a ``trip_p_id`` from an earlier
+    attempt. Otherwise the trip id returned by Parkonic is stored on the
+    ticket and the job together.
+``park_out``
+    Once Parkonic answers, the answer is stored and the job advances to
+    ``move``, so a retry never sends the park-out again.
+``move``
+    The ticket is moved to ``SubmittedTicket`` and the job is marked
+    ``done`` in the same transaction.
+
+A failed step is retried with exponential backoff, up to
+``SUBMISSION_MAX_ATTEMPTS`` times, before the job is marked ``failed``. The
+HTTP calls are made outside any database transaction. If a worker dies
+between a successful call and its commit, the retry repeats that call.
+Jobs are started at most ``SUBMIT_RATE_LIMIT`` times per second per process.
+
+Every submission, single or bulk, goes through this table, so a ticket has
+at most one job and one worker calling Parkonic for it. The job keeps the
+request id of the request that queued it, and the worker logs under that id.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from logging_config import get_logger, request_id
+from models import SubmissionJob, Ticket
+
+SUBMISSION_WORKERS = int(os.environ.get("SUBMISSION_WORKERS", "4"))
+SUBMISSION_LEASE_SECONDS = float(os.environ.get("SUBMISSION_LEASE_SECONDS", "300"))
+SUBMISSION_POLL_SECONDS = float(os.environ.get("SUBMISSION_POLL_SECONDS", "2"))
+SUBMISSION_MAX_ATTEMPTS = int(os.environ.get("SUBMISSION_MAX_ATTEMPTS", "8"))
+SUBMISSION_BACKOFF_SECONDS = float(os.environ.get("SUBMISSION_BACKOFF_SECONDS", "30"))
+SUBMISSION_BACKOFF_MAX_SECONDS = float(os.environ.get("SUBMISSION_BACKOFF_MAX_SECONDS", "3600"))
+# Maximum number of submissions started per second (0 disables the limit).
+# Each submission makes a park-in and a park-out call.
+SUBMIT_RATE_LIMIT = float(os.environ.get("SUBMIT_RATE_LIMIT", "5"))
+
+PARK_IN = "park_in"
+PARK_OUT = "park_out"
+MOVE = "move"
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+log = get_logger("submit")
+
+
+class RateLimiter:
+    """Token bucket shared by the submission threads."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None) -> None:
+        self.rate = rate
+        self.capacity = float(burst or max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SubmissionError(Exception):
+    """A step failed; the job is retried unless *permanent*."""
+
+    def __init__(self, message: str, permanent: bool = False) -> None:
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class SubmissionSteps(ABC):
+    """The Parkonic calls and ticket move of a submission, implemented in ``main``."""
+
+    @abstractmethod
+    def park_in(self, ticket: Ticket) -> Tuple[int, Any]:
+        """Call park-in and return ``(trip_id, response)``. Raises :class:`SubmissionError`."""
+
+    @abstractmethod
+    def park_out(self, ticket: Ticket, trip_id: int) -> Any:
+        """Call park-out and return the response. Raises :class:`SubmissionError`."""
+
+    @abstractmethod
+    def complete(self, db: Session, ticket: Ticket) -> int:
+        """Move *ticket* to the submitted table without committing; return its new id."""
+
+    def completed(self, ticket_id: int, spot: Tuple[Optional[int], Optional[int]]) -> None:
+        """Called after the move is committed."""
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    ticket_id: int
+    step: str
+    trip_id: Optional[int]
+    attempts: int
+    request_id: Optional[str]
+
+
+def job_to_dict(job: SubmissionJob) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "ticket_id": job.ticket_id,
+        "state": job.state,
+        "step": job.step,
+        "trip_id": job.trip_id,
+        "submitted_id": job.submitted_id,
+        "attempts": job.attempts,
+        "last_error": job.last_error,
+        "park_out_response": job.park_out_response,
+        "request_id": job.request_id,
+        "next_attempt_at": job.next_attempt_at,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+def enqueue(db: Session, ticket_id: int, origin: Optional[str] = None) -> SubmissionJob:
+    """Return the pending job of *ticket_id*, creating it or restarting a finished one.
+
+    A pending job is returned untouched, so a ticket already being worked is
+    not submitted twice. *origin* is the request id recorded on a new or
+    restarted job; it defaults to the current one. Does not commit.
+    """
+
+    now = datetime.utcnow()
+    origin = origin or request_id.get()
+    job = db.query(SubmissionJob).filter(SubmissionJob.ticket_id == ticket_id).first()
+    if job is None:
+        savepoint = db.begin_nested()
+        try:
+            job = SubmissionJob(
+                ticket_id=ticket_id, state=PENDING, step=PARK_IN, attempts=0, request_id=origin,
+                next_attempt_at=now, created_at=now, updated_at=now,
+            )
+            db.add(job)
+            savepoint.commit()
+            return job
+        except IntegrityError:
+            # Queued concurrently by another request.
+            savepoint.rollback()
+            job = db.query(SubmissionJob).filter(SubmissionJob.ticket_id == ticket_id).one()
+
+    if job.state != PENDING:
+        # A failed job is retried from the start; park-in is still skipped if a
+        # trip id was stored, and a park-out Parkonic already answered is not
+        # sent again. A done job means the ticket id was reused.
+        if job.state == DONE or job.step != MOVE:
+            job.step = PARK_IN
+            job.trip_id = None
+            job.park_out_response = None
+        job.state = PENDING
+        job.submitted_id = None
+        job.attempts = 0
+        job.last_error = None
+        job.next_attempt_at = now
+        job.lease_owner = None
+        job.lease_until = None
+        job.request_id = origin
+        job.updated_at = now
+    return job
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(SUBMISSION_BACKOFF_MAX_SECONDS, SUBMISSION_BACKOFF_SECONDS * 2 ** (attempts - 1)))
+
+
+class SubmissionWorkers:
+    """Pool of threads draining the outbox."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        steps: SubmissionSteps,
+        workers: int = SUBMISSION_WORKERS,
+        lease_seconds: float = SUBMISSION_LEASE_SECONDS,
+        poll_seconds: float = SUBMISSION_POLL_SECONDS,
+        max_attempts: int = SUBMISSION_MAX_ATTEMPTS,
+        rate_limit: float = SUBMIT_RATE_LIMIT,
+    ) -> None:
+        self.session_factory = session_factory
+        self.steps = steps
+        self.workers = workers
+        self.lease = timedelta(seconds=lease_seconds)
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.limiter = RateLimiter(rate_limit)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stopping.clear()
+        for index in range(self.workers):
+            owner = f"{uuid.uuid4().hex[:12]}-{index}"
+            thread = threading.Thread(target=self._loop, args=(owner,), name=f"submission-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Stop after the jobs in progress; unfinished ones are picked up after a restart."""
+
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self) -> None:
+        """Tell idle workers a job was queued."""
+        self._wakeup.set()
+
+    def _loop(self, owner: str) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = self.claim(owner)
+            except Exception:
+                log.exception("Failed to claim a submission job")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+                continue
+            self.limiter.acquire()
+            token = request_id.set(job.request_id or f"submission-{job.id}")
+            try:
+                self.run(job, owner)
+            finally:
+                request_id.reset(token)
+
+    def claim(self, owner: str) -> Optional[ClaimedJob]:
+        """Lease the oldest due job to *owner*."""
+
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            candidates = (
+                db.query(SubmissionJob.id)
+                .filter(
+                    SubmissionJob.state == PENDING,
+                    SubmissionJob.next_attempt_at <= now,
+                    or_(SubmissionJob.lease_until == None, SubmissionJob.lease_until < now),
+                )
+                .order_by(SubmissionJob.next_attempt_at, SubmissionJob.id)
+                .limit(self.workers * 2)
+                .all()
+            )
+            for (job_id,) in candidates:
+                # Another worker may take the same candidate; only one UPDATE matches.
+                taken = db.execute(
+                    update(SubmissionJob)
+                    .where(
+                        SubmissionJob.id == job_id,
+                        SubmissionJob.state == PENDING,
+                        or_(SubmissionJob.lease_until == None, SubmissionJob.lease_until < now),
+                    )
+                    .values(lease_owner=owner, lease_until=now + self.lease, updated_at=now)
+                ).rowcount
+                db.commit()
+                if taken:
+                    job = db.get(SubmissionJob, job_id)
+                    return ClaimedJob(job.id, job.ticket_id, job.step, job.trip_id, job.attempts, job.request_id)
+            return None
+        finally:
+            db.close()
+
+    def _owned(self, db: Session, job: ClaimedJob, owner: str) -> bool:
+        """Extend the lease, locking the job row until commit; False if it was lost."""
+
+        now = datetime.utcnow()
+        renewed = db.execute(
+            update(SubmissionJob)
+            .where(SubmissionJob.id == job.id, SubmissionJob.lease_owner == owner, SubmissionJob.state == PENDING)
+            .values(lease_until=now + self.lease, updated_at=now)
+        ).rowcount
+        if not renewed:
+            log.warning("Lost the lease of submission job %s", job.id, extra={"ticket_id": job.ticket_id})
+        return bool(renewed)
+
+    def _load_ticket(self, db: Session, ticket_id: int) -> Ticket:
+        ticket = db.get(Ticket, ticket_id)
+        if ticket is None:
+            raise SubmissionError("Ticket not found", permanent=True)
+        # Keep the loaded values but end the transaction before calling Parkonic.
+        db.expunge(ticket)
+        db.rollback()
+        return ticket
+
+    def run(self, job: ClaimedJob, owner: str) -> None:
+        """Run the remaining steps of a claimed job."""
+
+        db = self.session_factory()
+        try:
+            ticket = self._load_ticket(db, job.ticket_id)
+            trip_id = job.trip_id
+            step = job.step
+            if step == PARK_IN:
+                if ticket.trip_p_id:
+                    trip_id = ticket.trip_p_id
+                else:
+                    trip_id, _ = self.steps.park_in(ticket)
+                if not self._owned(db, job, owner):
+                    db.rollback()
+                    return
+                db.execute(
+                    update(Ticket).where(Ticket.id == ticket.id).values(trip_p_id=trip_id, status="submitted")
+                )
+                db.execute(
+                    update(SubmissionJob).where(SubmissionJob.id == job.id).values(step=PARK_OUT, trip_id=trip_id)
+                )
+                db.commit()
+                step = PARK_OUT
+
+            if step == PARK_OUT:
+                response = self.steps.park_out(ticket, trip_id)
+                if not self._owned(db, job, owner):
+                    db.rollback()
+                    return
+                db.execute(
+                    update(SubmissionJob)
+                    .where(SubmissionJob.id == job.id)
+                    .values(step=MOVE, park_out_response=json.dumps(response, default=str))
+                )
+                db.commit()
+
+            if not self._owned(db, job, owner):
+                db.rollback()
+                return
+            submitted_id = self.steps.complete(db, ticket)
+            db.execute(
+                update(SubmissionJob)
+                .where(SubmissionJob.id == job.id)
+                .values(state=DONE, submitted_id=submitted_id, lease_owner=None, lease_until=None, last_error=None)
+            )
+            db.commit()
+            self.steps.completed(ticket.id, (ticket.access_point_id, ticket.spot_number))
+            log.info("Ticket submitted", extra={"ticket_id": ticket.id, "submitted_id": submitted_id, "job_id": job.id})
+        except Exception as exc:
+            db.rollback()
+            self._failed(db, job, owner, exc)
+        finally:
+            db.close()
+
+    def _failed(self, db: Session, job: ClaimedJob, owner: str, exc: Exception) -> None:
+        attempts = job.attempts + 1
+        permanent = isinstance(exc, SubmissionError) and exc.permanent
+        give_up = permanent or attempts >= self.max_attempts
+        if isinstance(exc, SubmissionError):
+            log.warning("Submission of ticket %s failed: %s", job.ticket_id, exc, extra={"job_id": job.id})
+        else:
+            log.exception("Unexpected error submitting ticket %s", job.ticket_id, extra={"job_id": job.id})
+        now = datetime.utcnow()
+        try:
+            db.execute(
+                update(SubmissionJob)
+                .where(SubmissionJob.id == job.id, SubmissionJob.lease_owner == owner)
+                .values(
+                    state=FAILED if give_up else PENDING,
+                    attempts=attempts,
+                    last_error=str(exc)[:2000],
+                    next_attempt_at=now if give_up else now + _backoff(attempts),
+                    lease_owner=None,
+                    lease_until=None,
+                    updated_at=now,
+                )
+            )
+            db.commit()
+        except Exception:
+            # The lease runs out and another worker retries the job.
+            db.rollback()
+            log.exception("Failed to record the failure of submission job %s", job.id)
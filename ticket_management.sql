@@ -6,7 +6,7 @@ CREATE TABLE User (
 
 CREATE TABLE Ticket (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    token VARCHAR(255) NOT NULL UNIQUE,
+    token VARCHAR(255) NOT NULL,
     access_point_id INT,
     number VARCHAR(50),
     code VARCHAR(50),
@@ -17,14 +17,23 @@ CREATE TABLE Ticket (
     entry_pic_base64 LONGTEXT,
     car_pic LONGTEXT, -- to store base64 image
     exit_video_path VARCHAR(255),
+    video_status VARCHAR(20),
     spot_number INT,
     trip_p_id INT,
     ticket_key_id INT
 );
 
+-- token is indexed but not unique: several tickets may carry the same token
+-- (see /convert-video/{token}). Ingest is deduplicated per spot instead,
+-- under the SpotState row lock.
+CREATE INDEX ix_Ticket_token ON Ticket (token);
+CREATE INDEX ix_ticket_spot_entry ON Ticket (access_point_id, spot_number, entry_time);
+CREATE INDEX ix_ticket_spot_plate ON Ticket (access_point_id, spot_number, number, entry_time);
+CREATE INDEX ix_ticket_number ON Ticket (number);
+
 CREATE TABLE SubmittedTicket (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    token VARCHAR(255) NOT NULL UNIQUE,
+    token VARCHAR(255) NOT NULL,
     access_point_id INT,
     number VARCHAR(50),
     code VARCHAR(50),
@@ -35,14 +44,18 @@ CREATE TABLE SubmittedTicket (
     entry_pic_base64 LONGTEXT,
     car_pic LONGTEXT,
     exit_video_path VARCHAR(255),
+    video_status VARCHAR(20),
     spot_number INT,
     trip_p_id INT,
     ticket_key_id INT
 );
+CREATE INDEX ix_SubmittedTicket_token ON SubmittedTicket (token);
+CREATE INDEX ix_submitted_ticket_number ON SubmittedTicket (number);
+CREATE INDEX ix_submitted_ticket_entry ON SubmittedTicket (entry_time);
 
 CREATE TABLE CancelledTicket (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    token VARCHAR(255) NOT NULL UNIQUE,
+    token VARCHAR(255) NOT NULL,
     access_point_id INT,
     number VARCHAR(50),
     code VARCHAR(50),
@@ -53,7 +66,136 @@ CREATE TABLE CancelledTicket (
     entry_pic_base64 LONGTEXT,
     car_pic LONGTEXT,
     exit_video_path VARCHAR(255),
+    video_status VARCHAR(20),
+    spot_number INT,
+    trip_p_id INT,
+    ticket_key_id INT
+);
+CREATE INDEX ix_CancelledTicket_token ON CancelledTicket (token);
+CREATE INDEX ix_cancelled_ticket_number ON CancelledTicket (number);
+CREATE INDEX ix_cancelled_ticket_entry ON CancelledTicket (entry_time);
+
+-- Old rows moved by archiver.py; ids are kept from the live tables.
+CREATE TABLE SubmittedTicketArchive (
+    id INT NOT NULL PRIMARY KEY,
+    token VARCHAR(255),
+    access_point_id INT,
+    number VARCHAR(50),
+    code VARCHAR(50),
+    city VARCHAR(100),
+    status VARCHAR(50),
+    entry_time DATETIME NOT NULL,
+    exit_time DATETIME,
+    entry_pic_base64 LONGTEXT,
+    car_pic LONGTEXT,
+    exit_video_path VARCHAR(255),
+    video_status VARCHAR(20),
     spot_number INT,
     trip_p_id INT,
     ticket_key_id INT
 );
+CREATE INDEX ix_submitted_ticket_archive_number ON SubmittedTicketArchive (number);
+CREATE INDEX ix_submitted_ticket_archive_entry ON SubmittedTicketArchive (entry_time);
+
+CREATE TABLE CancelledTicketArchive (
+    id INT NOT NULL PRIMARY KEY,
+    token VARCHAR(255),
+    access_point_id INT,
+    number VARCHAR(50),
+    code VARCHAR(50),
+    city VARCHAR(100),
+    status VARCHAR(50),
+    entry_time DATETIME NOT NULL,
+    exit_time DATETIME,
+    entry_pic_base64 LONGTEXT,
+    car_pic LONGTEXT,
+    exit_video_path VARCHAR(255),
+    video_status VARCHAR(20),
+    spot_number INT,
+    trip_p_id INT,
+    ticket_key_id INT
+);
+CREATE INDEX ix_cancelled_ticket_archive_number ON CancelledTicketArchive (number);
+CREATE INDEX ix_cancelled_ticket_archive_entry ON CancelledTicketArchive (entry_time);
+
+CREATE TABLE SpotState (
+    access_point_id INT NOT NULL,
+    spot_number INT NOT NULL,
+    latest_ticket_id INT,
+    latest_entry_time DATETIME,
+    last_ticket_id INT,
+    PRIMARY KEY (access_point_id, spot_number)
+);
+
+CREATE TABLE SubmissionJob (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    ticket_id INT NOT NULL UNIQUE,
+    state VARCHAR(20) NOT NULL DEFAULT 'pending',
+    step VARCHAR(20) NOT NULL DEFAULT 'park_in',
+    trip_id INT,
+    submitted_id INT,
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    park_out_response TEXT,
+    request_id VARCHAR(128),
+    lease_owner VARCHAR(64),
+    lease_until DATETIME,
+    next_attempt_at DATETIME NOT NULL,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE INDEX ix_submission_job_claim ON SubmissionJob (state, next_attempt_at);
+
+CREATE TABLE JobLock (
+    name VARCHAR(100) PRIMARY KEY,
+    owner VARCHAR(64),
+    lease_until DATETIME,
+    next_run_at DATETIME,
+    last_started_at DATETIME,
+    last_finished_at DATETIME,
+    last_duration_seconds DOUBLE,
+    last_status VARCHAR(20),
+    last_error TEXT
+);
+
+CREATE TABLE BackgroundJob (
+    id VARCHAR(32) PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    info MEDIUMTEXT,
+    result MEDIUMTEXT,
+    error TEXT,
+    created_at DOUBLE NOT NULL,
+    started_at DOUBLE,
+    finished_at DOUBLE
+);
+CREATE INDEX ix_BackgroundJob_finished_at ON BackgroundJob (finished_at);
+
+-- Databases created before the video_status column existed need:
+--   ALTER TABLE Ticket ADD COLUMN video_status VARCHAR(20);
+--   ALTER TABLE SubmittedTicket ADD COLUMN video_status VARCHAR(20);
+--   ALTER TABLE CancelledTicket ADD COLUMN video_status VARCHAR(20);
+--   ALTER TABLE SubmittedTicketArchive ADD COLUMN video_status VARCHAR(20);
+--   ALTER TABLE CancelledTicketArchive ADD COLUMN video_status VARCHAR(20);
+
+-- Databases created before SubmissionJob.request_id existed need:
+--   ALTER TABLE SubmissionJob ADD COLUMN request_id VARCHAR(128);
+
+-- Databases created before SubmissionJob.park_out_response existed need:
+--   ALTER TABLE SubmissionJob ADD COLUMN park_out_response TEXT;
+
+-- Databases created when token was declared UNIQUE need (MySQL names the
+-- index after the column):
+--   ALTER TABLE Ticket DROP INDEX token, ADD INDEX ix_Ticket_token (token);
+--   ALTER TABLE SubmittedTicket DROP INDEX token, ADD INDEX ix_SubmittedTicket_token (token);
+--   ALTER TABLE CancelledTicket DROP INDEX token, ADD INDEX ix_CancelledTicket_token (token);
+
+-- Databases created before the ticket lookup indexes existed need (create_all
+-- only adds indexes to tables it creates):
+--   CREATE INDEX ix_ticket_spot_entry ON Ticket (access_point_id, spot_number, entry_time);
+--   CREATE INDEX ix_ticket_spot_plate ON Ticket (access_point_id, spot_number, number, entry_time);
+--   CREATE INDEX ix_ticket_number ON Ticket (number);
+--   CREATE INDEX ix_submitted_ticket_number ON SubmittedTicket (number);
+--   CREATE INDEX ix_submitted_ticket_entry ON SubmittedTicket (entry_time);
+--   CREATE INDEX ix_cancelled_ticket_number ON CancelledTicket (number);
+--   CREATE INDEX ix_cancelled_ticket_entry ON CancelledTicket (entry_time);
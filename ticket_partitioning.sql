@@ -0,0 +1,110 @@
+-- Optional monthly partitioning of the archive tables by entry_time (MySQL 8).
+--
+-- Queries with an entry_time range then only touch the matching partitions,
+-- and a whole month can be dropped with ALTER TABLE ... DROP PARTITION
+-- instead of a large DELETE. MySQL requires the partitioning column in every
+-- unique key, so the primary key becomes (id, entry_time); ids stay unique
+-- because archiver.py copies them from the live tables.
+--
+-- Run once after ticket_management.sql, adjusting the first month. Monthly
+-- partitions are listed up to December 2027. After that, every archiver run
+-- (archiver.extend_partitions) splits the catch-all pmax partition so that
+-- partitions exist ARCHIVE_PARTITION_MONTHS_AHEAD months (default 3) ahead.
+-- A month that is already missing is added on the next run, e.g.:
+--
+--   ALTER TABLE SubmittedTicketArchive REORGANIZE PARTITION pmax INTO (
+--       PARTITION p202801 VALUES LESS THAN (TO_DAYS('2028-02-01')),
+--       PARTITION pmax VALUES LESS THAN MAXVALUE
+--   );
+
+ALTER TABLE SubmittedTicketArchive
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (id, entry_time);
+
+ALTER TABLE SubmittedTicketArchive
+    PARTITION BY RANGE (TO_DAYS(entry_time)) (
+        PARTITION p_old VALUES LESS THAN (TO_DAYS('2025-01-01')),
+        PARTITION p202501 VALUES LESS THAN (TO_DAYS('2025-02-01')),
+        PARTITION p202502 VALUES LESS THAN (TO_DAYS('2025-03-01')),
+        PARTITION p202503 VALUES LESS THAN (TO_DAYS('2025-04-01')),
+        PARTITION p202504 VALUES LESS THAN (TO_DAYS('2025-05-01')),
+        PARTITION p202505 VALUES LESS THAN (TO_DAYS('2025-06-01')),
+        PARTITION p202506 VALUES LESS THAN (TO_DAYS('2025-07-01')),
+        PARTITION p202507 VALUES LESS THAN (TO_DAYS('2025-08-01')),
+        PARTITION p202508 VALUES LESS THAN (TO_DAYS('2025-09-01')),
+        PARTITION p202509 VALUES LESS THAN (TO_DAYS('2025-10-01')),
+        PARTITION p202510 VALUES LESS THAN (TO_DAYS('2025-11-01')),
+        PARTITION p202511 VALUES LESS THAN (TO_DAYS('2025-12-01')),
+        PARTITION p202512 VALUES LESS THAN (TO_DAYS('2026-01-01')),
+        PARTITION p202601 VALUES LESS THAN (TO_DAYS('2026-02-01')),
+        PARTITION p202602 VALUES LESS THAN (TO_DAYS('2026-03-01')),
+        PARTITION p202603 VALUES LESS THAN (TO_DAYS('2026-04-01')),
+        PARTITION p202604 VALUES LESS THAN (TO_DAYS('2026-05-01')),
+        PARTITION p202605 VALUES LESS THAN (TO_DAYS('2026-06-01')),
+        PARTITION p202606 VALUES LESS THAN (TO_DAYS('2026-07-01')),
+        PARTITION p202607 VALUES LESS THAN (TO_DAYS('2026-08-01')),
+        PARTITION p202608 VALUES LESS THAN (TO_DAYS('2026-09-01')),
+        PARTITION p202609 VALUES LESS THAN (TO_DAYS('2026-10-01')),
+        PARTITION p202610 VALUES LESS THAN (TO_DAYS('2026-11-01')),
+        PARTITION p202611 VALUES LESS THAN (TO_DAYS('2026-12-01')),
+        PARTITION p202612 VALUES LESS THAN (TO_DAYS('2027-01-01')),
+        PARTITION p202701 VALUES LESS THAN (TO_DAYS('2027-02-01')),
+        PARTITION p202702 VALUES LESS THAN (TO_DAYS('2027-03-01')),
+        PARTITION p202703 VALUES LESS THAN (TO_DAYS('2027-04-01')),
+        PARTITION p202704 VALUES LESS THAN (TO_DAYS('2027-05-01')),
+        PARTITION p202705 VALUES LESS THAN (TO_DAYS('2027-06-01')),
+        PARTITION p202706 VALUES LESS THAN (TO_DAYS('2027-07-01')),
+        PARTITION p202707 VALUES LESS THAN (TO_DAYS('2027-08-01')),
+        PARTITION p202708 VALUES LESS THAN (TO_DAYS('2027-09-01')),
+        PARTITION p202709 VALUES LESS THAN (TO_DAYS('2027-10-01')),
+        PARTITION p202710 VALUES LESS THAN (TO_DAYS('2027-11-01')),
+        PARTITION p202711 VALUES LESS THAN (TO_DAYS('2027-12-01')),
+        PARTITION p202712 VALUES LESS THAN (TO_DAYS('2028-01-01')),
+        PARTITION pmax VALUES LESS THAN MAXVALUE
+    );
+
+ALTER TABLE CancelledTicketArchive
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (id, entry_time);
+
+ALTER TABLE CancelledTicketArchive
+    PARTITION BY RANGE (TO_DAYS(entry_time)) (
+        PARTITION p_old VALUES LESS THAN (TO_DAYS('2025-01-01')),
+        PARTITION p202501 VALUES LESS THAN (TO_DAYS('2025-02-01')),
+        PARTITION p202502 VALUES LESS THAN (TO_DAYS('2025-03-01')),
+        PARTITION p202503 VALUES LESS THAN (TO_DAYS('2025-04-01')),
+        PARTITION p202504 VALUES LESS THAN (TO_DAYS('2025-05-01')),
+        PARTITION p202505 VALUES LESS THAN (TO_DAYS('2025-06-01')),
+        PARTITION p202506 VALUES LESS THAN (TO_DAYS('2025-07-01')),
+        PARTITION p202507 VALUES LESS THAN (TO_DAYS('2025-08-01')),
+        PARTITION p202508 VALUES LESS THAN (TO_DAYS('2025-09-01')),
+        PARTITION p202509 VALUES LESS THAN (TO_DAYS('2025-10-01')),
+        PARTITION p202510 VALUES LESS THAN (TO_DAYS('2025-11-01')),
+        PARTITION p202511 VALUES LESS THAN (TO_DAYS('2025-12-01')),
+        PARTITION p202512 VALUES LESS THAN (TO_DAYS('2026-01-01')),
+        PARTITION p202601 VALUES LESS THAN (TO_DAYS('2026-02-01')),
+        PARTITION p202602 VALUES LESS THAN (TO_DAYS('2026-03-01')),
+        PARTITION p202603 VALUES LESS THAN (TO_DAYS('2026-04-01')),
+        PARTITION p202604 VALUES LESS THAN (TO_DAYS('2026-05-01')),
+        PARTITION p202605 VALUES LESS THAN (TO_DAYS('2026-06-01')),
+        PARTITION p202606 VALUES LESS THAN (TO_DAYS('2026-07-01')),
+        PARTITION p202607 VALUES LESS THAN (TO_DAYS('2026-08-01')),
+        PARTITION p202608 VALUES LESS THAN (TO_DAYS('2026-09-01')),
+        PARTITION p202609 VALUES LESS THAN (TO_DAYS('2026-10-01')),
+        PARTITION p202610 VALUES LESS THAN (TO_DAYS('2026-11-01')),
+        PARTITION p202611 VALUES LESS THAN (TO_DAYS('2026-12-01')),
+        PARTITION p202612 VALUES LESS THAN (TO_DAYS('2027-01-01')),
+        PARTITION p202701 VALUES LESS THAN (TO_DAYS('2027-02-01')),
+        PARTITION p202702 VALUES LESS THAN (TO_DAYS('2027-03-01')),
+        PARTITION p202703 VALUES LESS THAN (TO_DAYS('2027-04-01')),
+        PARTITION p202704 VALUES LESS THAN (TO_DAYS('2027-05-01')),
+        PARTITION p202705 VALUES LESS THAN (TO_DAYS('2027-06-01')),
+        PARTITION p202706 VALUES LESS THAN (TO_DAYS('2027-07-01')),
+        PARTITION p202707 VALUES LESS THAN (TO_DAYS('2027-08-01')),
+        PARTITION p202708 VALUES LESS THAN (TO_DAYS('2027-09-01')),
+        PARTITION p202709 VALUES LESS THAN (TO_DAYS('2027-10-01')),
+        PARTITION p202710 VALUES LESS THAN (TO_DAYS('2027-11-01')),
+        PARTITION p202711 VALUES LESS THAN (TO_DAYS('2027-12-01')),
+        PARTITION p202712 VALUES LESS THAN (TO_DAYS('2028-01-01')),
+        PARTITION pmax VALUES LESS THAN MAXVALUE
+    );
@@ -0,0 +1,104 @@
+"""Move tickets between the Ticket, SubmittedTicket and CancelledTicket tables.
+
+Rows are copied with a server-side ``INSERT ... SELECT`` and removed with a
+``DELETE`` in the caller's transaction, so moving many tickets costs a few
+statements instead of a load, copy and delete per ticket. Nothing here
+commits; callers decide the transaction boundary.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import delete, insert, literal, select
+from sqlalchemy.orm import Session
+
+from models import CancelledTicket, Ticket
+
+# All three tables share the same columns; ``id`` is assigned by the target.
+COLUMNS = [c.name for c in Ticket.__table__.columns if c.name != "id"]
+CHUNK_SIZE = 1000
+
+
+def _chunks(ids: Sequence[int], size: int = CHUNK_SIZE) -> Iterable[List[int]]:
+    for start in range(0, len(ids), size):
+        yield list(ids[start:start + size])
+
+
+def _insert_select(ids: List[int], source, target, overrides: Dict[str, Any], keep_ids: bool = False):
+    table = source.__table__
+    columns = ["id"] + COLUMNS if keep_ids else COLUMNS
+    selected = (
+        literal(overrides[name], type_=table.c[name].type).label(name) if name in overrides else table.c[name]
+        for name in columns
+    )
+    return insert(target).from_select(columns, select(*selected).where(table.c.id.in_(ids)).order_by(table.c.id))
+
+
+def lock_tickets(db: Session, ids: Iterable[int], source=Ticket) -> list:
+    """Lock and return ``(id, access_point_id, spot_number)`` rows of *ids* that exist."""
+
+    ids = sorted(set(ids))
+    rows = []
+    for chunk in _chunks(ids):
+        rows.extend(
+            db.query(source.id, source.access_point_id, source.spot_number)
+            .filter(source.id.in_(chunk))
+            .order_by(source.id)
+            .with_for_update()
+            .all()
+        )
+    return rows
+
+
+def move_tickets(
+    db: Session,
+    ids: Iterable[int],
+    source,
+    target,
+    overrides: Optional[Dict[str, Any]] = None,
+    keep_ids: bool = False,
+) -> int:
+    """Move the rows *ids* from *source* to *target*.
+
+    ``overrides`` maps column names to constant values written instead of the
+    source values, e.g. ``{"status": "cancelled"}``. With ``keep_ids`` the
+    rows keep their ids, as in the archive tables. Returns the number of
+    rows removed from *source*.
+    """
+
+    moved = 0
+    for chunk in _chunks(sorted(set(ids))):
+        db.execute(_insert_select(chunk, source, target, overrides or {}, keep_ids))
+        moved += db.execute(delete(source).where(source.id.in_(chunk))).rowcount
+    return moved
+
+
+def move_ticket(
+    db: Session,
+    ticket_id: int,
+    source,
+    target,
+    overrides: Optional[Dict[str, Any]] = None,
+) -> Optional[int]:
+    """Move a single row and return its new id in *target*, or None if missing.
+
+    The id comes from ``RETURNING`` where the database supports it
+    (PostgreSQL, SQLite, MariaDB) and from the cursor's last row id on MySQL.
+    """
+
+    statement = _insert_select([ticket_id], source, target, overrides or {})
+    if db.get_bind().dialect.insert_returning:
+        new_id = db.execute(statement.returning(target.id)).scalar()
+        if new_id is None:
+            return None
+    else:
+        result = db.execute(statement)
+        if not result.rowcount:
+            return None
+        new_id = result.lastrowid
+    db.execute(delete(source).where(source.id == ticket_id))
+    return new_id
+
+
+def cancel_tickets(db: Session, ids: Iterable[int]) -> int:
+    return move_tickets(db, ids, Ticket, CancelledTicket, {"status": "cancelled"})
+
@@ -0,0 +1,173 @@
+"""Opt-in recorder of incoming camera events, for replay with ``benchmarks/replay.py``.
+
+Set ``TRAFFIC_CAPTURE_PATH`` to append every ``POST /ticket``,
+``/ticket/multipart`` and ``/tickets/batch`` request to a file next to that
+path, one JSON object per line (gzip-compressed when the name ends in
+``.gz``). The process id goes before the extension, so each uvicorn worker
+writes its own file: ``capture.jsonl.gz`` becomes ``capture.<pid>.jsonl.gz``.
+Requests are only queued on the request path; a background thread encodes
+and writes them. When the queue is full, records are dropped rather than
+slowing ingest.
+
+``TRAFFIC_CAPTURE_IMAGES`` decides what happens to the base64 images:
+
+``ref`` (default)
+    Each distinct image is written once to ``<file>.images/<sha256>.jpg``;
+    the record holds ``{"sha256": ..., "bytes": ...}``.
+``strip``
+    Only the decoded size is kept (``{"bytes": ...}``).
+``keep``
+    The base64 string is stored inline.
+
+Multipart uploads are recorded with the sizes of their image parts only.
+"""
+
+import base64
+import binascii
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from logging_config import get_logger
+
+TRAFFIC_CAPTURE_PATH = os.environ.get("TRAFFIC_CAPTURE_PATH", "")
+TRAFFIC_CAPTURE_IMAGES = os.environ.get("TRAFFIC_CAPTURE_IMAGES", "ref").lower()
+TRAFFIC_CAPTURE_QUEUE = int(os.environ.get("TRAFFIC_CAPTURE_QUEUE", "10000"))
+IMAGE_FIELDS = ("entry_pic_base64", "car_pic_base64")
+
+log = get_logger("capture")
+
+
+def open_log(path: str, mode: str):
+    """Open a capture log for text reading or appending, gunzipping ``.gz`` files."""
+
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def worker_path(path: str, pid: Optional[int] = None) -> str:
+    """*path* with the process id inserted before its extension."""
+
+    directory, name = os.path.split(path)
+    stem, dot, suffix = name.partition(".")
+    pid = os.getpid() if pid is None else pid
+    return os.path.join(directory, f"{stem}.{pid}{dot}{suffix}")
+
+
+class TrafficRecorder:
+    def __init__(self, path: str = "", images: str = "ref", max_queue: int = 10000) -> None:
+        if images not in ("ref", "strip", "keep"):
+            raise ValueError(f"Unknown TRAFFIC_CAPTURE_IMAGES mode: {images}")
+        self.path = path
+        self.images = images
+        # Set by the process that starts writing; see ``worker_path``.
+        self.file_path: Optional[str] = None
+        self.image_dir: Optional[str] = None
+        self.recorded = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(max_queue)
+        self._seen_images = set()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def record(self, endpoint: str, tickets: Any, **extra: Any) -> None:
+        """Queue one request. *tickets* is a ``TicketCreate`` or a list of them."""
+
+        if not self.enabled:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.time(), endpoint, tickets, extra))
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self.file_path = worker_path(self.path)
+                self.image_dir = f"{self.file_path}.images"
+                self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+                self._thread.start()
+
+    def _image(self, value: Optional[str]) -> Any:
+        if value is None or self.images == "keep":
+            return value
+        encoded = value.split(",", 1)[1] if value.startswith("data:image") else value
+        try:
+            data = base64.b64decode(encoded)
+        except (binascii.Error, ValueError):
+            return {"invalid": True, "bytes": len(value)}
+        if self.images == "strip":
+            return {"bytes": len(data)}
+
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self._seen_images:
+            path = os.path.join(self.image_dir, f"{digest}.jpg")
+            if not os.path.exists(path):
+                os.makedirs(self.image_dir, exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(data)
+            self._seen_images.add(digest)
+        return {"sha256": digest, "bytes": len(data)}
+
+    def _ticket(self, ticket: Any) -> Dict[str, Any]:
+        data = ticket.model_dump(mode="json", exclude_none=True)
+        for field in IMAGE_FIELDS:
+            if field in data:
+                data[field] = self._image(data[field])
+        return data
+
+    def _encode(self, received: float, endpoint: str, tickets: Any, extra: Dict[str, Any]) -> str:
+        entry: Dict[str, Any] = {"ts": round(received, 6), "endpoint": endpoint}
+        if isinstance(tickets, list):
+            entry["tickets"] = [self._ticket(ticket) for ticket in tickets]
+        else:
+            entry["ticket"] = self._ticket(tickets)
+        entry.update(extra)
+        return json.dumps(entry, separators=(",", ":"))
+
+    def _run(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        os.makedirs(directory, exist_ok=True)
+        log.info("Capturing traffic to %s", self.file_path)
+        with open_log(self.file_path, "a") as out:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                try:
+                    out.write(self._encode(*item) + "\n")
+                    self.recorded += 1
+                except Exception:
+                    log.exception("Failed to record %s request", item[1])
+                if self._queue.empty():
+                    out.flush()
+        log.info("Traffic capture closed", extra={"recorded": self.recorded, "dropped": self.dropped})
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Write the queued records and stop the writer thread."""
+
+        thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+        self._thread = None
+
+
+recorder = TrafficRecorder(TRAFFIC_CAPTURE_PATH, TRAFFIC_CAPTURE_IMAGES, TRAFFIC_CAPTURE_QUEUE)